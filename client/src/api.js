@@ -46,6 +46,7 @@ export const signup = async (name, email, password, role) => {
   }
 };
 
+// Queues the upload for analysis; resolves to { jobId, status, position, statusUrl }
 export const uploadAudio = async (formData) => {
   try {
     const response = await API.post("/upload/audio", formData, {
@@ -59,6 +60,16 @@ export const uploadAudio = async (formData) => {
   }
 };
 
+// Status of a queued upload; the report is included once status is "done"
+export const getUploadJob = async (jobId) => {
+  try {
+    const response = await API.get(`/upload/jobs/${jobId}`);
+    return response.data;
+  } catch (error) {
+    throw error;
+  }
+};
+
 export const getReports = async (url = "/reports/doctor") => {
   try {
     const response = await API.get(url);
@@ -1,5 +1,5 @@
 import React, { useState, useRef, useEffect } from "react";
-import { API, getPatients } from "../api";
+import { API, getPatients, getUploadJob } from "../api";
 import {
   Box, Typography, Paper, Button, Stack, LinearProgress, IconButton, Slider, Alert, CircularProgress, Card, CardContent, Grid,
   FormControl, InputLabel, Select, MenuItem
@@ -18,6 +18,7 @@ export default function Upload() {
   const [audioURL, setAudioURL] = useState(null);
   const [report, setReport] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [queuePosition, setQueuePosition] = useState(0);
   const [error, setError] = useState("");
   const [isRecording, setIsRecording] = useState(false);
   const [recordedBlob, setRecordedBlob] = useState(null);
@@ -288,18 +289,28 @@ export default function Upload() {
       }
 
       const token = localStorage.getItem("token");
+      const headers = { Authorization: `Bearer ${token}` };
       const res = await API.post("/upload/audio", formData, {
-        headers: {
-          "Content-Type": "multipart/form-data",
-          Authorization: `Bearer ${token}`,
-        },
+        headers: { ...headers, "Content-Type": "multipart/form-data" },
       });
-      setReport(res.data);
-      console.log('Report data received:', res.data);
+      // The server queues the analysis (202); poll the job until the report is ready
+      let job = res.data;
+      setQueuePosition(job.position || 0);
+      while (job.status !== "done") {
+        if (job.status === "failed") {
+          throw new Error(job.error || "Upload failed");
+        }
+        await new Promise((resolve) => setTimeout(resolve, job.status === "queued" ? 5000 : 2000));
+        job = await getUploadJob(res.data.jobId);
+        setQueuePosition(job.position || 0);
+      }
+      setReport(job.report);
+      console.log('Report data received:', job.report);
     } catch (err) {
-      setError(err.response?.data?.error || "Upload failed");
+      setError(err.response?.data?.error || err.message || "Upload failed");
     } finally {
       setLoading(false);
+      setQueuePosition(0);
     }
   };
 
@@ -540,7 +551,7 @@ export default function Upload() {
                 fontSize: '1.1rem',
               }}
             >
-              {loading ? 'Processing...' : 'Upload & Analyze'}
+              {loading ? (queuePosition ? `Queued (position ${queuePosition})...` : 'Processing...') : 'Upload & Analyze'}
             </Button>
           </Stack>
         </CardContent>
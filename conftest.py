@@ -0,0 +1,51 @@
+"""
+Shared fixtures for the root-level tests.
+
+Models are tiny and randomly initialised, so no test downloads weights; the
+tests check that the pipeline's fast paths give the same numbers as the plain
+ones, not what the numbers mean.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml"))
+
+import pytest
+
+EMOTION_LABELS = ["angry", "happy", "neutral", "sad"]
+
+
+@pytest.fixture(scope="session")
+def tiny_emotion_model():
+    """A (model, feature_extractor) pair shaped like the wav2vec2 emotion classifier."""
+    transformers = pytest.importorskip("transformers")
+    import torch
+
+    torch.manual_seed(0)
+    config = transformers.Wav2Vec2Config(
+        hidden_size=32, num_hidden_layers=1, num_attention_heads=2, intermediate_size=64,
+        conv_dim=(16, 16), conv_stride=(5, 2), conv_kernel=(10, 3), num_feat_extract_layers=2,
+        num_conv_pos_embeddings=16, num_conv_pos_embedding_groups=2, num_labels=len(EMOTION_LABELS),
+        id2label=dict(enumerate(EMOTION_LABELS)), label2id={label: i for i, label in enumerate(EMOTION_LABELS)},
+    )
+    model = transformers.Wav2Vec2ForSequenceClassification(config).eval()
+    feature_extractor = transformers.Wav2Vec2FeatureExtractor(
+        feature_size=1, sampling_rate=16000, padding_value=0.0, do_normalize=True, return_attention_mask=False,
+    )
+    return model, feature_extractor
+
+
+@pytest.fixture(scope="session")
+def small_whisper():
+    """A randomly initialised Whisper with the real vocabulary and one narrow layer each side."""
+    import torch
+    from whisper.model import ModelDimensions, Whisper
+
+    torch.manual_seed(0)
+    # Multilingual vocabulary, so language tokens exist
+    model = Whisper(ModelDimensions(n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+                                    n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2,
+                                    n_text_layer=1)).eval()
+    # Whisper leaves this to the checkpoint (torch.empty), which would decode from uninitialised memory
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.02)
+    return model
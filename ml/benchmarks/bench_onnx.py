@@ -0,0 +1,101 @@
+"""
+Check the ONNX Runtime emotion backend against PyTorch and compare latency.
+
+    python ml/benchmarks/bench_onnx.py [--models superb/wav2vec2-base-superb-er ...]
+        [--batch-sizes 1 8 16] [--seconds 1 3 10] [--tolerance 1e-3] [--threads N]
+
+For every model, batch size and window length, the same synthetic windows go
+through the PyTorch model and the exported ONNX graph. The report gives the
+largest absolute logit difference, how often the top label agrees, and the
+median latency of each backend. The script exits with status 1 if any logit
+differs by more than --tolerance, so it doubles as the parity test for the
+exported graphs.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# Make the ml directory importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import torch
+
+from benchmarks.synthetic import SAMPLE_RATE, speech_like
+from model import registry
+from model.emotion import prepare_inputs
+
+DEFAULT_MODELS = [registry.DEFAULT_EMOTION_MODEL, "superb/wav2vec2-base-superb-er"]
+
+
+def median_latency(fn, repeats):
+    fn()  # Warm-up (ONNX Runtime allocates on the first run of each shape)
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return float(np.median(times))
+
+
+def compare_model(name, batch_sizes, seconds_list, repeats):
+    torch_model, feature_extractor = registry.get_emotion_model(name, precision="fp32", backend="torch")
+    onnx_model, _ = registry.get_emotion_model(name, precision="fp32", backend="onnx")
+
+    rows = []
+    for seconds in seconds_list:
+        for batch_size in batch_sizes:
+            windows = [speech_like(seconds, seed=i, pitch=110 + 15 * i) for i in range(batch_size)]
+            inputs = feature_extractor(windows, sampling_rate=SAMPLE_RATE, return_tensors="pt", padding=True)
+
+            def run_torch():
+                with torch.inference_mode():
+                    return torch_model(**prepare_inputs(inputs, torch_model)).logits.float().numpy()
+
+            def run_onnx():
+                return onnx_model(**prepare_inputs(inputs, onnx_model)).logits.numpy()
+
+            torch_logits, onnx_logits = run_torch(), run_onnx()
+            torch_seconds = median_latency(run_torch, repeats)
+            onnx_seconds = median_latency(run_onnx, repeats)
+            rows.append({
+                "seconds": seconds,
+                "batchSize": batch_size,
+                "maxAbsDiff": float(np.abs(torch_logits - onnx_logits).max()),
+                "top1Agreement": float(np.mean(torch_logits.argmax(-1) == onnx_logits.argmax(-1))),
+                "torchMs": round(torch_seconds * 1000, 2),
+                "onnxMs": round(onnx_seconds * 1000, 2),
+                "speedup": round(torch_seconds / onnx_seconds, 2) if onnx_seconds else None,
+            })
+            print(json.dumps({"model": name, **rows[-1]}), file=sys.stderr)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--models", nargs="+", default=DEFAULT_MODELS)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 16])
+    parser.add_argument("--seconds", type=float, nargs="+", default=[1, 3, 10])
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="largest allowed logit difference")
+    parser.add_argument("--threads", type=int, help="intra-op threads for both backends")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+        os.environ["THERAVOX_ONNX_THREADS"] = str(args.threads)
+        from model import onnx_backend
+        onnx_backend.THREADS = args.threads
+
+    report = {name: compare_model(name, args.batch_sizes, args.seconds, args.repeats) for name in args.models}
+    print(json.dumps(report, indent=2))
+
+    failures = [(name, row) for name, rows in report.items() for row in rows if row["maxAbsDiff"] > args.tolerance]
+    for name, row in failures:
+        print(f"Parity failure: {name} {row['seconds']}s x{row['batchSize']}: "
+              f"max logit difference {row['maxAbsDiff']:.2e} > {args.tolerance:.0e}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    print("ONNX logits match PyTorch within tolerance", file=sys.stderr)
@@ -0,0 +1,90 @@
+"""
+Measure PDF report throughput in reports per second.
+
+    python ml/benchmarks/bench_pdf.py [--reports 200] [--workers 1 2 4] [--windows 120]
+
+Synthetic reports (a few paragraphs of transcript and an emotion timeline of
+--windows windows) are rendered four ways: one generate_pdf() call per report,
+generate_pdfs() to files, generate_pdfs() to in-memory bytes, and to bytes
+with a distinct timeline per report, so every chart is drawn (the other runs
+share a few timelines and mostly hit the chart cache).
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Make the ml directory importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+# Charts go to a scratch cache (the pool's spawned processes read this too)
+WORKDIR = tempfile.TemporaryDirectory()
+os.environ["THERAVOX_CACHE_DIR"] = WORKDIR.name
+
+from model.utils import pdf_generator
+
+LABELS = ["angry", "calm", "happy", "neutral", "sad"]
+WORDS = ("I have been feeling a little better this week but the evenings are still hard and "
+         "sleep comes late most nights when work has been busy").split()
+
+
+def make_report(i, windows, timeline_seed):
+    rng = np.random.default_rng(i)
+    timeline_rng = np.random.default_rng(timeline_seed)
+    timeline = []
+    for w in range(windows):
+        scores = timeline_rng.dirichlet(np.ones(len(LABELS))) * 100
+        timeline.append({
+            "start": w * 2.5, "end": w * 2.5 + 5,
+            "scores": {label: round(float(score), 1) for label, score in zip(LABELS, scores)},
+        })
+    return {
+        "patientName": f"Patient {i}", "patientAge": str(20 + i % 60), "patientGender": "N/A",
+        "transcript": " ".join(rng.choice(WORDS, 400)),
+        "emotions": ["neutral (41.2%)", "calm (22.5%)"],
+        "emotionTimeline": timeline,
+        "pitch": 142.3, "silence": 12.5, "pace": 128.0,
+        "summary": " ".join(rng.choice(WORDS, 40)),
+    }
+
+
+def timed(fn, count):
+    started = time.perf_counter()
+    results = fn()
+    elapsed = time.perf_counter() - started
+    failed = sum(result in (None, False) for result in results)
+    return {"seconds": round(elapsed, 3), "reportsPerSecond": round(count / elapsed, 1), "failed": failed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--reports", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1])
+    parser.add_argument("--windows", type=int, default=120, help="emotion timeline windows per report")
+    parser.add_argument("--charts", type=int, default=4, help="distinct timelines in the cached runs")
+    args = parser.parse_args()
+
+    shared = [make_report(i, args.windows, i % args.charts) for i in range(args.reports)]
+    report = {"reports": args.reports, "windows": args.windows, "runs": {}}
+    with WORKDIR as workdir:
+        paths = [os.path.join(workdir, f"report-{i}.pdf") for i in range(args.reports)]
+        pdf_generator.generate_pdf(shared[0], paths[0])  # Warm-up: imports and the first chart
+
+        report["runs"]["generate_pdf"] = timed(
+            lambda: [pdf_generator.generate_pdf(r, p) for r, p in zip(shared, paths)], args.reports)
+        for workers in sorted(set(args.workers)):
+            distinct = [make_report(i, args.windows, 10_000 * workers + i) for i in range(args.reports)]
+            report["runs"][f"files/{workers}"] = timed(
+                lambda: pdf_generator.generate_pdfs(shared, paths, workers=workers), args.reports)
+            report["runs"][f"bytes/{workers}"] = timed(
+                lambda: pdf_generator.generate_pdfs(shared, workers=workers, as_bytes=True), args.reports)
+            report["runs"][f"bytes-uncached-charts/{workers}"] = timed(
+                lambda: pdf_generator.generate_pdfs(distinct, workers=workers, as_bytes=True), args.reports)
+            print(json.dumps({k: v for k, v in report["runs"].items() if k.endswith(f"/{workers}")}), file=sys.stderr)
+        pdf_generator.shutdown_pool()
+
+    print(json.dumps(report, indent=2))
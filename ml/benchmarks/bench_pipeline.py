@@ -0,0 +1,230 @@
+"""
+Time every pipeline stage on synthetic audio and catch performance regressions.
+
+    python ml/benchmarks/bench_pipeline.py [--minutes 1 5 30 60] [--signals speech tone noise silence]
+        [--save-baseline baseline.json] [--baseline baseline.json --threshold 0.25]
+
+Each signal/length combination is written to a WAV file and run through the
+stages one at a time: decode_audio, preprocess_audio, transcribe,
+detect_emotions, extract_audio_features and generate_pdf. For every stage the
+report gives the wall time, the peak resident memory while it ran and the
+audio seconds processed per second. Models are loaded before anything is
+timed, so load time is reported once and not counted against the stages.
+
+"whisperWindow" compares one batch of 30s windows decoded the old way (the
+encoder run by detect_language and again by decode) with the shared encoder
+pass, with and without language ID, and gives the saving per window.
+
+With --baseline the run is compared against an earlier report and the script
+exits with status 1 if any stage got slower by more than --threshold (as a
+fraction, plus --min-slack seconds so sub-second stages don't flap).
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+# Make the ml directory importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import soundfile as sf
+import torch
+import whisper
+
+import process_audio
+from benchmarks.synthetic import SAMPLE_RATE, noise, silence, speech_like, tone
+from model import registry, transcription
+from model.utils.audio import AudioContext
+
+SIGNALS = {
+    "speech": speech_like,
+    "tone": tone,
+    "noise": noise,
+    "silence": silence,
+}
+STAGES = ("decode_audio", "preprocess_audio", "transcribe", "detect_emotions", "extract_audio_features", "generate_pdf")
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux /proc, else the lifetime peak)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PeakRss:
+    """Samples the RSS on a background thread while the with-block runs."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start = self.peak = current_rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+
+def measure(fn, audio_seconds):
+    with PeakRss() as rss:
+        started = time.perf_counter()
+        result = fn()
+        wall = time.perf_counter() - started
+    return result, {
+        "wallSeconds": round(wall, 3),
+        "peakRssMb": round(rss.peak, 1),
+        "rssGrowthMb": round(rss.peak - rss.start, 1),
+        "audioSecondsPerSecond": round(audio_seconds / wall, 2) if wall else None,
+    }
+
+
+def best_of(fn, runs=2):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def measure_encoder_reuse(samples):
+    """Per-window milliseconds of the old and the shared-encoder Whisper paths on one batch."""
+    model = registry.get_whisper()
+    chunks = transcription.find_chunks(samples)[:transcription.BATCH_SIZE]
+    if not chunks:
+        return None
+    batch = [samples[a:b] for a, b in chunks]
+    options = transcription.decoding_options("en")
+
+    def legacy():
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(chunk), model.dims.n_mels) for chunk in batch
+        ]).to(model.device)
+        model.detect_language(mel)
+        model.decode(mel, options)
+
+    per_window = 1000 / len(batch)
+    legacy_ms = best_of(legacy) * per_window
+    shared_ms = best_of(lambda: transcription._decode_batch(model, batch, options, detect=False)) * per_window
+    language_ms = best_of(lambda: transcription._decode_batch(model, batch, options, detect=True)) * per_window
+    return {
+        "windows": len(batch),
+        "legacyMs": round(legacy_ms, 1),
+        "sharedMs": round(shared_ms, 1),
+        "sharedWithLanguageMs": round(language_ms, 1),
+        "savedMs": round(legacy_ms - shared_ms, 1),
+        "savedWithLanguageMs": round(legacy_ms - language_ms, 1),
+        "savedFraction": round(1 - shared_ms / legacy_ms, 3) if legacy_ms else None,
+    }
+
+
+def run_case(signal, minutes, workdir):
+    seconds = minutes * 60
+    samples = SIGNALS[signal](seconds)
+    path = os.path.join(workdir, f"{signal}-{minutes:g}m.wav")
+    sf.write(path, samples, SAMPLE_RATE, subtype="PCM_16")
+    ctx = AudioContext(samples, SAMPLE_RATE, path)
+
+    stages = {}
+    _, stages["decode_audio"] = measure(lambda: process_audio.decode_audio(path), seconds)
+    _, stages["preprocess_audio"] = measure(lambda: process_audio.preprocess_audio(samples, SAMPLE_RATE), seconds)
+    transcript, stages["transcribe"] = measure(lambda: process_audio.transcribe(ctx), seconds)
+    emotions, stages["detect_emotions"] = measure(lambda: process_audio.detect_emotions(ctx), seconds)
+    features, stages["extract_audio_features"] = measure(
+        lambda: process_audio.extract_audio_features(ctx, transcript), seconds)
+
+    pitch, silence_seconds, pace, _ = features
+    report = {
+        "patientName": "Benchmark", "patientAge": "N/A", "patientGender": "N/A",
+        "transcript": transcript, "emotions": emotions, "pitch": pitch, "silence": silence_seconds,
+        "pace": pace, "summary": process_audio.summarize(transcript),
+    }
+    pdf_path = os.path.join(workdir, f"{signal}-{minutes:g}m.pdf")
+    _, stages["generate_pdf"] = measure(lambda: process_audio.generate_pdf(report, pdf_path), seconds)
+    return {"signal": signal, "minutes": minutes, "audioSeconds": seconds, "stages": stages,
+            "whisperWindow": measure_encoder_reuse(samples)}
+
+
+def compare(report, baseline, threshold, min_slack):
+    """Return a list of human-readable regressions of report against baseline."""
+    previous = {(case["signal"], case["minutes"]): case for case in baseline.get("cases", [])}
+    regressions = []
+    for case in report["cases"]:
+        before = previous.get((case["signal"], case["minutes"]))
+        if not before:
+            continue
+        for stage, timing in case["stages"].items():
+            if stage not in before["stages"]:
+                continue
+            old, new = before["stages"][stage]["wallSeconds"], timing["wallSeconds"]
+            if new > old * (1 + threshold) + min_slack:
+                regressions.append(
+                    f"{case['signal']} {case['minutes']:g} min {stage}: {old:.3f}s -> {new:.3f}s "
+                    f"(+{(new / old - 1) * 100 if old else float('inf'):.0f}%)"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 5, 30, 60])
+    parser.add_argument("--signals", nargs="+", default=list(SIGNALS), choices=list(SIGNALS))
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--save-baseline", help="write this run's report here")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown per stage (0.25 = 25%%)")
+    parser.add_argument("--min-slack", type=float, default=0.05, help="extra seconds allowed before a slowdown counts")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    registry.preload()
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "config": process_audio.analysis_config(),
+            "loadSeconds": round(time.perf_counter() - started, 2),
+        },
+        "cases": [],
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for minutes in args.minutes:
+            for signal in args.signals:
+                case = run_case(signal, minutes, workdir)
+                print(json.dumps(case), file=sys.stderr)
+                report["cases"].append(case)
+
+    print(json.dumps(report, indent=2))
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(json.dumps(report, indent=2) + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold, args.min_slack)
+        for line in regressions:
+            print(f"Regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No stage regressed past the threshold", file=sys.stderr)
@@ -0,0 +1,139 @@
+"""
+Compare fp32, bf16 and int8 inference on a fixed local test set.
+
+    python ml/benchmarks/bench_precision.py --data path/to/clips [--precisions fp32 bf16 int8]
+
+Every audio file in --data is transcribed and emotion-classified at each
+precision. The report gives per-precision model load time and latency, and
+measures accuracy against fp32: word error rate of the transcript, agreement
+of the per-window top emotion and the mean absolute difference of the
+per-window emotion scores. If a clip has a <name>.txt next to it, the WER
+against that reference transcript is reported too. Without --data a few
+synthetic clips are used, which only makes the latency numbers meaningful.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# Make the ml directory importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import process_audio
+from benchmarks.synthetic import SAMPLE_RATE, speech_like
+from model import registry
+from model.utils.audio import AudioContext
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".webm", ".ogg", ".flac", ".m4a")
+
+
+def word_error_rate(reference, hypothesis):
+    """Word-level Levenshtein distance divided by the reference length."""
+    ref, hyp = reference.lower().split(), hypothesis.lower().split()
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    row = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (ref_word != hyp_word))
+    return row[-1] / len(ref)
+
+
+def load_test_set(data_dir):
+    """Return [(name, AudioContext, reference transcript or None)]."""
+    if not data_dir:
+        return [(f"synthetic-{seconds}s", AudioContext(speech_like(seconds, seed=seconds), SAMPLE_RATE), None)
+                for seconds in (10, 30, 90)]
+
+    clips = []
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.lower().endswith(AUDIO_EXTENSIONS):
+            continue
+        path = os.path.join(data_dir, filename)
+        reference_path = os.path.splitext(path)[0] + ".txt"
+        reference = open(reference_path).read().strip() if os.path.exists(reference_path) else None
+        clips.append((filename, AudioContext.from_file(path), reference))
+    return clips
+
+
+def run_precision(precision, clips):
+    registry.configure(precision=precision)
+    started = time.perf_counter()
+    registry.preload()
+    load_seconds = time.perf_counter() - started
+
+    outputs = {}
+    for name, ctx, _ in clips:
+        t0 = time.perf_counter()
+        transcript = process_audio.transcribe_detailed(ctx)["text"]
+        t1 = time.perf_counter()
+        timeline = process_audio.detect_emotions_detailed(ctx)["timeline"]
+        t2 = time.perf_counter()
+        outputs[name] = {
+            "transcript": transcript,
+            "timeline": timeline,
+            "transcribeSeconds": t1 - t0,
+            "emotionSeconds": t2 - t1,
+        }
+    return load_seconds, outputs
+
+
+def compare(clips, results, baseline="fp32"):
+    report = {}
+    for precision, (load_seconds, outputs) in results.items():
+        rows = []
+        for name, ctx, reference in clips:
+            out, base = outputs[name], results[baseline][1][name]
+            agreement, score_diff = [], []
+            for window, base_window in zip(out["timeline"], base["timeline"]):
+                agreement.append(window["emotion"] == base_window["emotion"])
+                score_diff.extend(abs(window["scores"][label] - base_window["scores"][label])
+                                  for label in window["scores"])
+            row = {
+                "clip": name,
+                "audioSeconds": round(ctx.duration, 2),
+                "transcribeSeconds": round(out["transcribeSeconds"], 3),
+                "emotionSeconds": round(out["emotionSeconds"], 3),
+                "werVsFp32": round(word_error_rate(base["transcript"], out["transcript"]), 4),
+                "emotionAgreement": round(float(np.mean(agreement)), 4) if agreement else None,
+                "emotionScoreDiff": round(float(np.mean(score_diff)), 3) if score_diff else None,
+            }
+            if reference is not None:
+                row["werVsReference"] = round(word_error_rate(reference, out["transcript"]), 4)
+            rows.append(row)
+
+        audio_seconds = sum(row["audioSeconds"] for row in rows)
+        transcribe_seconds = sum(row["transcribeSeconds"] for row in rows)
+        emotion_seconds = sum(row["emotionSeconds"] for row in rows)
+        report[precision] = {
+            "loadSeconds": round(load_seconds, 2),
+            "transcribeSeconds": round(transcribe_seconds, 3),
+            "emotionSeconds": round(emotion_seconds, 3),
+            "realtimeFactor": round(audio_seconds / (transcribe_seconds + emotion_seconds), 2),
+            "meanWerVsFp32": round(float(np.mean([row["werVsFp32"] for row in rows])), 4),
+            "clips": rows,
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare model precisions for latency and accuracy.")
+    parser.add_argument("--data", help="directory of audio clips (optionally with <name>.txt references)")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16", "int8"],
+                        choices=["fp32", "bf16", "int8"])
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    precisions = ["fp32"] + [p for p in args.precisions if p != "fp32"]
+
+    clips = load_test_set(args.data)
+    results = {precision: run_precision(precision, clips) for precision in precisions}
+    report = json.dumps(compare(clips, results), indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
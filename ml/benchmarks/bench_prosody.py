@@ -0,0 +1,84 @@
+"""
+Benchmark the prosody extractor against the previous feature code.
+
+    python ml/benchmarks/bench_prosody.py [--minutes 1 10 60] [--skip-legacy]
+
+"legacy" is the old extract_audio_features() path (piptrack at 22.05 kHz with a
+median magnitude mask plus a dBFS loop over 100 ms chunks, as pydub computed it); "main" is what
+main() used to compute (piptrack magnitudes and librosa.effects.split).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# Make the ml directory importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import librosa
+
+from benchmarks.synthetic import SAMPLE_RATE, speech_like
+from model.utils import prosody
+
+
+def _dbfs(chunk):
+    """pydub's AudioSegment.dBFS for 16-bit PCM: integer RMS against full scale."""
+    rms = int(np.sqrt(np.mean(chunk.astype(np.float64) ** 2)))
+    return 20 * np.log10(rms / 32768) if rms else -float("inf")
+
+
+def legacy_features(samples, sample_rate):
+    sr = 22050
+    y = librosa.resample(y=samples, orig_sr=sample_rate, target_sr=sr)
+    pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
+    pitch_values = pitches[magnitudes > np.median(magnitudes)]
+    avg_pitch = float(np.mean(pitch_values)) if len(pitch_values) > 0 else 0.0
+
+    pcm = (np.clip(samples, -1, 1) * 32767).astype(np.int16)
+    step = sample_rate // 10  # audio[::100] in pydub: 100 ms chunks, the last one shorter
+    silent_chunks = [start for start in range(0, len(pcm), step) if _dbfs(pcm[start:start + step]) < -40]
+    return {"pitch": round(avg_pitch, 2), "silence": round(len(silent_chunks) * 0.1, 2)}
+
+
+def main_features(samples, sample_rate):
+    sr = 22050
+    y = librosa.resample(y=samples, orig_sr=sample_rate, target_sr=sr)
+    pitch = librosa.piptrack(y=y, sr=sr)[1].mean()
+    silence = librosa.effects.split(y, top_db=20)[0].shape[0] / len(y)
+    return {"pitch": float(pitch), "silence": float(silence)}
+
+
+def new_features(samples, sample_rate):
+    summary = prosody.extract(samples, sample_rate)["summary"]
+    return {"pitch": summary["pitch"], "silence": summary["silence"]}
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return round(time.perf_counter() - started, 3), result
+
+
+def run(minutes, skip_legacy=False):
+    results = []
+    for length in minutes:
+        samples = speech_like(length * 60)
+        row = {"minutes": length}
+        row["prosody"], row["prosodyOutput"] = timed(new_features, samples, SAMPLE_RATE)
+        if not skip_legacy:
+            row["legacy"], row["legacyOutput"] = timed(legacy_features, samples, SAMPLE_RATE)
+            row["main"], row["mainOutput"] = timed(main_features, samples, SAMPLE_RATE)
+            row["speedup"] = round(row["legacy"] / row["prosody"], 1) if row["prosody"] else None
+        print(json.dumps(row), file=sys.stderr)
+        results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 10, 60])
+    parser.add_argument("--skip-legacy", action="store_true", help="only time the new extractor")
+    args = parser.parse_args()
+    print(json.dumps(run(args.minutes, args.skip_legacy), indent=2))
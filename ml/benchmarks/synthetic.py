@@ -0,0 +1,52 @@
+"""
+Synthetic speech-like test audio generated locally (no recordings needed).
+
+The signal alternates "utterances" and pauses. Utterances are a harmonic tone
+with a slowly drifting pitch, amplitude-modulated at a syllable-like rate, with
+a little background noise throughout.
+"""
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def speech_like(seconds, sample_rate=SAMPLE_RATE, seed=0, pitch=140.0):
+    """Return seconds of float32 speech-like audio at sample_rate."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    out = np.empty(n, dtype=np.float32)
+
+    pos = 0
+    while pos < n:
+        # Utterance of 1-6 s followed by a pause of 0.2-2 s
+        talk = min(int(rng.uniform(1, 6) * sample_rate), n - pos)
+        t = np.arange(talk) / sample_rate
+        f0 = pitch * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.2, 0.6) * t))
+        phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+        voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+        envelope = 0.5 * (1 + np.sin(2 * np.pi * rng.uniform(3, 5) * t)) ** 2
+        out[pos:pos + talk] = 0.1 * voice * envelope
+        pos += talk
+
+        pause = min(int(rng.uniform(0.2, 2.0) * sample_rate), n - pos)
+        out[pos:pos + pause] = 0.0
+        pos += pause
+
+    out += rng.normal(0, 0.002, n).astype(np.float32)
+    return out
+
+
+def tone(seconds, frequency=440.0, sample_rate=SAMPLE_RATE):
+    """A pure sine tone."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (0.3 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def noise(seconds, level=0.05, sample_rate=SAMPLE_RATE, seed=0):
+    """White noise."""
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, level, int(seconds * sample_rate)).astype(np.float32)
+
+
+def silence(seconds, sample_rate=SAMPLE_RATE):
+    return np.zeros(int(seconds * sample_rate), dtype=np.float32)
@@ -0,0 +1,146 @@
+"""
+Cross-request micro-batching for the emotion classifier.
+
+In worker mode several jobs can be in flight at once. Instead of every job
+running its own small forward passes, jobs hand their windows to a shared
+MicroBatcher. A single scheduler thread collects windows from all jobs until it
+has MAX_ITEMS of them or the oldest has waited MAX_WAIT_MS, pads them into one
+batch with the feature extractor (which also builds the attention mask when the
+model uses one), runs one forward pass and hands each job its own rows back.
+
+    THERAVOX_MICRO_BATCH_MAX      windows per forward pass (default 32)
+    THERAVOX_MICRO_BATCH_WAIT_MS  how long a window may wait for company (default 10)
+
+A longer wait gives bigger batches and more throughput under load at the cost
+of added latency per batch; MAX_ITEMS caps memory per forward pass.
+"""
+import collections
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+from .emotion import TEMPERATURE, prepare_inputs
+from .utils import profiling
+from .utils.lazy import lazy_import
+
+torch = lazy_import("torch")
+
+MAX_ITEMS = int(os.environ.get("THERAVOX_MICRO_BATCH_MAX", "32"))
+MAX_WAIT_MS = float(os.environ.get("THERAVOX_MICRO_BATCH_WAIT_MS", "10"))
+
+
+class _Request:
+    """The windows of one classify() call and where their probabilities go."""
+
+    def __init__(self, windows):
+        self.windows = windows
+        self.probabilities = [None] * len(windows)
+        self.remaining = len(windows)
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Batches emotion windows from concurrent jobs into shared forward passes."""
+
+    def __init__(self, model, feature_extractor, max_items=None, max_wait_ms=None, torch_threads=None):
+        self.model = model
+        self.feature_extractor = feature_extractor
+        self.max_items = max(1, max_items or MAX_ITEMS)
+        self.max_wait = (MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000
+        self.torch_threads = torch_threads
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = collections.Counter()
+        self._stats = {"batches": 0, "windows": 0, "requests": 0, "waitSecondsSum": 0.0, "forwardSecondsSum": 0.0}
+        self._thread = threading.Thread(target=self._loop, name="emotion-batcher", daemon=True)
+        self._thread.start()
+
+    def classify(self, windows, sample_rate):
+        """Return the (num_windows, num_labels) probabilities for windows; blocks until done."""
+        if sample_rate != self.feature_extractor.sampling_rate:
+            raise ValueError(f"Expected {self.feature_extractor.sampling_rate} Hz audio, got {sample_rate} Hz")
+        request = _Request(windows)
+        if not windows:
+            return np.zeros((0, len(self.model.config.id2label)), dtype=np.float32)
+        with self._stats_lock:
+            self._stats["requests"] += 1
+        enqueued = time.perf_counter()
+        for index in range(len(windows)):
+            self._queue.put((request, index, enqueued))
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return np.stack(request.probabilities)
+
+    def _collect(self):
+        """Block for the first window, then gather more until the batch is full or the wait runs out."""
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_items:
+            timeout = deadline - time.perf_counter()
+            try:
+                items.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self):
+        if self.torch_threads:
+            # Process-wide: this also applies to whatever else runs torch in the worker
+            torch.set_num_threads(self.torch_threads)
+        while True:
+            items = self._collect()
+            started = time.perf_counter()
+            try:
+                with profiling.span("emotions.batch_features", event=False):
+                    inputs = prepare_inputs(self.feature_extractor(
+                        [request.windows[index] for request, index, _ in items],
+                        sampling_rate=self.feature_extractor.sampling_rate,
+                        return_tensors="pt",
+                        padding=True,
+                    ), self.model)
+                with profiling.span("emotions.batch_forward", event=False), torch.inference_mode():
+                    logits = self.model(**inputs).logits.float()
+                probabilities = torch.softmax(logits / TEMPERATURE, dim=-1).cpu().numpy()
+            except Exception as e:
+                print(f"Error in batched emotion inference: {str(e)}", file=sys.stderr)
+                for request, _, _ in items:
+                    request.error = e
+                    request.done.set()
+                continue
+
+            finished = time.perf_counter()
+            for (request, index, _), probs in zip(items, probabilities):
+                request.probabilities[index] = probs
+                request.remaining -= 1
+                if request.remaining == 0 and request.error is None:
+                    request.done.set()
+
+            with self._stats_lock:
+                self._batch_sizes[len(items)] += 1
+                self._stats["batches"] += 1
+                self._stats["windows"] += len(items)
+                self._stats["waitSecondsSum"] += sum(started - enqueued for _, _, enqueued in items)
+                self._stats["forwardSecondsSum"] += finished - started
+
+    def stats(self):
+        """Batch-size histogram and totals for health/metrics reporting."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["batchSizes"] = {str(size): count for size, count in sorted(self._batch_sizes.items())}
+        batches = stats["batches"] or 1
+        stats.update(
+            maxItems=self.max_items,
+            maxWaitMs=self.max_wait * 1000,
+            pending=self._queue.qsize(),
+            meanBatchSize=round(stats["windows"] / batches, 2),
+            meanWaitMs=round(stats["waitSecondsSum"] / max(stats["windows"], 1) * 1000, 2),
+            waitSecondsSum=round(stats["waitSecondsSum"], 3),
+            forwardSecondsSum=round(stats["forwardSecondsSum"], 3),
+        )
+        return stats
@@ -0,0 +1,181 @@
+"""
+Sliding-window speech emotion recognition.
+
+The classifier sees the recording as fixed-length windows (WINDOW_SECONDS long,
+starting every HOP_SECONDS). Windows are stacked into batches of BATCH_SIZE and
+classified with one forward pass per batch, so memory stays flat no matter how
+long the recording is. The result is a per-window timeline plus the mean
+probability of every label over the whole recording.
+"""
+import os
+
+import numpy as np
+
+from .utils import profiling
+from .utils.lazy import lazy_import
+
+torch = lazy_import("torch")
+
+WINDOW_SECONDS = float(os.environ.get("THERAVOX_EMOTION_WINDOW", "3.0"))
+HOP_SECONDS = float(os.environ.get("THERAVOX_EMOTION_HOP", "1.5"))
+BATCH_SIZE = int(os.environ.get("THERAVOX_EMOTION_BATCH_SIZE", "16"))
+TEMPERATURE = 0.2  # Lower temperature for more decisive predictions
+
+
+def prepare_inputs(inputs, model):
+    """Move feature-extractor output to the model's device and float dtype (e.g. bf16)."""
+    dtype = model.dtype
+    return {
+        key: value.to(model.device, dtype=dtype) if value.is_floating_point() else value.to(model.device)
+        for key, value in inputs.items()
+    }
+
+
+def window_starts(num_samples, sample_rate, window_seconds=None, hop_seconds=None):
+    """Return (window_length, start offsets) covering the whole signal.
+
+    The last window is aligned to the end of the signal so every window has the
+    same length; a signal shorter than one window becomes a single window.
+    """
+    window = int((window_seconds or WINDOW_SECONDS) * sample_rate)
+    hop = max(1, int((hop_seconds or HOP_SECONDS) * sample_rate))
+    if num_samples <= window:
+        return num_samples, np.array([0])
+    starts = np.arange(0, num_samples - window + 1, hop)
+    if starts[-1] + window < num_samples:
+        starts = np.append(starts, num_samples - window)
+    return window, starts
+
+
+def classify_windows(model, feature_extractor, y, sr, window_seconds=None,
+                     hop_seconds=None, batch_size=None, offset=0.0, batcher=None):
+    """Classify every window of y and return (labels, timeline, mean_probs).
+
+    labels are the lower-cased model labels, timeline holds one entry per window
+    with its start/end time (shifted by offset seconds), top emotion and
+    per-label percentages, and mean_probs is the per-label mean probability
+    (in percent) over all windows. With a batcher (see model.batching) the
+    windows share forward passes with other jobs instead of running here.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    id2label = model.config.id2label
+    labels = [id2label.get(i, f'Label_{i}').lower() for i in range(len(id2label))]
+
+    window, starts = window_starts(len(y), sr, window_seconds, hop_seconds)
+    timeline = []
+    prob_sum = np.zeros(len(labels), dtype=np.float64)
+
+    # The batcher does its own grouping, so hand it every window at once
+    step = len(starts) if batcher else batch_size
+    for i in range(0, len(starts), step):
+        batch_starts = starts[i:i + step]
+        windows = [y[start:start + window] for start in batch_starts]
+        if batcher:
+            probabilities = batcher.classify(windows, sr)
+        else:
+            with profiling.span("emotions.features"):
+                inputs = prepare_inputs(feature_extractor(
+                    windows,
+                    sampling_rate=sr,
+                    return_tensors="pt",
+                    padding=True,
+                ), model)
+
+            with profiling.span("emotions.forward"), torch.inference_mode():
+                logits = model(**inputs).logits.float()
+
+            # Apply temperature scaling for better probability distribution
+            probabilities = torch.softmax(logits / TEMPERATURE, dim=-1).cpu().numpy()
+        prob_sum += probabilities.sum(axis=0)
+
+        for start, probs in zip(batch_starts, probabilities):
+            top = int(probs.argmax())
+            timeline.append({
+                "start": round(offset + start / sr, 2),
+                "end": round(offset + (start + window) / sr, 2),
+                "emotion": labels[top],
+                "confidence": round(float(probs[top]) * 100, 1),
+                "scores": {label: round(float(p) * 100, 1) for label, p in zip(labels, probs)},
+            })
+
+    mean_probs = prob_sum / max(len(starts), 1) * 100
+    return labels, timeline, mean_probs
+
+
+class StreamingClassifier:
+    """classify_windows() for audio that arrives in pieces.
+
+    Windows are classified as soon as they are fully buffered, on the same
+    start grid (and with the same end-aligned last window) as classify_windows
+    uses for a whole recording. Only the last window's worth of audio is kept
+    between feeds. The stream is classified as it arrives, without the
+    whole-recording trimming and normalization of the batch preprocessing.
+    """
+
+    def __init__(self, model, feature_extractor, sample_rate, window_seconds=None, hop_seconds=None,
+                 batch_size=None, batcher=None):
+        self.model = model
+        self.feature_extractor = feature_extractor
+        self.sample_rate = sample_rate
+        self.window = int((window_seconds or WINDOW_SECONDS) * sample_rate)
+        self.hop = max(1, int((hop_seconds or HOP_SECONDS) * sample_rate))
+        self.batch_size = batch_size
+        self.batcher = batcher
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.buffer_start = 0  # Stream position of buffer[0], in samples
+        self.next_start = 0  # Stream position of the next window to classify
+        self.total = 0
+        self.labels = None
+        self.timeline = []
+        self.prob_sum = None
+
+    def _classify(self, start, end):
+        """Classify the windows of stream[start:end] (one grid of hops) and record them."""
+        segment = self.buffer[start - self.buffer_start:end - self.buffer_start]
+        labels, timeline, mean_probs = classify_windows(
+            self.model, self.feature_extractor, segment, self.sample_rate,
+            window_seconds=self.window / self.sample_rate, hop_seconds=self.hop / self.sample_rate,
+            batch_size=self.batch_size, offset=start / self.sample_rate, batcher=self.batcher,
+        )
+        self.labels = labels
+        weighted = mean_probs * len(timeline)
+        self.prob_sum = weighted if self.prob_sum is None else self.prob_sum + weighted
+        self.timeline.extend(timeline)
+        return timeline
+
+    def feed(self, samples):
+        """Add samples; returns the timeline entries of the windows they completed."""
+        samples = np.asarray(samples, dtype=np.float32)
+        self.buffer = np.concatenate((self.buffer, samples))
+        self.total += len(samples)
+
+        new_windows = []
+        if self.total - self.next_start >= self.window:
+            count = (self.total - self.next_start - self.window) // self.hop + 1
+            end = self.next_start + (count - 1) * self.hop + self.window
+            new_windows = self._classify(self.next_start, end)
+            self.next_start += count * self.hop
+
+        # Keep enough audio for the next window and for an end-aligned last one
+        keep_from = max(0, min(self.next_start, self.total - self.window))
+        self.buffer = self.buffer[keep_from - self.buffer_start:]
+        self.buffer_start = keep_from
+        return new_windows
+
+    def finish(self):
+        """Classify the end of the stream; returns the final timeline entries."""
+        if not self.timeline:
+            # The whole recording is shorter than one window
+            if self.total < self.sample_rate:
+                return []
+            return self._classify(0, self.total)
+        last_end = self.next_start - self.hop + self.window
+        if last_end < self.total:
+            return self._classify(self.total - self.window, self.total)
+        return []
+
+    def mean_probs(self):
+        """Per-label mean probability (in percent) over the windows so far."""
+        if not self.timeline:
+            return None
+        return self.prob_sum / len(self.timeline)
@@ -0,0 +1,134 @@
+"""
+ONNX Runtime backend for the audio emotion classifier.
+
+The Hugging Face classifier is exported to ONNX once, with dynamic batch and
+sample axes, and cached under <cache dir>/onnx. Later starts load the graph
+straight into an onnxruntime session without loading the PyTorch weights.
+OnnxClassifier behaves like the PyTorch model as far as the pipeline is
+concerned (model(**inputs).logits, .config, .dtype, .device), so
+emotion.classify_windows, the micro-batcher and predict_emotion.py use it
+unchanged.
+
+    THERAVOX_EMOTION_BACKEND  "torch" (default) or "onnx", see model.registry
+    THERAVOX_ONNX_THREADS     intra-op threads per session (default 0 = one per core)
+
+Needs the optional onnx and onnxruntime packages (ml/requirements-onnx.txt).
+"""
+import inspect
+import os
+import sys
+import types
+
+import torch
+
+from .utils.cache import CACHE_DIR
+
+ONNX_DIR = os.path.join(CACHE_DIR, "onnx")
+OPSET = 17
+THREADS = int(os.environ.get("THERAVOX_ONNX_THREADS", "0"))
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError("The onnx emotion backend needs onnxruntime: pip install -r ml/requirements-onnx.txt") from None
+    return onnxruntime
+
+
+def model_path(name, with_mask):
+    safe_name = name.replace("/", "--")
+    suffix = "-mask" if with_mask else ""
+    return os.path.join(ONNX_DIR, f"emotion-{safe_name}{suffix}-opset{OPSET}.onnx")
+
+
+class _LogitsOnly(torch.nn.Module):
+    """Export wrapper: plain tensor inputs in, logits out."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_values, attention_mask=None):
+        return self.model(input_values=input_values, attention_mask=attention_mask).logits
+
+
+def export(model, path, with_mask):
+    """Export a PyTorch audio classifier to path with dynamic batch/sample axes."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    dummy = torch.zeros(2, 16000)
+    inputs, input_names = (dummy,), ["input_values"]
+    dynamic_axes = {"input_values": {0: "batch", 1: "samples"}, "logits": {0: "batch"}}
+    if with_mask:
+        inputs += (torch.ones(2, 16000, dtype=torch.long),)
+        input_names.append("attention_mask")
+        dynamic_axes["attention_mask"] = {0: "batch", 1: "samples"}
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # The TorchScript exporter: newer torch defaults to the dynamo one, which
+    # needs onnxscript and takes dynamic_shapes instead of dynamic_axes
+    legacy = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.inference_mode():
+        # The wrapper must be in eval mode too: afterwards the exporter sets
+        # the wrapper's training flag on every submodule, enabling dropout
+        torch.onnx.export(
+            _LogitsOnly(model.float()).eval(), inputs, tmp_path,
+            input_names=input_names, output_names=["logits"],
+            dynamic_axes=dynamic_axes, opset_version=OPSET, do_constant_folding=True, **legacy,
+        )
+    os.replace(tmp_path, path)
+    print(f"Exported emotion model to {path}", file=sys.stderr)
+
+
+class OnnxClassifier:
+    """An onnxruntime session with the calling convention of a Hugging Face classifier."""
+
+    def __init__(self, path, config, threads=None, device="cpu"):
+        ort = _import_onnxruntime()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = THREADS if threads is None else threads
+        options.inter_op_num_threads = 1
+        providers = ["CPUExecutionProvider"]
+        if device == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(path, options, providers=providers)
+        self.input_names = {node.name for node in self.session.get_inputs()}
+        self.config = config
+        self.path = path
+
+    @property
+    def dtype(self):
+        return torch.float32
+
+    @property
+    def device(self):
+        return torch.device("cpu")
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_values, attention_mask=None, **kwargs):
+        feeds = {"input_values": _to_numpy(input_values).astype("float32", copy=False)}
+        if "attention_mask" in self.input_names:
+            if attention_mask is None:
+                attention_mask = torch.ones(feeds["input_values"].shape, dtype=torch.long)
+            feeds["attention_mask"] = _to_numpy(attention_mask).astype("int64", copy=False)
+        logits = self.session.run(["logits"], feeds)[0]
+        return types.SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def _to_numpy(value):
+    return value.detach().cpu().numpy() if hasattr(value, "detach") else value
+
+
+def load(name, feature_extractor, load_torch_model, device="cpu", threads=None):
+    """Return an OnnxClassifier for name, exporting it with load_torch_model() the first time."""
+    from transformers import AutoConfig
+
+    _import_onnxruntime()
+    with_mask = bool(getattr(feature_extractor, "return_attention_mask", False))
+    path = model_path(name, with_mask)
+    if not os.path.exists(path):
+        export(load_torch_model(), path, with_mask)
+    return OnnxClassifier(path, AutoConfig.from_pretrained(name), threads=threads, device=device)
@@ -0,0 +1,125 @@
+"""
+Reduced-precision variants of the pipeline models.
+
+    fp32  the models as loaded
+    bf16  activations in bfloat16; Whisper keeps float32 weights (its layers
+          cast weights to the activation dtype) and float32 tensors at the
+          encoder/decoder boundaries, which is what whisper's decoding expects
+    int8  dynamic int8 quantization of every Linear layer (CPU only)
+
+Quantized models are saved under <cache dir>/quantized so later starts skip
+loading the float32 checkpoint. Only the state dict and plain architecture
+settings are stored, and they are read back with torch.load(weights_only=True),
+so a tampered cache file can't run code; the quantized module is rebuilt from
+the settings and the stored weights loaded into it.
+"""
+import os
+import sys
+
+import torch
+
+from .utils.cache import CACHE_DIR
+
+PRECISIONS = ("fp32", "bf16", "int8")
+QUANTIZED_DIR = os.path.join(CACHE_DIR, "quantized")
+
+
+class _Wrapper(torch.nn.Module):
+    """Wraps a module; attributes it doesn't define (e.g. .blocks) come from the inner one."""
+
+    def __init__(self, inner):
+        super().__init__()
+        self.inner = inner
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(super().__getattr__("inner"), name)
+
+
+class _BFloat16Encoder(_Wrapper):
+    """Runs a Whisper audio encoder in bfloat16 and returns float32 features."""
+
+    def forward(self, x):
+        return self.inner(x.to(torch.bfloat16)).float()
+
+
+class _BFloat16Decoder(_Wrapper):
+    """Runs a Whisper text decoder in bfloat16 (it follows the dtype of xa)."""
+
+    def forward(self, x, xa, kv_cache=None):
+        return self.inner(x, xa.to(torch.bfloat16), kv_cache=kv_cache)
+
+
+def whisper_bf16(model):
+    model.encoder = _BFloat16Encoder(model.encoder)
+    model.decoder = _BFloat16Decoder(model.decoder)
+    return model
+
+
+def classifier_bf16(model):
+    return model.to(torch.bfloat16)
+
+
+def quantize_whisper(model):
+    """Dynamic int8 quantization of the Whisper encoder/decoder Linear layers."""
+    import whisper
+
+    # whisper.model.Linear only overrides forward() to cast weights to the input
+    # dtype; quantize_dynamic only accepts plain nn.Linear, so swap the class
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    model.encoder = torch.ao.quantization.quantize_dynamic(model.encoder, {torch.nn.Linear}, dtype=torch.qint8)
+    model.decoder = torch.ao.quantization.quantize_dynamic(model.decoder, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def quantize_classifier(model):
+    """Dynamic int8 quantization of the classifier's Linear layers."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _describe(kind, model):
+    """Plain settings that rebuild model's architecture (see _skeleton)."""
+    if kind == "whisper":
+        return {"dims": dict(vars(model.dims))}
+    return {"class": type(model).__name__, "config": model.config.to_dict()}
+
+
+def _skeleton(kind, name, meta):
+    """The quantized module described by meta, with untrained weights to load a state dict into."""
+    if kind == "whisper":
+        import whisper
+
+        model = whisper.model.Whisper(whisper.model.ModelDimensions(**meta["dims"]))
+        if name in whisper._ALIGNMENT_HEADS:
+            model.set_alignment_heads(whisper._ALIGNMENT_HEADS[name])
+        return quantize_whisper(model.eval())
+    import transformers
+
+    config = transformers.AutoConfig.for_model(**meta["config"])
+    return quantize_classifier(getattr(transformers, meta["class"])(config).eval())
+
+
+def load_quantized(kind, name, build):
+    """Load a saved quantized model, or build() it and save its weights."""
+    safe_name = name.replace("/", "--")
+    path = os.path.join(QUANTIZED_DIR, f"{kind}-{safe_name}-int8-torch{torch.__version__}.pt")
+    if os.path.exists(path):
+        try:
+            saved = torch.load(path, map_location="cpu", weights_only=True)
+            model = _skeleton(kind, name, saved["meta"])
+            model.load_state_dict(saved["state_dict"])
+            return model
+        except Exception as e:
+            print(f"Ignoring unreadable quantized model {path}: {str(e)}", file=sys.stderr)
+
+    model = build()
+    os.makedirs(QUANTIZED_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save({"meta": _describe(kind, model), "state_dict": model.state_dict()}, tmp_path)
+    os.replace(tmp_path, path)
+    print(f"Saved quantized {kind} model to {path}", file=sys.stderr)
+    return model
@@ -0,0 +1,298 @@
+"""
+Process-wide registry of the models used by the audio pipeline.
+
+Models are loaded lazily on first use and then cached, so every stage (and
+every job in worker mode) shares the same instances. Model names and the
+device can be set through environment variables or configure():
+
+    THERAVOX_WHISPER_MODEL   Whisper checkpoint name (default "base")
+    THERAVOX_EMOTION_MODEL   Hugging Face audio classification model
+    THERAVOX_TEXT_EMOTION_MODEL  Hugging Face text classification model, see model.text_emotion
+    THERAVOX_DEVICE          "cpu", "cuda" or "auto" (default "auto")
+    THERAVOX_PRECISION       "fp32", "bf16" or "int8" (default "fp32"), see model.precision
+    THERAVOX_EMOTION_BACKEND "torch" or "onnx" (default "torch"), see model.onnx_backend
+    THERAVOX_MODEL_CACHE_MB  memory the cached models may use (default 0 = no limit)
+
+With a memory limit, loading a model that takes the cache over it first
+drops the least recently used models; jobs still running with a dropped
+model keep their reference, and the next job that needs it loads it again.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+DEFAULT_WHISPER_MODEL = "base"  # Using base model for faster processing
+DEFAULT_EMOTION_MODEL = "r-f/wav2vec-english-speech-emotion-recognition"  # English emotion recognition model
+DEFAULT_TEXT_EMOTION_MODEL = "j-hartmann/emotion-english-distilroberta-base"  # Emotions in English text
+
+_config = {
+    "whisper_model": os.environ.get("THERAVOX_WHISPER_MODEL", DEFAULT_WHISPER_MODEL),
+    "emotion_model": os.environ.get("THERAVOX_EMOTION_MODEL", DEFAULT_EMOTION_MODEL),
+    "text_emotion_model": os.environ.get("THERAVOX_TEXT_EMOTION_MODEL", DEFAULT_TEXT_EMOTION_MODEL),
+    "device": os.environ.get("THERAVOX_DEVICE", "auto"),
+    "precision": os.environ.get("THERAVOX_PRECISION", "fp32"),
+    "emotion_backend": os.environ.get("THERAVOX_EMOTION_BACKEND", "torch"),
+}
+
+MODEL_CACHE_MB = float(os.environ.get("THERAVOX_MODEL_CACHE_MB", "0"))
+
+_models = collections.OrderedDict()  # Least recently used first
+_model_mb = {}
+_load_metrics = {}
+_lock = threading.RLock()
+
+
+def configure(whisper_model=None, emotion_model=None, device=None, precision=None, emotion_backend=None,
+              text_emotion_model=None):
+    """Override the configured model names/device/precision/backend. None keeps the current value."""
+    with _lock:
+        if text_emotion_model:
+            _config["text_emotion_model"] = text_emotion_model
+        if emotion_backend:
+            _config["emotion_backend"] = emotion_backend
+        if precision:
+            _config["precision"] = precision
+        if whisper_model:
+            _config["whisper_model"] = whisper_model
+        if emotion_model:
+            _config["emotion_model"] = emotion_model
+        if device:
+            _config["device"] = device
+
+
+def get_config():
+    """Return a copy of the active configuration with the device resolved."""
+    config = dict(_config)
+    config["device"] = get_device()
+    return config
+
+
+def model_names():
+    """Configured model names and precision, without resolving the device or loading anything."""
+    return {
+        "whisper_model": _config["whisper_model"],
+        "emotion_model": _config["emotion_model"],
+        "precision": _config["precision"],
+        "emotion_backend": _config["emotion_backend"],
+        "text_emotion_model": _config["text_emotion_model"],
+    }
+
+
+def get_device(precision=None):
+    """Resolve the configured device, picking CUDA when "auto" and available.
+
+    int8 models are dynamically quantized, which only runs on the CPU.
+    """
+    if (precision or _config["precision"]) == "int8":
+        return "cpu"
+    device = _config["device"]
+    if device == "auto":
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+
+def _size_mb(entry):
+    """Megabytes of tensor data held by a cached entry (a model or a tuple with one)."""
+    import torch
+
+    total = 0
+    seen = set()
+    for part in entry if isinstance(entry, tuple) else (entry,):
+        if isinstance(part, torch.nn.Module):
+            for value in part.state_dict().values():
+                # Quantized layers keep (weight, bias) tuples in their state dict
+                for tensor in value if isinstance(value, tuple) else (value,):
+                    if not isinstance(tensor, torch.Tensor) or tensor.layout != torch.strided:
+                        continue
+                    if not tensor.is_quantized:
+                        if tensor.data_ptr() in seen:  # Tied weights
+                            continue
+                        seen.add(tensor.data_ptr())
+                    total += tensor.nelement() * tensor.element_size()
+        elif os.path.exists(getattr(part, "path", "") or ""):
+            total += os.path.getsize(part.path)  # ONNX Runtime session: about the graph file's size
+    return total / 2**20
+
+
+def _evict(keep):
+    """Drop least recently used models until the cache fits MODEL_CACHE_MB (keep always stays)."""
+    while MODEL_CACHE_MB and sum(_model_mb.values()) > MODEL_CACHE_MB and len(_models) > 1:
+        key = next(k for k in _models if k != keep)
+        del _models[key]
+        size = _model_mb.pop(key)
+        print(f"Dropped {key[0]} model {key[1]} ({key[3]}, {size:.0f} MB) to stay under "
+              f"{MODEL_CACHE_MB:.0f} MB", file=sys.stderr)
+
+
+def _get(key, loader):
+    """Return the cached object for key, calling loader() once to build it."""
+    entry = _models.get(key)
+    if entry is not None:
+        if MODEL_CACHE_MB:
+            with _lock:
+                if key in _models:
+                    _models.move_to_end(key)
+        return entry
+    with _lock:
+        if key not in _models:
+            print(f"Loading {key[0]} model: {key[1]} ({key[3]}) on {key[2]}...", file=sys.stderr)
+            started = time.perf_counter()
+            _models[key] = loader()
+            elapsed = time.perf_counter() - started
+            _load_metrics["/".join(str(part) for part in key)] = round(elapsed, 3)
+            _model_mb[key] = _size_mb(_models[key])
+            print(f"Loaded {key[1]} in {elapsed:.2f}s ({_model_mb[key]:.0f} MB)", file=sys.stderr)
+            _evict(keep=key)
+        return _models[key]
+
+
+def get_whisper(name=None, precision=None):
+    """Return the shared Whisper model."""
+    name = name or _config["whisper_model"]
+    precision = precision or _config["precision"]
+    device = get_device(precision)
+
+    def load():
+        import whisper
+        from . import precision as reduced
+        if precision == "int8":
+            return reduced.load_quantized(
+                "whisper", name, lambda: reduced.quantize_whisper(whisper.load_model(name, device="cpu"))
+            )
+        model = whisper.load_model(name, device=device)
+        if precision == "bf16":
+            model = reduced.whisper_bf16(model)
+        return model
+
+    return _get(("whisper", name, device, precision), load)
+
+
+def get_emotion_model(name=None, precision=None, backend=None):
+    """Return the shared (model, feature_extractor) pair for an audio classifier.
+
+    With the "onnx" backend the model is an onnx_backend.OnnxClassifier; it
+    always runs in float32, whatever the precision.
+    """
+    name = name or _config["emotion_model"]
+    precision = precision or _config["precision"]
+    backend = backend or _config["emotion_backend"]
+    device = get_device(precision)
+
+    if backend == "onnx":
+        def load_onnx():
+            from transformers import AutoFeatureExtractor, AutoModelForAudioClassification
+            from . import onnx_backend
+
+            feature_extractor = AutoFeatureExtractor.from_pretrained(name)
+            model = onnx_backend.load(
+                name, feature_extractor, lambda: AutoModelForAudioClassification.from_pretrained(name),
+                device=device,
+            )
+            return model, feature_extractor
+
+        return _get(("emotion", name, device, "onnx"), load_onnx)
+
+    def load():
+        from transformers import AutoFeatureExtractor, AutoModelForAudioClassification
+        from . import precision as reduced
+
+        def load_model():
+            model = AutoModelForAudioClassification.from_pretrained(name).to(device)
+            # Set model to evaluation mode
+            model.eval()
+            return model
+
+        if precision == "int8":
+            model = reduced.load_quantized("emotion", name, lambda: reduced.quantize_classifier(load_model()))
+        elif precision == "bf16":
+            model = reduced.classifier_bf16(load_model())
+        else:
+            model = load_model()
+        feature_extractor = AutoFeatureExtractor.from_pretrained(name)
+        return model, feature_extractor
+
+    return _get(("emotion", name, device, precision), load)
+
+
+def get_text_emotion_model(name=None, precision=None):
+    """Return the shared (model, tokenizer) pair for the transcript text classifier."""
+    name = name or _config["text_emotion_model"]
+    precision = precision or _config["precision"]
+    device = get_device(precision)
+
+    def load():
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        from . import precision as reduced
+
+        def load_model():
+            model = AutoModelForSequenceClassification.from_pretrained(name).to(device)
+            model.eval()
+            return model
+
+        if precision == "int8":
+            model = reduced.load_quantized("text_emotion", name, lambda: reduced.quantize_classifier(load_model()))
+        elif precision == "bf16":
+            model = reduced.classifier_bf16(load_model())
+        else:
+            model = load_model()
+        tokenizer = AutoTokenizer.from_pretrained(name)
+        return model, tokenizer
+
+    return _get(("text_emotion", name, device, precision), load)
+
+
+def preload(text_emotion=False):
+    """Load the configured default models up front (used by worker mode)."""
+    get_whisper()
+    get_emotion_model()
+    if text_emotion:
+        get_text_emotion_model()
+
+
+def prepare_for_fork():
+    """Freeze the cached models so forked workers can share their weights.
+
+    Every torch module is put in eval mode with requires_grad off, so no job
+    builds an autograd graph or writes to a weight tensor, and the weight
+    pages stay shared copy-on-write between the parent and its children.
+    CUDA can't be used across fork(), so this refuses CUDA models. ONNX
+    Runtime sessions aren't fork-safe either (their thread pools don't
+    survive it), so they are dropped here, which stops their threads; the
+    exported graph stays on disk and every child opens its own session.
+    """
+    import torch
+
+    with _lock:
+        for key in [key for key in _models if key[3] == "onnx"]:
+            del _models[key]
+            _model_mb.pop(key, None)
+            print(f"Closed ONNX Runtime session for {key[1]}; each worker process opens its own", file=sys.stderr)
+        for key, entry in _models.items():
+            if key[2] == "cuda":
+                raise RuntimeError("Pre-forked workers need CPU models; CUDA can't be shared across fork()")
+            for model in entry if isinstance(entry, tuple) else (entry,):
+                if isinstance(model, torch.nn.Module):
+                    model.eval()
+                    for parameter in model.parameters():
+                        parameter.requires_grad_(False)
+    torch.set_grad_enabled(False)
+
+
+def load_metrics():
+    """Seconds spent loading each cached model, keyed by kind/name/device."""
+    return dict(_load_metrics)
+
+
+def loaded_models():
+    """Names of the models currently held in the cache."""
+    return ["/".join(str(part) for part in key) for key in _models]
+
+
+def cache_usage():
+    """Megabytes held by each cached model, keyed like loaded_models(), plus the total and the limit."""
+    with _lock:
+        models = {"/".join(str(part) for part in key): round(size, 1) for key, size in _model_mb.items()}
+    return {"models": models, "totalMb": round(sum(models.values()), 1), "limitMb": MODEL_CACHE_MB or None}
@@ -0,0 +1,185 @@
+"""
+Emotions in the transcript text.
+
+Transcript segments (up to 30 s of speech each) are split into sentences,
+and every sentence is classified with a Hugging Face text classifier
+(j-hartmann/emotion-english-distilroberta-base by default, see model.registry).
+A sentence's times are interpolated from its position in the segment text.
+Sentences are tokenized once, sorted by token length and padded per batch, so
+a batch of short phrases isn't padded to the longest sentence of the
+recording. Scores are kept in an LRU cache keyed by sentence text, so a phrase
+that comes up again ("I don't know.", "Yeah, I guess.") is not run through the
+model twice. merge_timeline() then attaches the text emotion of the
+overlapping sentence to every window of the audio emotion timeline.
+
+    THERAVOX_TEXT_EMOTION_BATCH_SIZE  sentences per forward pass (default 32)
+    THERAVOX_TEXT_EMOTION_CACHE       sentences kept in the cache (default 4096, 0 = off)
+"""
+import collections
+import os
+import re
+import sys
+import threading
+
+from .emotion import prepare_inputs
+from .utils import profiling
+from .utils.lazy import lazy_import
+
+torch = lazy_import("torch")
+
+BATCH_SIZE = int(os.environ.get("THERAVOX_TEXT_EMOTION_BATCH_SIZE", "32"))
+CACHE_SIZE = int(os.environ.get("THERAVOX_TEXT_EMOTION_CACHE", "4096"))
+MAX_TOKENS = 256  # Longer sentences (unpunctuated run-ons) are truncated
+
+SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+
+_tokenizer_lock = threading.Lock()  # Fast tokenizers can't be called from two threads at once
+
+
+class ScoreCache:
+    """Thread-safe LRU map of (model, text) -> per-label percentages."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            scores = self.entries.get(key)
+            if scores is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return scores
+
+    def put(self, key, scores):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = scores
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+_cache = ScoreCache(CACHE_SIZE)
+
+
+def cache_stats():
+    """Entries, hits and misses of the process-wide score cache."""
+    return _cache.stats()
+
+
+def _normalize(text):
+    return " ".join(text.split())
+
+
+def _pad(sequences, pad_id):
+    """Right-pad token id lists into input_ids/attention_mask tensors."""
+    width = max(len(ids) for ids in sequences)
+    input_ids = torch.full((len(sequences), width), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(sequences), width), dtype=torch.long)
+    for row, ids in enumerate(sequences):
+        input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[row, :len(ids)] = 1
+    return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+def classify_texts(model, tokenizer, texts, batch_size=None):
+    """Return a {label: percent} dict for every text, running only the ones not cached."""
+    batch_size = batch_size or BATCH_SIZE
+    model_name = getattr(model.config, "_name_or_path", "")
+    texts = [_normalize(text) for text in texts]
+    results = {}
+    pending = []
+    for text in dict.fromkeys(texts):
+        scores = _cache.get((model_name, text))
+        if scores is None:
+            pending.append(text)
+        else:
+            results[text] = scores
+
+    if pending:
+        id2label = model.config.id2label
+        labels = [id2label.get(i, f'Label_{i}').lower() for i in range(len(id2label))]
+        with profiling.span("text_emotions.tokenize"), _tokenizer_lock:
+            token_ids = tokenizer(pending, truncation=True, max_length=MAX_TOKENS)["input_ids"]
+        # Similar lengths share a batch, so little of each batch is padding
+        order = sorted(range(len(pending)), key=lambda i: len(token_ids[i]))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            inputs = prepare_inputs(_pad([token_ids[i] for i in batch], tokenizer.pad_token_id), model)
+            with profiling.span("text_emotions.forward", batch=len(batch)), torch.inference_mode():
+                logits = model(**inputs).logits.float()
+            probabilities = torch.softmax(logits, dim=-1).cpu().numpy()
+            for i, probs in zip(batch, probabilities):
+                scores = {label: round(float(p) * 100, 1) for label, p in zip(labels, probs)}
+                results[pending[i]] = scores
+                _cache.put((model_name, pending[i]), scores)
+
+    print(f"Classified {len(set(texts))} distinct sentences ({len(pending)} not cached)", file=sys.stderr)
+    return [dict(results[text]) for text in texts]
+
+
+def split_sentences(segment):
+    """Split a transcript segment into sentences with start/end times interpolated by character position."""
+    text = _normalize(segment.get("text", ""))
+    sentences = []
+    position = 0
+    for sentence in SENTENCE_END.split(text):
+        if sentence:
+            start = text.index(sentence, position)
+            position = start + len(sentence)
+            sentences.append({
+                "start": round(segment["start"] + (segment["end"] - segment["start"]) * start / len(text), 2),
+                "end": round(segment["start"] + (segment["end"] - segment["start"]) * position / len(text), 2),
+                "text": sentence,
+            })
+    return sentences
+
+
+def classify_segments(model, tokenizer, segments, batch_size=None):
+    """Classify the sentences of transcript segments.
+
+    Returns one start/end/text/emotion/confidence/scores entry per sentence, in time order.
+    """
+    sentences = [sentence for segment in segments for sentence in split_sentences(segment)]
+    if not sentences:
+        return []
+    entries = []
+    all_scores = classify_texts(model, tokenizer, [sentence["text"] for sentence in sentences], batch_size)
+    for sentence, scores in zip(sentences, all_scores):
+        top = max(scores, key=scores.get)
+        entries.append({**sentence, "emotion": top, "confidence": scores[top], "scores": scores})
+    return entries
+
+
+def merge_timeline(timeline, text_emotions):
+    """Add textEmotion/textConfidence to every timeline window from the sentence overlapping it most.
+
+    Both lists are in time order. Windows that overlap no sentence (silence)
+    are left as they are. Returns the timeline, which is updated in place.
+    """
+    first = 0
+    for window in timeline:
+        while first < len(text_emotions) and text_emotions[first]["end"] <= window["start"]:
+            first += 1
+        best, best_overlap = None, 0.0
+        for entry in text_emotions[first:]:
+            if entry["start"] >= window["end"]:
+                break
+            overlap = min(entry["end"], window["end"]) - max(entry["start"], window["start"])
+            if overlap > best_overlap:
+                best, best_overlap = entry, overlap
+        if best is not None:
+            window["textEmotion"] = best["emotion"]
+            window["textConfidence"] = best["confidence"]
+    return timeline
@@ -0,0 +1,152 @@
+"""
+Per-job choice of model tier.
+
+A tier is a Whisper checkpoint, an emotion classifier precision and an
+emotion preprocessing pipeline; the bigger the tier, the better and slower:
+
+    fast      Whisper tiny, int8 emotion classifier, no HPSS (preprocess "none")
+    standard  Whisper base, configured precision, "fast" preprocessing
+    accurate  Whisper small, configured precision, "fast" preprocessing
+
+choose() takes the most accurate tier whose predicted run time fits the
+latency SLO. A tier's run time is a fixed overhead plus its cost per second of
+audio, which starts from a conservative CPU estimate and then follows the jobs
+this process has actually run with that tier. The jobs waiting behind this one
+need their share of the same slots, so with a backlog of B jobs over S slots a
+job gets SLO / (1 + B / S) seconds. When nothing fits, the fastest tier runs.
+
+    THERAVOX_TIERING      "1" to pick a tier per job (default off: every job uses the configured models)
+    THERAVOX_LATENCY_SLO  seconds one analysis should take, backlog included (default 300)
+    THERAVOX_TIERS        tiers the policy may pick (default "fast,standard,accurate")
+
+Every tier's models are held in the model registry, whose memory is bounded by
+THERAVOX_MODEL_CACHE_MB. The chosen tier (or "configured" with tiering off)
+is recorded in each result, with the numbers it was chosen on, and is part of
+the result cache key, so a result made with the fast tier under load is not
+served once the queue is empty.
+"""
+import contextvars
+import os
+import threading
+
+from . import registry
+from .utils import preprocessing
+
+ENABLED = os.environ.get("THERAVOX_TIERING", "0") == "1"
+LATENCY_SLO = float(os.environ.get("THERAVOX_LATENCY_SLO", "300"))
+OVERHEAD_SECONDS = 2.0  # Per-job cost that doesn't grow with the audio (decode, postprocess)
+MIN_LEARN_SECONDS = 10.0  # Shorter jobs are mostly overhead and say little about the per-second cost
+LEARNING_RATE = 0.3
+
+# Fastest first. cost: analysis seconds per second of audio on a CPU core,
+# the starting estimate until jobs have been measured.
+# emotionPrecision None keeps the configured precision.
+TIERS = {
+    "fast": {"whisperModel": "tiny", "emotionPrecision": "int8", "preprocess": "none", "cost": 0.08},
+    "standard": {"whisperModel": "base", "emotionPrecision": None, "preprocess": "fast", "cost": 0.15},
+    "accurate": {"whisperModel": "small", "emotionPrecision": None, "preprocess": "fast", "cost": 0.45},
+}
+ALLOWED = [name.strip() for name in os.environ.get("THERAVOX_TIERS", ",".join(TIERS)).split(",") if name.strip()]
+
+_current = contextvars.ContextVar("theravox_tier", default=None)
+_costs = {name: tier["cost"] for name, tier in TIERS.items()}
+_jobs = {name: 0 for name in TIERS}
+_lock = threading.Lock()
+
+
+def allowed_tiers():
+    """The usable tier names, fastest first."""
+    return [name for name in TIERS if name in ALLOWED] or ["standard"]
+
+
+def resolve(name):
+    """Model names, precisions and preprocessing of a tier ("configured" = the registry's settings)."""
+    config = registry.model_names()
+    if name == "configured":
+        whisper_model, emotion_precision, preprocess = (
+            config["whisper_model"], config["precision"], preprocessing.DEFAULT_PIPELINE)
+    else:
+        tier = TIERS[name]
+        whisper_model, emotion_precision, preprocess = (
+            tier["whisperModel"], tier["emotionPrecision"] or config["precision"], tier["preprocess"])
+    if config["emotion_backend"] == "onnx":
+        emotion_precision = "fp32"  # The ONNX graph always runs in float32
+    return {
+        "name": name,
+        "whisperModel": whisper_model,
+        "whisperPrecision": config["precision"],
+        "emotionModel": config["emotion_model"],
+        "emotionPrecision": emotion_precision,
+        "preprocess": preprocess,
+    }
+
+
+def at_least(name):
+    """Allowed tiers as accurate as name or more, most accurate first."""
+    tiers = allowed_tiers()
+    return list(reversed(tiers[tiers.index(name):])) if name in tiers else [name]
+
+
+def predict(name, duration):
+    """Predicted analysis seconds for duration seconds of audio with a tier."""
+    return OVERHEAD_SECONDS + _costs[name] * duration
+
+
+def choose(duration, backlog=0, slots=1):
+    """Pick the tier for a job of duration seconds with backlog jobs waiting for slots slots."""
+    budget = LATENCY_SLO / (1 + max(0, backlog) / max(1, slots))
+    tiers = allowed_tiers()
+    chosen = tiers[0]
+    for name in reversed(tiers):
+        if predict(name, duration) <= budget:
+            chosen = name
+            break
+    tier = resolve(chosen)
+    tier["policy"] = {
+        "durationSeconds": round(duration, 2),
+        "backlog": backlog,
+        "slots": slots,
+        "sloSeconds": LATENCY_SLO,
+        "budgetSeconds": round(budget, 2),
+        "predictedSeconds": round(predict(chosen, duration), 2),
+    }
+    return tier
+
+
+def record(name, duration, seconds):
+    """Update a tier's per-second cost from a finished job's analysis time."""
+    if name not in _costs:
+        return
+    with _lock:
+        _jobs[name] += 1
+        if duration >= MIN_LEARN_SECONDS:
+            observed = max(0.0, seconds - OVERHEAD_SECONDS) / duration
+            _costs[name] += LEARNING_RATE * (observed - _costs[name])
+
+
+def current():
+    """The tier of the job running in this context, else the configured models."""
+    return _current.get() or resolve("configured")
+
+
+def set_current(tier):
+    """Make tier the current job's tier (stage threads inherit it); returns a token for reset()."""
+    return _current.set(tier)
+
+
+def reset(token):
+    _current.reset(token)
+
+
+def stats():
+    """Jobs run and the current per-second cost estimate of every tier."""
+    with _lock:
+        return {name: {"jobs": _jobs[name], "cost": round(_costs[name], 4)} for name in TIERS}
+
+
+def preload():
+    """Load the models of every allowed tier (used by worker mode before forking)."""
+    for name in allowed_tiers():
+        tier = resolve(name)
+        registry.get_whisper(tier["whisperModel"], tier["whisperPrecision"])
+        registry.get_emotion_model(tier["emotionModel"], tier["emotionPrecision"])
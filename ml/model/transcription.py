@@ -0,0 +1,337 @@
+"""
+Long-form Whisper transcription.
+
+Whisper only looks at 30 seconds of audio per decode, so longer recordings are
+cut into chunks of at most 30 seconds. Cuts are placed in pauses found by an
+energy-based voice activity check, chunks with no speech at all are skipped,
+and the remaining chunks are decoded in batches. Only one batch of log-Mel
+spectrograms exists at a time, so peak memory is bounded by the batch size and
+not by the length of the recording.
+
+The encoder runs once per window. Language ID (off unless configured) and
+decoding both read the same audio features, and decoding starts from the
+cross-attention keys/values language ID already projected.
+
+Decoding installs KV-cache hooks on the model's decoder modules, and those
+hooks fire for every forward pass through them, whichever thread runs it. So
+one model instance decodes one batch at a time (see model_lock); concurrent
+jobs still compute their spectrograms and encoder passes side by side.
+
+    THERAVOX_WHISPER_LANGUAGE         language to decode in (default "en"); "auto"
+                                      detects it per window
+    THERAVOX_WHISPER_DETECT_LANGUAGE  "1" also reports the detected language when
+                                      the language is fixed (default "0")
+"""
+import os
+import sys
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from .utils import profiling
+from .utils.lazy import lazy_import
+
+librosa = lazy_import("librosa")
+torch = lazy_import("torch")
+whisper = lazy_import("whisper")
+
+SAMPLE_RATE = 16000  # whisper.audio.SAMPLE_RATE
+CHUNK_SECONDS = 30  # whisper.audio.CHUNK_LENGTH
+MIN_CHUNK_SECONDS = 5  # Don't cut at a pause closer than this to the chunk start
+SILENCE_TOP_DB = 40  # Frames this far below the peak count as silence
+BATCH_SIZE = int(os.environ.get("THERAVOX_WHISPER_BATCH_SIZE", "4"))
+LANGUAGE = os.environ.get("THERAVOX_WHISPER_LANGUAGE", "en")
+DETECT_LANGUAGE = os.environ.get("THERAVOX_WHISPER_DETECT_LANGUAGE", "0") == "1"
+
+_model_locks = weakref.WeakKeyDictionary()
+_model_locks_guard = threading.Lock()
+
+
+def model_lock(model):
+    """The lock that serializes decoding (language ID included) on one Whisper model."""
+    with _model_locks_guard:
+        lock = _model_locks.get(model)
+        if lock is None:
+            lock = _model_locks[model] = threading.Lock()
+        return lock
+
+
+def find_chunks(samples, sample_rate=SAMPLE_RATE, max_seconds=CHUNK_SECONDS,
+                min_seconds=MIN_CHUNK_SECONDS, top_db=SILENCE_TOP_DB):
+    """Return (start, end) sample offsets of the chunks that contain speech."""
+    if len(samples) == 0:
+        return []
+
+    # Non-silent intervals; the midpoints of the gaps between them are cut candidates
+    voiced = librosa.effects.split(samples, top_db=top_db)
+    if len(voiced) == 0:
+        return []
+    pauses = (voiced[:-1, 1] + voiced[1:, 0]) // 2
+
+    max_len = int(max_seconds * sample_rate)
+    min_len = int(min_seconds * sample_rate)
+    chunks = []
+    start = 0
+    while start < len(samples):
+        limit = start + max_len
+        if limit >= len(samples):
+            end = len(samples)
+        else:
+            candidates = pauses[(pauses > start + min_len) & (pauses <= limit)]
+            end = int(candidates[-1]) if len(candidates) else limit
+        # Skip chunks that are entirely silence
+        if np.any((voiced[:, 0] < end) & (voiced[:, 1] > start)):
+            chunks.append((start, end))
+        start = end
+    return chunks
+
+
+def decoding_options(language=None, prompt=None):
+    """Greedy DecodingOptions for language ("auto" or None = detect per window)."""
+    language = language or LANGUAGE
+    return whisper.DecodingOptions(
+        fp16=False,
+        language=None if language == "auto" else language,
+        task="transcribe",
+        without_timestamps=True,  # Segment times come from the chunk boundaries
+        prompt=prompt,
+    )
+
+
+def _cross_attention_modules(model):
+    return [module for block in model.decoder.blocks for module in (block.cross_attn.key, block.cross_attn.value)]
+
+
+def detect_language(model, audio_features):
+    """Language ID on encoded audio features.
+
+    Same computation as whisper.detect_language (one decoder step from the
+    start-of-transcript token), but run with the KV-cache hooks installed so
+    the cross-attention keys/values it projects can be handed to decoding.
+    Returns ([(language, probability)] per window, cross-attention cache).
+    """
+    tokenizer = whisper.tokenizer.get_tokenizer(model.is_multilingual, num_languages=model.num_languages)
+    cache, hooks = model.install_kv_cache_hooks()
+    try:
+        tokens = torch.tensor([[tokenizer.sot]] * audio_features.shape[0]).to(audio_features.device)
+        logits = model.decoder(tokens, audio_features, kv_cache=cache)[:, 0].float()
+    finally:
+        for hook in hooks:
+            hook.remove()
+
+    language_tokens = torch.tensor(list(tokenizer.all_language_tokens), device=logits.device)
+    probs = logits[:, language_tokens].softmax(dim=-1).cpu()
+    codes = tokenizer.all_language_codes
+    languages = [(codes[int(row.argmax())], round(float(row.max()), 3)) for row in probs]
+    cross_cache = {module: cache[module] for module in _cross_attention_modules(model) if module in cache}
+    return languages, cross_cache
+
+
+def _decode_features(model, audio_features, options, cross_cache=None):
+    """model.decode() on already-encoded features, optionally starting from a cross-attention cache."""
+    task = whisper.decoding.DecodingTask(model, options)
+    # The cache can only be shared when nothing else runs the decoder first:
+    # with language=None the task does its own language ID step
+    if cross_cache and options.language is not None and hasattr(task.inference, "kv_cache"):
+        # The decoder reads its position offset from the first cache entry, so
+        # empty self-attention entries go first; the hooks append to them
+        sample = next(iter(cross_cache.values()))
+        cache = {
+            module: sample.new_zeros((sample.shape[0], 0, sample.shape[2]))
+            for block in model.decoder.blocks for module in (block.attn.key, block.attn.value)
+        }
+        cache.update(cross_cache)
+        task.inference.kv_cache, task.inference.hooks = model.install_kv_cache_hooks(cache)
+    return task.run(audio_features)
+
+
+def _decode_batch(model, batch, options, detect=None, timings=None):
+    """Decode a list of <=30s waveforms in one batched forward pass.
+
+    Returns the DecodingResults and, when language ID ran, the detected
+    (language, probability) of each window. Per-stage seconds are added to
+    the timings dict when one is given.
+    """
+    detect = DETECT_LANGUAGE if detect is None else detect
+    with profiling.span("transcribe.features") as features_span:
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(chunk), model.dims.n_mels)
+            for chunk in batch
+        ]).to(model.device)
+
+    with torch.no_grad():
+        # The only encoder pass for these windows
+        with profiling.span("transcribe.encoder") as encoder_span:
+            audio_features = model.embed_audio(mel)
+
+        languages, cross_cache, language_span = None, None, None
+        # Other jobs' decoder passes would run through this job's KV-cache hooks
+        with model_lock(model):
+            # English-only checkpoints (*.en) have no language tokens to detect with
+            if detect and options.language is not None and model.is_multilingual:
+                with profiling.span("transcribe.language") as language_span:
+                    languages, cross_cache = detect_language(model, audio_features)
+
+            with profiling.span("transcribe.forward") as forward_span:
+                results = _decode_features(model, audio_features, options, cross_cache)
+
+    if languages is None and options.language is None:
+        # Language ID ran inside the decoding task
+        languages = [(result.language, None) for result in results]
+    if timings is not None:
+        for name, stage in (("features", features_span), ("encoder", encoder_span),
+                            ("language", language_span), ("decode", forward_span)):
+            if stage is not None:
+                timings[name] = timings.get(name, 0.0) + stage.wall
+    return results, languages
+
+
+def transcribe_long(model, samples, sample_rate=SAMPLE_RATE, batch_size=None, language=None, detect=None):
+    """Transcribe a whole recording and return text, timed segments and throughput."""
+    batch_size = batch_size or BATCH_SIZE
+    started = time.perf_counter()
+    options = decoding_options(language)
+
+    chunks = find_chunks(samples, sample_rate)
+    segments = []
+    timings = {}
+    detected = {}
+    for i in range(0, len(chunks), batch_size):
+        bounds = chunks[i:i + batch_size]
+        results, languages = _decode_batch(model, [samples[a:b] for a, b in bounds], options, detect, timings)
+        for j, ((a, b), result) in enumerate(zip(bounds, results)):
+            text = result.text.strip()
+            if text:
+                segment = {
+                    "start": round(a / sample_rate, 2),
+                    "end": round(b / sample_rate, 2),
+                    "text": text,
+                }
+                if languages:
+                    segment["language"], probability = languages[j]
+                    if probability is not None:
+                        segment["languageProbability"] = probability
+                    detected[segment["language"]] = detected.get(segment["language"], 0.0) + (b - a)
+                segments.append(segment)
+        print(f"Transcribed {min(i + batch_size, len(chunks))}/{len(chunks)} chunks", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    audio_seconds = len(samples) / sample_rate
+    result = {
+        "text": " ".join(segment["text"] for segment in segments),
+        "segments": segments,
+        "stats": {
+            "audioSeconds": round(audio_seconds, 2),
+            "wallSeconds": round(elapsed, 3),
+            "chunks": len(chunks),
+            "batchSize": batch_size,
+            # Audio seconds transcribed per wall-clock second
+            "throughput": round(audio_seconds / elapsed, 2) if elapsed > 0 else 0.0,
+            # Mean seconds per 30s window in each step
+            "perWindow": {name: round(seconds / len(chunks), 4) for name, seconds in timings.items()} if chunks else {},
+        },
+    }
+    if detected:
+        # The language spoken for most of the recording
+        result["language"] = max(detected, key=detected.get)
+    return result
+
+
+def next_cut(samples, sample_rate=SAMPLE_RATE, min_seconds=MIN_CHUNK_SECONDS, top_db=SILENCE_TOP_DB):
+    """Where to end the chunk that starts at samples[0]: (end offset, whether it has speech).
+
+    Like find_chunks, the cut goes at the last pause past min_seconds, or at
+    the end of samples when there is none.
+    """
+    voiced = librosa.effects.split(samples, top_db=top_db)
+    if len(voiced) == 0:
+        return len(samples), False
+    pauses = (voiced[:-1, 1] + voiced[1:, 0]) // 2
+    candidates = pauses[pauses > int(min_seconds * sample_rate)]
+    end = int(candidates[-1]) if len(candidates) else len(samples)
+    return end, bool(voiced[0, 0] < end)
+
+
+class StreamingTranscriber:
+    """Transcribes a recording that arrives in pieces.
+
+    Audio is held back until a full CHUNK_SECONDS window is buffered, then the
+    window is cut at its last pause and decoded with the end of the transcript
+    so far as the prompt, which keeps Whisper's context across chunks. At most
+    one window is ever pending, so finish() only has the tail left to decode.
+    """
+
+    def __init__(self, model, sample_rate=SAMPLE_RATE, language=None, prompt_chars=200):
+        if sample_rate != SAMPLE_RATE:
+            raise ValueError(f"Whisper needs {SAMPLE_RATE} Hz audio, got {sample_rate} Hz")
+        self.model = model
+        self.sample_rate = sample_rate
+        self.language = language
+        self.prompt_chars = prompt_chars
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.offset = 0  # Stream position of pending[0], in samples
+        self.segments = []
+        self.chunks = 0
+        self.decode_seconds = 0.0
+
+    @property
+    def text(self):
+        return " ".join(segment["text"] for segment in self.segments)
+
+    def _decode(self, end):
+        """Decode pending[:end] and drop it from the buffer; returns the new segment, if any."""
+        chunk, start = self.pending[:end], self.offset
+        self.pending = self.pending[end:]
+        self.offset += end
+
+        options = decoding_options(self.language, prompt=self.text[-self.prompt_chars:] or None)
+        started = time.perf_counter()
+        results, languages = _decode_batch(self.model, [chunk], options)
+        text = results[0].text.strip()
+        self.decode_seconds += time.perf_counter() - started
+        self.chunks += 1
+        if not text:
+            return []
+        segment = {
+            "start": round(start / self.sample_rate, 2),
+            "end": round((start + end) / self.sample_rate, 2),
+            "text": text,
+        }
+        if languages:
+            segment["language"] = languages[0][0]
+        self.segments.append(segment)
+        return [segment]
+
+    def feed(self, samples):
+        """Add samples; returns the segments completed by them."""
+        self.pending = np.concatenate((self.pending, np.asarray(samples, dtype=np.float32)))
+        window = int(CHUNK_SECONDS * self.sample_rate)
+        new_segments = []
+        while len(self.pending) >= window:
+            end, has_speech = next_cut(self.pending[:window], self.sample_rate)
+            if has_speech:
+                new_segments += self._decode(end)
+            else:
+                self.pending = self.pending[end:]
+                self.offset += end
+        return new_segments
+
+    def finish(self):
+        """Decode whatever is still buffered; returns the final segments."""
+        if len(self.pending) == 0 or len(librosa.effects.split(self.pending, top_db=SILENCE_TOP_DB)) == 0:
+            self.offset += len(self.pending)
+            self.pending = self.pending[:0]
+            return []
+        return self._decode(len(self.pending))
+
+    def stats(self):
+        audio_seconds = (self.offset + len(self.pending)) / self.sample_rate
+        return {
+            "audioSeconds": round(audio_seconds, 2),
+            "wallSeconds": round(self.decode_seconds, 3),
+            "chunks": self.chunks,
+            "batchSize": 1,
+            "throughput": round(audio_seconds / self.decode_seconds, 2) if self.decode_seconds > 0 else 0.0,
+        }
@@ -0,0 +1,184 @@
+"""
+Decoded audio shared by the analysis stages.
+
+An AudioContext decodes an upload once into a mono float32 buffer at 16 kHz
+(the rate Whisper and the wav2vec classifier expect). Stages that need another
+sample rate ask for it with at_rate(), which resamples once and caches it.
+
+Decoding never writes an intermediate file: PCM formats libsndfile understands
+(WAV, FLAC, OGG) are read with soundfile, everything else is streamed through
+an ffmpeg subprocess that emits mono float32 samples at the target rate on its
+stdout. Recordings longer than MAX_SECONDS are rejected while decoding, before
+they can use more memory, and iter_decode() yields fixed-size chunks for
+callers that don't need the whole recording at once.
+"""
+import collections
+import os
+import shutil
+import subprocess
+import threading
+
+import numpy as np
+
+from .lazy import lazy_import
+
+librosa = lazy_import("librosa")
+sf = lazy_import("soundfile")
+
+SAMPLE_RATE = 16000
+MAX_SECONDS = float(os.environ.get("THERAVOX_MAX_AUDIO_SECONDS", str(3 * 60 * 60)))
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
+SOUNDFILE_EXTENSIONS = (".wav", ".flac", ".ogg", ".aiff", ".aif")
+STDERR_LINES = 20  # Last ffmpeg error lines kept for the exception message
+
+
+def _too_long(path, max_seconds):
+    return ValueError(f"Audio longer than {max_seconds:.0f}s limit: {path}")
+
+
+def _ffmpeg_command(path, sample_rate):
+    ffmpeg = shutil.which(FFMPEG_BIN)
+    if not ffmpeg:
+        raise RuntimeError(f"ffmpeg not found (looked for {FFMPEG_BIN!r}); it is needed to decode {path}")
+    return [ffmpeg, "-nostdin", "-v", "error", "-i", path,
+            "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(sample_rate), "-"]
+
+
+def _read_into(stream, buffer):
+    """Fill buffer from stream; returns the number of bytes read (short only at EOF)."""
+    view = memoryview(buffer).cast("B")
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return filled
+
+
+def _drain(stream, lines):
+    """Read stream to EOF, keeping its last lines; ffmpeg blocks once a full stderr pipe goes unread."""
+    for line in stream:
+        lines.append(line)
+
+
+def _ffmpeg_stream(path, sample_rate, chunk_samples, max_seconds):
+    """Yield float32 chunks of chunk_samples (the last may be shorter) from an ffmpeg pipe."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Audio file not found: {path}")
+    max_samples = int(max_seconds * sample_rate)
+    proc = subprocess.Popen(_ffmpeg_command(path, sample_rate),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    # A damaged file can log far more than a pipe buffer of errors while stdout is still being read
+    stderr_lines = collections.deque(maxlen=STDERR_LINES)
+    stderr_reader = threading.Thread(target=_drain, args=(proc.stderr, stderr_lines), name="ffmpeg-stderr", daemon=True)
+    stderr_reader.start()
+    total = 0
+    try:
+        while True:
+            chunk = np.empty(chunk_samples, dtype=np.float32)
+            count = _read_into(proc.stdout, chunk) // 4
+            if count:
+                total += count
+                if total > max_samples:
+                    raise _too_long(path, max_seconds)
+                yield chunk[:count]
+            if count < chunk_samples:
+                break
+        proc.wait()
+        stderr_reader.join()
+        error = b"".join(stderr_lines).decode(errors="replace").strip()
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg could not decode {path}: {error or f'exit code {proc.returncode}'}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        stderr_reader.join()
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def _read_soundfile(path, sample_rate, max_seconds):
+    """Decode with libsndfile; returns None if it can't read the format."""
+    try:
+        info = sf.info(path)
+    except RuntimeError:
+        return None
+    if info.frames > max_seconds * info.samplerate:
+        raise _too_long(path, max_seconds)
+    samples, rate = sf.read(path, dtype="float32", always_2d=True)
+    samples = samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+    if rate != sample_rate:
+        samples = librosa.resample(y=samples, orig_sr=rate, target_sr=sample_rate)
+    return samples.astype(np.float32, copy=False)
+
+
+def decode_file(path, sample_rate=SAMPLE_RATE, max_seconds=None):
+    """Decode any ffmpeg-readable file into a mono float32 array at sample_rate."""
+    max_seconds = max_seconds or MAX_SECONDS
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Audio file not found: {path}")
+    if path.lower().endswith(SOUNDFILE_EXTENSIONS):
+        samples = _read_soundfile(path, sample_rate, max_seconds)
+        if samples is not None:
+            return samples
+
+    chunks = list(_ffmpeg_stream(path, sample_rate, sample_rate * 60, max_seconds))
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+
+
+def iter_decode(path, sample_rate=SAMPLE_RATE, chunk_seconds=30.0, max_seconds=None):
+    """Yield consecutive mono float32 chunks of chunk_seconds at sample_rate.
+
+    Only one chunk is held in memory at a time, so this suits recordings too
+    long to decode whole. The last chunk may be shorter.
+    """
+    max_seconds = max_seconds or MAX_SECONDS
+    chunk_samples = max(1, int(chunk_seconds * sample_rate))
+    if path.lower().endswith(SOUNDFILE_EXTENSIONS) and shutil.which(FFMPEG_BIN) is None:
+        # No ffmpeg: libsndfile can still stream PCM, resampling block by block
+        info = sf.info(path)
+        if info.frames > max_seconds * info.samplerate:
+            raise _too_long(path, max_seconds)
+        block = max(1, int(chunk_seconds * info.samplerate))
+        for samples in sf.blocks(path, blocksize=block, dtype="float32", always_2d=True):
+            samples = samples.mean(axis=1)
+            if info.samplerate != sample_rate:
+                samples = librosa.resample(y=samples, orig_sr=info.samplerate, target_sr=sample_rate)
+            yield samples.astype(np.float32, copy=False)
+        return
+    yield from _ffmpeg_stream(path, sample_rate, chunk_samples, max_seconds)
+
+
+class AudioContext:
+    """One decoded recording plus cached resamples of it."""
+
+    def __init__(self, samples, sample_rate=SAMPLE_RATE, path=None):
+        self.samples = np.ascontiguousarray(samples, dtype=np.float32)
+        self.sample_rate = sample_rate
+        self.path = path
+        self._resampled = {sample_rate: self.samples}
+
+    @classmethod
+    def from_file(cls, path, sample_rate=SAMPLE_RATE):
+        return cls(decode_file(path, sample_rate), sample_rate, path=path)
+
+    @classmethod
+    def ensure(cls, audio):
+        """Accept an AudioContext or a file path and return an AudioContext."""
+        if isinstance(audio, cls):
+            return audio
+        return cls.from_file(audio)
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+    def at_rate(self, sample_rate):
+        """Return the waveform at sample_rate, resampling at most once per rate."""
+        if sample_rate not in self._resampled:
+            self._resampled[sample_rate] = librosa.resample(
+                y=self.samples, orig_sr=self.sample_rate, target_sr=sample_rate
+            ).astype(np.float32, copy=False)
+        return self._resampled[sample_rate]
@@ -0,0 +1,124 @@
+"""
+On-disk cache of analysis results, keyed by audio content.
+
+The key is the SHA-256 of the uploaded file's bytes combined with a
+fingerprint of everything that changes the output (model names, preprocessing
+pipeline, window settings). Entries live in a single SQLite file, compressed,
+and the least recently used ones are evicted once the total size goes over
+THERAVOX_CACHE_MAX_MB. A hit needs no decoding and no model.
+
+    THERAVOX_CACHE        set to 0 to disable the cache
+    THERAVOX_CACHE_DIR    directory for the database (default ml/.cache)
+    THERAVOX_CACHE_MAX_MB size budget before eviction (default 256)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from contextlib import contextmanager
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CACHE_DIR = os.environ.get("THERAVOX_CACHE_DIR", os.path.join(ML_DIR, ".cache"))
+ENABLED = os.environ.get("THERAVOX_CACHE", "1") != "0"
+MAX_BYTES = int(float(os.environ.get("THERAVOX_CACHE_MAX_MB", "256")) * 1024 * 1024)
+# Bump when the shape or meaning of cached results changes
+CACHE_VERSION = 1
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(audio_digest, config):
+    """Combine the audio digest with the output-affecting configuration."""
+    fingerprint = json.dumps({"version": CACHE_VERSION, **config}, sort_keys=True)
+    return hashlib.sha256(f"{audio_digest}:{fingerprint}".encode()).hexdigest()
+
+
+class ResultCache:
+    """LRU cache of JSON-serialisable results in a SQLite file."""
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or CACHE_DIR
+        self.max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+        self.path = os.path.join(self.directory, "results.sqlite3")
+        os.makedirs(self.directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    @contextmanager
+    def _connect(self):
+        # A fresh connection per call keeps this safe across threads and forked workers
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        with self._connect() as db:
+            row = db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key, value, encoder=None):
+        """Store value under key and evict old entries if over budget."""
+        blob = zlib.compress(json.dumps(value, cls=encoder).encode())
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in db.execute("SELECT key, size FROM results ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        print(f"Result cache evicted {evicted} entries", file=sys.stderr)
+
+    def stats(self):
+        with self._connect() as db:
+            count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"entries": count, "bytes": total, "maxBytes": self.max_bytes}
+
+
+_default = None
+
+
+def get_cache():
+    """Return the process-wide cache, or None when caching is disabled."""
+    global _default
+    if not ENABLED:
+        return None
+    if _default is None:
+        _default = ResultCache()
+    return _default
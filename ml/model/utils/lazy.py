@@ -0,0 +1,82 @@
+"""
+Deferred imports for the heavy libraries (torch, whisper, librosa, transformers).
+
+    torch = lazy_import("torch")
+
+binds a placeholder that imports the real module the first time an attribute
+is used, so `process_audio.py --help` or a bad argument doesn't pay seconds of
+import time. Every deferred import is timed; import_times() reports them and
+missing_modules() checks what is installed without importing anything.
+"""
+import importlib
+import importlib.util
+import sys
+import threading
+import time
+
+# Module name -> pip package that provides it
+REQUIRED_MODULES = {
+    "whisper": "whisper-openai",
+    "librosa": "librosa",
+    "torch": "torch",
+    "numpy": "numpy",
+    "transformers": "transformers",
+    "soundfile": "soundfile",
+    "fpdf": "fpdf",
+}
+
+_import_times = {}
+_lock = threading.Lock()
+
+
+class _LazyModule:
+    """Stands in for a module until one of its attributes is needed."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            with _lock:
+                if self._module is None:
+                    already_loaded = self._name in sys.modules
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    if not already_loaded:
+                        elapsed = time.perf_counter() - started
+                        _import_times[self._name] = round(elapsed, 3)
+                        print(f"Imported {self._name} in {elapsed:.2f}s", file=sys.stderr)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name):
+    """Return a placeholder for module name that imports it on first attribute access."""
+    return _LazyModule(name)
+
+
+def import_times():
+    """Seconds spent importing each deferred module so far."""
+    return dict(_import_times)
+
+
+def missing_modules(modules=None):
+    """Return the pip packages whose modules can't be found, without importing them."""
+    modules = modules or REQUIRED_MODULES
+    missing = []
+    for module, package in modules.items():
+        try:
+            found = importlib.util.find_spec(module) is not None
+        except (ImportError, ValueError):
+            found = False
+        if not found:
+            missing.append(package)
+    return missing
@@ -1,9 +1,47 @@
+"""
+PDF reports for the analysis results.
+
+    render_pdf(report)                -> PDF bytes (nothing written to disk)
+    generate_pdf(report, path)        -> writes one report, True on success
+    generate_pdfs(reports, paths)     -> renders many reports in a process pool
+
+The emotion timeline chart is drawn with matplotlib once per distinct
+timeline and cached as a PNG under <cache dir>/charts; every process also
+keeps the parsed image, so a chart that was already used is not decoded again.
+Once the PNGs go over THERAVOX_CHART_CACHE_MAX_MB, the least recently used
+ones are deleted (a file's mtime is bumped whenever its chart is reused).
+
+    THERAVOX_PDF_WORKERS          processes for generate_pdfs (default: one per core)
+    THERAVOX_CHART_CACHE_MAX_MB   size budget of the chart PNGs (default 64)
+"""
 from fpdf import FPDF
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import multiprocessing
 import sys
+import threading
+import time
 import uuid
 
+from .cache import CACHE_DIR
+
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "server", "uploads", "reports")
+CHARTS_DIR = os.path.join(CACHE_DIR, "charts")
+PDF_WORKERS = int(os.environ.get("THERAVOX_PDF_WORKERS", "0"))  # 0 = one per CPU core
+CHART_SIZE = (7.5, 2.4)  # Inches at 100 dpi; drawn 190 mm wide on the page
+CHARTS_MAX_BYTES = int(float(os.environ.get("THERAVOX_CHART_CACHE_MAX_MB", "64")) * 1024 * 1024)
+IMAGE_INFO_ENTRIES = 64  # Parsed charts kept per process, oldest dropped first
+
+_created_dirs = set()
+_image_info = {}  # Chart path -> image data parsed by fpdf, reused across documents
+_chart_figure = None
+_chart_lock = threading.Lock()
+_pool = None
+_pool_workers = 0
+
 class PDF(FPDF):
     def header(self):
         # Logo
@@ -43,95 +81,257 @@ class PDF(FPDF):
         # Line break
         self.ln()
 
-def generate_pdf(report_data, pdf_path=None):
-    """Generate a PDF report with the analysis results."""
+    def chart(self, path):
+        # fpdf parses an image once per document; seed it with the copy this
+        # process already parsed (shallow copy: the object number is per document)
+        info = _image_info.get(path)
+        if path not in self.images and info is not None:
+            self.images[path] = {**info, "i": len(self.images) + 1}
+        self.image(path, x=10, w=190)
+        if path not in _image_info:
+            # Copied now: writing the document deletes the image data from its dict
+            _image_info[path] = dict(self.images[path])
+            while len(_image_info) > IMAGE_INFO_ENTRIES:
+                _image_info.pop(next(iter(_image_info)), None)
+        self.ln(4)
+
+
+def _ensure_dir(path):
+    if path not in _created_dirs:
+        os.makedirs(path, exist_ok=True)
+        _created_dirs.add(path)
+
+
+def _timeline_chart(timeline):
+    """PNG path of the stacked emotion-score chart for timeline, drawing it only once."""
+    digest = hashlib.sha1(json.dumps(
+        [(w["start"], w["end"], w["scores"]) for w in timeline], sort_keys=True
+    ).encode()).hexdigest()
+    path = os.path.join(CHARTS_DIR, f"emotions-{digest}.png")
     try:
-        print(f"Starting PDF generation for path: {pdf_path}", file=sys.stderr)
-        
-        # Always use the correct directory
-        pdf_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "server", "uploads", "reports")
-        os.makedirs(pdf_dir, exist_ok=True)
-        if not pdf_path:
-            # Use a unique name if not provided
-            pdf_path = os.path.join(pdf_dir, f"report-{uuid.uuid4().hex}.pdf")
-        elif not os.path.isabs(pdf_path):
-            pdf_path = os.path.join(pdf_dir, pdf_path)
-        
-        # Create PDF object
-        pdf = PDF()
-        pdf.alias_nb_pages()
-        pdf.add_page()
-        
-        # Add date
-        pdf.set_font('Arial', 'I', 10)
-        pdf.cell(0, 10, f'Generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}', 0, 1)
-        pdf.ln(10)
-
-        # Add patient information
-        pdf.set_font('Arial', '', 12)
-        pdf.cell(0, 10, f"Name: {report_data.get('patientName', 'N/A')}")
-        pdf.ln()
-        pdf.cell(0, 10, f"Age: {report_data.get('patientAge', 'N/A')}")
-        pdf.ln()
-        pdf.cell(0, 10, f"Gender: {report_data.get('patientGender', 'N/A')}")
-        pdf.ln()
-        pdf.cell(0, 10, f"Date: {datetime.now().strftime('%Y-%m-%d')}")
-        pdf.ln(10)
-
-        # Add transcript section
-        pdf.chapter_title('Transcription')
-        transcript = report_data.get('transcript', 'No transcript available')
-        print(f"Adding transcript: {transcript[:100]}...", file=sys.stderr)
-        pdf.chapter_body(transcript)
-
-        # Add emotions section
-        pdf.chapter_title('Detected Emotions')
-        emotions = report_data.get('emotions', [])
-        print(f"Adding emotions: {emotions}", file=sys.stderr)
-        if emotions:
-            pdf.chapter_body(', '.join(emotions))
-        else:
-            pdf.chapter_body('No emotions detected')
-
-        # Add analysis section
-        pdf.chapter_title('Analysis')
-        analysis = f"""
+        os.utime(path)  # Most recently used, for _evict_charts
+        return path
+    except FileNotFoundError:
+        pass
+
+    global _chart_figure
+    import matplotlib
+    import numpy as np
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from PIL import Image
+
+    labels = sorted({label for window in timeline for label in window["scores"]})
+    times = [(window["start"] + window["end"]) / 2 for window in timeline]
+    scores = [[window["scores"].get(label, 0.0) for window in timeline] for label in labels]
+    with _chart_lock:
+        # One figure per process, cleared between charts
+        if _chart_figure is None:
+            _chart_figure = Figure(figsize=CHART_SIZE, dpi=100)
+            FigureCanvasAgg(_chart_figure)
+            ax = _chart_figure.add_subplot()
+            ax.set_ylim(0, 100)
+            ax.set_xlabel("Time (s)")
+            ax.set_ylabel("Score (%)")
+            # Fixed margins (room for the legend on the right); tight_layout costs more than the plot
+            _chart_figure.subplots_adjust(left=0.08, right=0.86, bottom=0.2, top=0.95)
+        fig = _chart_figure
+        ax = fig.axes[0]
+        # Swap out only the data; clearing the axes would rebuild every tick
+        for artist in list(ax.collections):
+            artist.remove()
+        if ax.get_legend() is not None:
+            ax.get_legend().remove()
+        colors = [matplotlib.colormaps["tab10"](i % 10) for i in range(len(labels))]
+        ax.stackplot(times, scores, labels=labels, colors=colors)
+        ax.set_xlim(times[0], times[-1])
+        ax.legend(loc="upper left", bbox_to_anchor=(1.0, 1.0), fontsize=7, frameon=False)
+        fig.canvas.draw()
+        # RGB without alpha: fpdf decodes an alpha channel pixel by pixel in Python
+        pixels = np.asarray(fig.canvas.buffer_rgba())[..., :3]
+
+    _ensure_dir(CHARTS_DIR)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    Image.fromarray(pixels).save(tmp_path, format="PNG")
+    os.replace(tmp_path, path)
+    _evict_charts(keep=path)
+    return path
+
+
+def _evict_charts(keep=None):
+    """Delete the least recently used chart PNGs until they fit CHARTS_MAX_BYTES."""
+    charts = []
+    with os.scandir(CHARTS_DIR) as entries:
+        for entry in entries:
+            if entry.name.endswith(".png") and entry.path != keep:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Evicted by another process meanwhile
+                charts.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in charts)
+    if keep is not None:
+        total += os.path.getsize(keep)
+    if total <= CHARTS_MAX_BYTES:
+        return
+    evicted = 0
+    for _, size, path in sorted(charts):
+        if total <= CHARTS_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            evicted += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    print(f"Chart cache evicted {evicted} charts", file=sys.stderr)
+
+
+def _build(report_data):
+    """Lay out one report and return the finished FPDF document."""
+    now = datetime.now()
+    pdf = PDF()
+    pdf.alias_nb_pages()
+    pdf.add_page()
+
+    # Add date
+    pdf.set_font('Arial', 'I', 10)
+    pdf.cell(0, 10, f'Generated on: {now.strftime("%Y-%m-%d %H:%M:%S")}', 0, 1)
+    pdf.ln(10)
+
+    # Add patient information
+    pdf.set_font('Arial', '', 12)
+    pdf.cell(0, 10, f"Name: {report_data.get('patientName', 'N/A')}")
+    pdf.ln()
+    pdf.cell(0, 10, f"Age: {report_data.get('patientAge', 'N/A')}")
+    pdf.ln()
+    pdf.cell(0, 10, f"Gender: {report_data.get('patientGender', 'N/A')}")
+    pdf.ln()
+    pdf.cell(0, 10, f"Date: {now.strftime('%Y-%m-%d')}")
+    pdf.ln(10)
+
+    # Add transcript section
+    pdf.chapter_title('Transcription')
+    pdf.chapter_body(report_data.get('transcript', 'No transcript available'))
+
+    # Add emotions section
+    pdf.chapter_title('Detected Emotions')
+    emotions = report_data.get('emotions', [])
+    if emotions:
+        pdf.chapter_body(', '.join(emotions))
+    else:
+        pdf.chapter_body('No emotions detected')
+
+    # Add the emotion timeline chart when there is more than one window
+    timeline = report_data.get('emotionTimeline') or []
+    if len(timeline) > 1:
+        pdf.chapter_title('Emotion Timeline')
+        pdf.chart(_timeline_chart(timeline))
+
+    # Add analysis section
+    pdf.chapter_title('Analysis')
+    analysis = f"""
         Average Pitch: {report_data.get('pitch', 0)} Hz
         Silence Duration: {report_data.get('silence', 0)} seconds
         Speaking Pace: {report_data.get('pace', 0)} words per minute
         """
-        print(f"Adding analysis: {analysis}", file=sys.stderr)
-        pdf.chapter_body(analysis)
-
-        # Add summary section
-        pdf.chapter_title('Summary')
-        summary = report_data.get('summary', 'No summary available')
-        print(f"Adding summary: {summary[:100]}...", file=sys.stderr)
-        pdf.chapter_body(summary)
-
-        # Ensure directory exists
-        if pdf_dir:
-            print(f"Creating PDF directory: {pdf_dir}", file=sys.stderr)
-            os.makedirs(pdf_dir, exist_ok=True)
-            # Check if directory is writable
-            if not os.access(pdf_dir, os.W_OK):
-                print(f"Error: Directory {pdf_dir} is not writable", file=sys.stderr)
-                return False
-        
-        # Save PDF
-        print(f"Saving PDF to: {pdf_path}", file=sys.stderr)
-        pdf.output(pdf_path)
-        
-        # Verify PDF was created
-        if os.path.exists(pdf_path):
-            print(f"PDF successfully created at: {pdf_path}", file=sys.stderr)
-            return True
-        else:
-            print(f"Error: PDF file was not created at {pdf_path}", file=sys.stderr)
-            return False
-            
+    pdf.chapter_body(analysis)
+
+    # Add summary section
+    pdf.chapter_title('Summary')
+    pdf.chapter_body(report_data.get('summary', 'No summary available'))
+    return pdf
+
+
+def render_pdf(report_data):
+    """Render a report to PDF bytes in memory."""
+    # fpdf 1.7 keeps the document as a latin-1 str
+    return _build(report_data).output(dest='S').encode('latin-1')
+
+
+def _resolve_path(pdf_path):
+    if not pdf_path:
+        # Use a unique name if not provided
+        return os.path.join(REPORTS_DIR, f"report-{uuid.uuid4().hex}.pdf")
+    if not os.path.isabs(pdf_path):
+        return os.path.join(REPORTS_DIR, pdf_path)
+    return pdf_path
+
+
+def _write(pdf_path, data):
+    _ensure_dir(os.path.dirname(pdf_path))
+    with open(pdf_path, 'wb') as f:
+        f.write(data)
+
+
+def generate_pdf(report_data, pdf_path=None):
+    """Generate a PDF report with the analysis results."""
+    try:
+        pdf_path = _resolve_path(pdf_path)
+        _write(pdf_path, render_pdf(report_data))
+        return True
     except Exception as e:
         print(f"Error generating PDF: {str(e)}", file=sys.stderr)
         import traceback
         traceback.print_exc(file=sys.stderr)
         return False
+
+
+def _render_one(job):
+    """Pool task: render one report to a file (returns its path) or to bytes."""
+    report_data, pdf_path, as_bytes = job
+    try:
+        data = render_pdf(report_data)
+        if as_bytes:
+            return data
+        _write(pdf_path, data)
+        return pdf_path
+    except Exception as e:
+        print(f"Error generating PDF: {str(e)}", file=sys.stderr)
+        return None
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        # Spawned, not forked: the caller may have model threads running
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _pool_workers = workers
+    return _pool
+
+
+def generate_pdfs(reports, pdf_paths=None, workers=None, as_bytes=False):
+    """Render many reports at once.
+
+    Returns one entry per report: its file path (or its bytes with
+    as_bytes=True), or None where that report failed. The pool's processes
+    are kept for later batches, so fonts, matplotlib and parsed charts are
+    set up once per process and not once per report.
+    """
+    reports = list(reports)
+    pdf_paths = list(pdf_paths) if pdf_paths is not None else [None] * len(reports)
+    jobs = [(report, None if as_bytes else _resolve_path(path), as_bytes) for report, path in zip(reports, pdf_paths)]
+    workers = min(workers or PDF_WORKERS or os.cpu_count() or 1, len(jobs))
+
+    started = time.perf_counter()
+    if workers <= 1:
+        results = [_render_one(job) for job in jobs]
+    else:
+        chunksize = max(1, len(jobs) // (workers * 4))
+        results = list(_get_pool(workers).map(_render_one, jobs, chunksize=chunksize))
+    elapsed = time.perf_counter() - started
+    if jobs:
+        print(f"Rendered {sum(r is not None for r in results)}/{len(jobs)} reports in {elapsed:.2f}s "
+              f"({len(jobs) / elapsed:.1f}/s, {workers} processes)", file=sys.stderr)
+    return results
+
+
+def shutdown_pool():
+    """Stop the generate_pdfs worker processes."""
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+        _pool_workers = 0
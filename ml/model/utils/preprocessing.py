@@ -0,0 +1,131 @@
+"""
+Pluggable audio preprocessing for the emotion classifier.
+
+A pipeline is a named list of (stage name, function) pairs. Each function takes
+(y, sr, info) and returns the new signal; info collects the trimmed offset.
+Available pipelines:
+
+    current  the original sequence: three chained pre-emphasis passes and a
+             full-signal STFT/HPSS/ISTFT
+    fast     the same steps with the three pre-emphasis filters fused into one
+             FIR pass and the harmonic separation run block by block, so the
+             spectral step needs O(block) memory instead of O(recording)
+    none     resample and normalize only
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from .lazy import lazy_import
+
+librosa = lazy_import("librosa")
+
+TARGET_SR = 16000
+DEFAULT_PIPELINE = os.environ.get("THERAVOX_PREPROCESS", "fast")
+
+TRIM_TOP_DB = 25  # Trim silence with more aggressive threshold
+PREEMPHASIS_COEFS = (0.97, 0.97, 0.95)
+HPSS_BLOCK_SECONDS = 10.0
+HPSS_HOP = 512  # librosa's default STFT hop
+# Context on each side of a block: covers the median filter (31 frames) plus
+# one FFT window (2048). Blocks and margins are whole hops, so every block's
+# STFT frames fall on the full-signal frame grid and the result matches it.
+HPSS_MARGIN_SAMPLES = (16 + 2048 // HPSS_HOP) * HPSS_HOP
+
+
+def resample(y, sr, info):
+    if sr != TARGET_SR:
+        y = librosa.resample(y=y, orig_sr=sr, target_sr=TARGET_SR)
+    return y
+
+
+def normalize(y, sr, info):
+    return librosa.util.normalize(y)
+
+
+def trim(y, sr, info):
+    y, index = librosa.effects.trim(y, top_db=TRIM_TOP_DB)
+    info["offset"] += float(index[0]) / TARGET_SR
+    return y
+
+
+def preemphasis(coef):
+    def stage(y, sr, info):
+        return librosa.effects.preemphasis(y, coef=coef)
+    return stage
+
+
+def fused_preemphasis(y, sr, info):
+    """All pre-emphasis filters as a single FIR convolution."""
+    taps = np.array([1.0])
+    for coef in PREEMPHASIS_COEFS:
+        taps = np.convolve(taps, [1.0, -coef])
+    return np.convolve(y, taps.astype(y.dtype))[:len(y)]
+
+
+def hpss(y, sr, info):
+    """Keep the harmonic part using one STFT over the whole signal."""
+    D = librosa.stft(y)
+    D_harmonic, D_percussive = librosa.decompose.hpss(D)
+    return librosa.istft(D_harmonic)
+
+
+def blockwise_hpss(y, sr, info):
+    """Keep the harmonic part, processing HPSS_BLOCK_SECONDS at a time."""
+    block = int(HPSS_BLOCK_SECONDS * TARGET_SR) // HPSS_HOP * HPSS_HOP
+    if len(y) <= block + 2 * HPSS_MARGIN_SAMPLES:
+        return librosa.effects.harmonic(y)
+
+    out = np.empty_like(y)
+    for start in range(0, len(y), block):
+        end = min(start + block, len(y))
+        lo = max(0, start - HPSS_MARGIN_SAMPLES)
+        hi = min(len(y), end + HPSS_MARGIN_SAMPLES)
+        harmonic = librosa.effects.harmonic(y[lo:hi])
+        out[start:end] = harmonic[start - lo:end - lo]
+    return out
+
+
+PIPELINES = {
+    "current": [
+        ("resample", resample),
+        ("normalize", normalize),
+        ("preemphasis", preemphasis(PREEMPHASIS_COEFS[0])),
+        ("trim", trim),
+        ("compression", preemphasis(PREEMPHASIS_COEFS[1])),
+        ("noise_reduction", preemphasis(PREEMPHASIS_COEFS[2])),
+        ("hpss", hpss),
+    ],
+    "fast": [
+        ("resample", resample),
+        ("normalize", normalize),
+        ("preemphasis", fused_preemphasis),
+        ("trim", trim),
+        ("hpss", blockwise_hpss),
+    ],
+    "none": [
+        ("resample", resample),
+        ("normalize", normalize),
+    ],
+}
+
+
+def run(y, sr, pipeline=None):
+    """Run a named pipeline and return (y, sr, info).
+
+    info holds the pipeline name, the seconds of leading audio trimmed away and
+    the wall time of every stage.
+    """
+    pipeline = pipeline or DEFAULT_PIPELINE
+    if pipeline not in PIPELINES:
+        raise ValueError(f"Unknown preprocessing pipeline: {pipeline}")
+
+    info = {"pipeline": pipeline, "offset": 0.0, "timings": {}}
+    for name, stage in PIPELINES[pipeline]:
+        started = time.perf_counter()
+        y = stage(y, sr, info)
+        info["timings"][name] = round(time.perf_counter() - started, 4)
+    print(f"Preprocessing ({pipeline}) stage timings: {info['timings']}", file=sys.stderr)
+    return y, TARGET_SR, info
@@ -0,0 +1,331 @@
+"""
+Stage-level spans, JSON log events and Prometheus metrics for the pipeline.
+
+    with profiling.span("emotions.forward", windows=16):
+        ...
+
+times the block (wall and thread CPU seconds) and tracks the peak resident
+memory of the process while it runs. A span opened inside another span on the
+same thread (or in a context copied from it) is folded into its parent: the
+parent's log event lists per-child totals instead of every child being logged.
+Top-level spans are written to stderr as one JSON line each:
+
+    {"event": "span", "name": "emotions", "job": "3f2a...", "wall": 4.12, "cpu": 3.9,
+     "peakRssMb": 1830.4, "rssDeltaMb": 112.0, "children": {"emotions.forward": {...}}}
+
+Every span, nested or not, is also aggregated per name for prometheus_text().
+
+    THERAVOX_SPAN_EVENTS  "0" turns the JSON span events off (default on)
+"""
+import contextlib
+import contextvars
+import importlib.util
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+EVENTS_ENABLED = os.environ.get("THERAVOX_SPAN_EVENTS", "1") != "0"
+SAMPLE_INTERVAL = 0.02  # Seconds between memory samples while a span is open
+WALL_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_current = contextvars.ContextVar("theravox_span", default=None)
+_job = contextvars.ContextVar("theravox_job", default=None)
+_lock = threading.Lock()
+_metrics = {}
+
+
+def rss_mb():
+    """Current resident set size in MB (Linux /proc, else the lifetime peak)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def process_memory(pid=None):
+    """RSS, PSS and shared/private resident memory of a process in MB.
+
+    Shared pages are the ones still shared copy-on-write with another process
+    (forked workers and their parent); PSS splits them evenly between the
+    sharers, so the PSS of all workers adds up to their real footprint. Reads
+    /proc/<pid>/smaps_rollup, falling back to statm (no PSS) on older kernels.
+    """
+    pid = pid or os.getpid()
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    except OSError:
+        pass
+    if fields:
+        return {
+            "rssMb": round(fields.get("Rss", 0.0), 1),
+            "pssMb": round(fields.get("Pss", 0.0), 1),
+            "sharedMb": round(fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0), 1),
+            "privateMb": round(fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0), 1),
+        }
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            resident, shared = (int(value) * os.sysconf("SC_PAGE_SIZE") / 2**20 for value in f.read().split()[1:3])
+    except (OSError, ValueError):
+        return None
+    return {"rssMb": round(resident, 1), "pssMb": None, "sharedMb": round(shared, 1),
+            "privateMb": round(resident - shared, 1)}
+
+
+class _MemorySampler:
+    """One background thread that samples the RSS while any span is open."""
+
+    def __init__(self):
+        self.spans = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.thread = None
+
+    def add(self, span):
+        with self.lock:
+            self.spans.add(span)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="span-memory", daemon=True)
+                self.thread.start()
+            self.wakeup.notify()
+
+    def remove(self, span):
+        with self.lock:
+            self.spans.discard(span)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.spans:
+                    self.wakeup.wait()
+                spans = list(self.spans)
+            current = rss_mb()
+            for span in spans:
+                span.peak_rss = max(span.peak_rss, current)
+            time.sleep(SAMPLE_INTERVAL)
+
+
+_sampler = _MemorySampler()
+
+
+def _reset_after_fork():
+    """A forked worker starts with its own sampler thread and empty metrics."""
+    global _lock, _sampler
+    _lock = threading.Lock()
+    _sampler = _MemorySampler()
+    _metrics.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.parent = _current.get()
+        self.children = {}
+        self.wall = self.cpu = 0.0
+        self.start_rss = self.peak_rss = rss_mb()
+
+    def _add_child(self, name, wall, cpu, peak_rss):
+        with _lock:
+            totals = self.children.setdefault(name, {"count": 0, "wall": 0.0, "cpu": 0.0, "peakRssMb": 0.0})
+            totals["count"] += 1
+            totals["wall"] += wall
+            totals["cpu"] += cpu
+            totals["peakRssMb"] = max(totals["peakRssMb"], peak_rss)
+        self.peak_rss = max(self.peak_rss, peak_rss)
+
+    def as_dict(self):
+        return {
+            "wall": round(self.wall, 3),
+            "cpu": round(self.cpu, 3),
+            "peakRssMb": round(self.peak_rss, 1),
+            "rssDeltaMb": round(self.peak_rss - self.start_rss, 1),
+        }
+
+
+def _record(name, wall, cpu, peak_rss, error):
+    with _lock:
+        metric = _metrics.setdefault(name, {
+            "count": 0, "errors": 0, "wall": 0.0, "cpu": 0.0, "peakRssMb": 0.0,
+            "buckets": [0] * len(WALL_BUCKETS),
+        })
+        metric["count"] += 1
+        metric["errors"] += bool(error)
+        metric["wall"] += wall
+        metric["cpu"] += cpu
+        metric["peakRssMb"] = max(metric["peakRssMb"], peak_rss)
+        for i, bound in enumerate(WALL_BUCKETS):
+            if wall <= bound:
+                metric["buckets"][i] += 1
+
+
+def emit(event, **fields):
+    """Write one structured log event to stderr."""
+    if EVENTS_ENABLED:
+        print(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, default=str), file=sys.stderr)
+
+
+@contextlib.contextmanager
+def span(name, event=True, **attrs):
+    """Time a block; yields the Span, whose as_dict() has the measurements.
+
+    event=False keeps a top-level span out of the log (it still counts in the
+    metrics), for spans that fire too often to log one by one.
+    """
+    current = Span(name, attrs)
+    token = _current.set(current)
+    _sampler.add(current)
+    wall, cpu = time.perf_counter(), time.thread_time()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current.wall = time.perf_counter() - wall
+        current.cpu = time.thread_time() - cpu
+        _sampler.remove(current)
+        current.peak_rss = max(current.peak_rss, rss_mb())
+        _current.reset(token)
+        _record(name, current.wall, current.cpu, current.peak_rss, error)
+
+        if current.parent is not None:
+            current.parent._add_child(name, current.wall, current.cpu, current.peak_rss)
+        elif event:
+            fields = {"name": name, "job": _job.get(), **current.as_dict(), **attrs}
+            if current.children:
+                fields["children"] = {
+                    child: {**totals, "wall": round(totals["wall"], 3), "cpu": round(totals["cpu"], 3),
+                            "peakRssMb": round(totals["peakRssMb"], 1)}
+                    for child, totals in current.children.items()
+                }
+            if error is not None:
+                fields["error"] = str(error)
+            emit("span", **fields)
+
+
+def set_job(job_id):
+    """Tag the spans of the current context (and contexts copied from it) with a job id."""
+    return _job.set(job_id)
+
+
+def metrics():
+    """Per-span-name totals since startup."""
+    with _lock:
+        return {name: {**metric, "buckets": list(metric["buckets"])} for name, metric in _metrics.items()}
+
+
+def prometheus_text(extra=None):
+    """Span metrics (plus extra (name, type, help, value) gauges) in Prometheus text format.
+
+    value may also be a list of (labels dict, value) pairs for a labelled series.
+    """
+    lines = []
+    for name, type_, help_, value in extra or ():
+        lines += [f"# HELP theravox_{name} {help_}", f"# TYPE theravox_{name} {type_}"]
+        if isinstance(value, list):
+            for labels, labelled_value in value:
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f"theravox_{name}{{{label_text}}} {labelled_value}")
+        else:
+            lines.append(f"theravox_{name} {value}")
+
+    snapshot = metrics()
+    lines += [
+        "# HELP theravox_stage_seconds Wall time of pipeline stages",
+        "# TYPE theravox_stage_seconds histogram",
+    ]
+    for name, metric in sorted(snapshot.items()):
+        for bound, count in zip(WALL_BUCKETS, metric["buckets"]):
+            lines.append(f'theravox_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+        lines.append(f'theravox_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {metric["count"]}')
+        lines.append(f'theravox_stage_seconds_sum{{stage="{name}"}} {metric["wall"]:.6f}')
+        lines.append(f'theravox_stage_seconds_count{{stage="{name}"}} {metric["count"]}')
+    for metric_name, key, type_, help_ in (
+        ("stage_cpu_seconds_total", "cpu", "counter", "CPU time of pipeline stages (thread time)"),
+        ("stage_errors_total", "errors", "counter", "Pipeline stages that raised"),
+        ("stage_peak_rss_megabytes", "peakRssMb", "gauge", "Highest process RSS seen while a stage ran"),
+    ):
+        lines += [f"# HELP theravox_{metric_name} {help_}", f"# TYPE theravox_{metric_name} {type_}"]
+        for name, metric in sorted(snapshot.items()):
+            lines.append(f'theravox_{metric_name}{{stage="{name}"}} {metric[key]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(path, extra=None):
+    """Atomically replace path with the current metrics (for node_exporter's textfile collector)."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(prometheus_text(extra))
+    os.replace(tmp_path, path)
+
+
+def serve_prometheus(port, extra=None, host="127.0.0.1"):
+    """Serve GET /metrics on host:port from a daemon thread; extra is a callable returning gauges.
+
+    Only local scrapers can reach it by default; pass host="0.0.0.0" to listen on every interface.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text(extra() if extra else None).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of the worker's stderr
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Serving Prometheus metrics on {host}:{port}", file=sys.stderr)
+    return server
+
+
+@contextlib.contextmanager
+def profile(directory, name="job"):
+    """cProfile (and, when torch is loaded, the torch profiler) around one job.
+
+    Writes <directory>/<name>.prof (open with snakeviz or pstats) and
+    <directory>/<name>.torch-trace.json (chrome://tracing or Perfetto).
+    """
+    import cProfile
+
+    os.makedirs(directory, exist_ok=True)
+    profiler = cProfile.Profile()
+    torch_profiler = None
+    if importlib.util.find_spec("torch") is not None:
+        import torch
+        torch_profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+        torch_profiler.__enter__()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_path = os.path.join(directory, f"{name}.prof")
+        profiler.dump_stats(profile_path)
+        print(f"Wrote cProfile stats to {profile_path}", file=sys.stderr)
+        if torch_profiler is not None:
+            torch_profiler.__exit__(None, None, None)
+            trace_path = os.path.join(directory, f"{name}.torch-trace.json")
+            torch_profiler.export_chrome_trace(trace_path)
+            print(f"Wrote torch profiler trace to {trace_path}", file=sys.stderr)
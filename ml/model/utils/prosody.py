@@ -0,0 +1,182 @@
+"""
+Prosody features (loudness, pitch and pauses) from the shared waveform.
+
+Everything is computed framewise on strided views of the 16 kHz buffer in one
+pass: per-frame RMS level in dBFS, an autocorrelation F0 estimate for voiced
+frames, and pause statistics from runs of silent frames. Frames are processed
+in blocks so memory stays bounded on long recordings.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+FRAME_SECONDS = 0.04  # Long enough for two periods at the lowest pitch
+HOP_SECONDS = 0.01
+SILENCE_DB = -40  # Frames quieter than this (dBFS) are silence
+MIN_PAUSE_SECONDS = 0.3  # Shorter silent runs are not counted as pauses
+F0_MIN = 60.0
+F0_MAX = 400.0
+VOICING_THRESHOLD = 0.5  # Normalized autocorrelation peak needed to call a frame voiced
+BLOCK_FRAMES = 4096
+
+
+def frame_signal(samples, frame_length, hop_length):
+    """Return a (n_frames, frame_length) strided view of samples (no copy)."""
+    if len(samples) < frame_length:
+        samples = np.pad(samples, (0, frame_length - len(samples)))
+    return sliding_window_view(samples, frame_length)[::hop_length]
+
+
+def _block_f0(frames, sample_rate, nfft, min_lag, max_lag):
+    """Autocorrelation F0 and voicing strength for a block of frames."""
+    frames = frames - frames.mean(axis=1, keepdims=True)
+    spectrum = np.fft.rfft(frames * np.hanning(frames.shape[1]), n=nfft, axis=1)
+    acf = np.fft.irfft(np.abs(spectrum) ** 2, n=nfft, axis=1)
+    energy = np.maximum(acf[:, :1], 1e-12)
+    acf = acf[:, :max_lag + 2] / energy
+
+    search = acf[:, min_lag:max_lag + 1]
+    peak = search.argmax(axis=1) + min_lag
+    strength = acf[np.arange(len(acf)), peak]
+
+    # Parabolic interpolation around the peak lag
+    left = acf[np.arange(len(acf)), peak - 1]
+    right = acf[np.arange(len(acf)), peak + 1]
+    denom = left - 2 * strength + right
+    shift = np.zeros_like(denom)
+    np.divide(0.5 * (left - right), denom, out=shift, where=np.abs(denom) > 1e-12)
+    f0 = sample_rate / (peak + np.clip(shift, -0.5, 0.5))
+    return f0, strength
+
+
+def _runs(mask):
+    """Lengths (in frames) of the runs of True values in a boolean array."""
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    return edges[1::2] - edges[::2]
+
+
+def _frame_params(sample_rate):
+    frame_length = int(FRAME_SECONDS * sample_rate)
+    hop_length = int(HOP_SECONDS * sample_rate)
+    min_lag = int(sample_rate / F0_MAX)
+    max_lag = min(int(sample_rate / F0_MIN), frame_length - 2)
+    # Smallest FFT size whose circular autocorrelation is exact up to max_lag
+    nfft = 1 << int(np.ceil(np.log2(frame_length + max_lag + 2)))
+    return frame_length, hop_length, min_lag, max_lag, nfft
+
+
+def _frame_features(frames, sample_rate):
+    """Per-frame (rms_db, f0, voiced) arrays for a (n_frames, frame_length) array."""
+    frame_length, _, min_lag, max_lag, nfft = _frame_params(sample_rate)
+    n_frames = len(frames)
+    rms_db = np.empty(n_frames, dtype=np.float32)
+    f0 = np.zeros(n_frames, dtype=np.float32)
+    voiced = np.zeros(n_frames, dtype=bool)
+
+    for start in range(0, n_frames, BLOCK_FRAMES):
+        block = frames[start:start + BLOCK_FRAMES]
+        end = start + len(block)
+        rms = np.sqrt(np.einsum("ij,ij->i", block, block, dtype=np.float64) / frame_length)
+        block_db = 20 * np.log10(np.maximum(rms, 1e-10))
+        rms_db[start:end] = block_db
+
+        # Only frames above the silence floor can be voiced
+        loud = np.flatnonzero(block_db >= SILENCE_DB)
+        if len(loud) == 0:
+            continue
+        block_f0, strength = _block_f0(block[loud].astype(np.float64), sample_rate, nfft, min_lag, max_lag)
+        is_voiced = strength >= VOICING_THRESHOLD
+        voiced[start + loud[is_voiced]] = True
+        f0[start + loud[is_voiced]] = block_f0[is_voiced]
+    return rms_db, f0, voiced
+
+
+def _summarize(rms_db, f0, voiced, duration):
+    n_frames = len(rms_db)
+    silent = rms_db < SILENCE_DB
+    pause_lengths = _runs(silent) * HOP_SECONDS
+    pauses = pause_lengths[pause_lengths >= MIN_PAUSE_SECONDS]
+    voiced_f0 = f0[voiced]
+    return {
+        "duration": round(duration, 2),
+        "pitch": round(float(voiced_f0.mean()), 2) if len(voiced_f0) else 0.0,
+        "pitchStd": round(float(voiced_f0.std()), 2) if len(voiced_f0) else 0.0,
+        "voicedRatio": round(float(voiced.mean()), 4) if n_frames else 0.0,
+        "loudness": round(float(np.median(rms_db[~silent])), 2) if (~silent).any() else float(SILENCE_DB),
+        "silence": round(float(silent.sum() * HOP_SECONDS), 2),
+        "silenceRatio": round(float(silent.mean()), 4) if n_frames else 0.0,
+        "pauseCount": int(len(pauses)),
+        "meanPause": round(float(pauses.mean()), 2) if len(pauses) else 0.0,
+        "longestPause": round(float(pauses.max()), 2) if len(pauses) else 0.0,
+    }
+
+
+def _result(rms_db, f0, voiced, duration):
+    return {
+        "frames": {
+            "time": np.arange(len(rms_db)) * HOP_SECONDS,
+            "rms_db": rms_db,
+            "f0": f0,
+            "voiced": voiced,
+        },
+        "summary": _summarize(rms_db, f0, voiced, duration),
+    }
+
+
+def extract(samples, sample_rate):
+    """Compute framewise prosody arrays and summary statistics.
+
+    Returns {"frames": {...}, "summary": {...}} where frames holds per-frame
+    "time", "rms_db", "f0" (0 for unvoiced frames) and "voiced" arrays.
+    """
+    frame_length, hop_length = _frame_params(sample_rate)[:2]
+    frames = frame_signal(np.asarray(samples, dtype=np.float32), frame_length, hop_length)
+    rms_db, f0, voiced = _frame_features(frames, sample_rate)
+    return _result(rms_db, f0, voiced, len(samples) / sample_rate)
+
+
+class StreamingProsody:
+    """extract() for audio that arrives in pieces.
+
+    Each feed() analyses the frames that are complete so far and keeps the
+    few samples that overlap the next frame, so the per-frame arrays (and the
+    summary) match what extract() gives for the whole recording.
+    """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.frame_length, self.hop_length = _frame_params(sample_rate)[:2]
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.total = 0
+        self.parts = []
+
+    def feed(self, samples):
+        """Add samples and return the summary of everything received so far."""
+        samples = np.asarray(samples, dtype=np.float32)
+        self.total += len(samples)
+        self.pending = np.concatenate((self.pending, samples))
+        if len(self.pending) >= self.frame_length:
+            frames = frame_signal(self.pending, self.frame_length, self.hop_length)
+            self.parts.append(_frame_features(frames, self.sample_rate))
+            self.pending = self.pending[len(frames) * self.hop_length:]
+        return _summarize(*self._arrays(), self.total / self.sample_rate)
+
+    def _arrays(self):
+        if not self.parts:
+            return np.zeros(0, np.float32), np.zeros(0, np.float32), np.zeros(0, bool)
+        return tuple(np.concatenate(arrays) for arrays in zip(*self.parts))
+
+    def finish(self):
+        """Return the same {"frames", "summary"} dict extract() would."""
+        if not self.parts:
+            # Shorter than one frame: extract() pads it to a single frame
+            frames = frame_signal(self.pending, self.frame_length, self.hop_length)
+            self.parts.append(_frame_features(frames, self.sample_rate))
+        return _result(*self._arrays(), self.total / self.sample_rate)
+
+
+def speaking_pace(transcript, duration):
+    """Words per minute for a transcript spoken over duration seconds."""
+    if duration <= 0:
+        return 0.0
+    return round(len(transcript.split()) / (duration / 60), 2)
@@ -1,23 +1,20 @@
 import torch
 import librosa
-from transformers import Wav2Vec2Processor, Wav2Vec2ForSequenceClassification
+from model import registry
+from model.emotion import prepare_inputs
 
-# Choose device
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
-# Load the pre-trained model and processor from Hugging Face
+# Pre-trained model from Hugging Face; loaded lazily through the shared registry
 model_name = "superb/wav2vec2-base-superb-er"
-processor = Wav2Vec2Processor.from_pretrained(model_name)
-model = Wav2Vec2ForSequenceClassification.from_pretrained(model_name).to(device)
 
-def predict_emotion(audio_path):
+def predict_emotion(audio_path, model_name=model_name):
+    model, processor = registry.get_emotion_model(model_name)
     # Load audio
     y, sr = librosa.load(audio_path, sr=16000)
     # Preprocess
-    inputs = processor(y, sampling_rate=sr, return_tensors="pt", padding=True).to(device)
+    inputs = prepare_inputs(processor(y, sampling_rate=sr, return_tensors="pt", padding=True), model)
     # Predict
     with torch.no_grad():
-        logits = model(**inputs).logits
+        logits = model(**inputs).logits.float()
     # For multi-label, use sigmoid; for single-label, use softmax
     probs = torch.sigmoid(logits).squeeze().cpu().numpy()
     labels = model.config.id2label
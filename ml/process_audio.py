@@ -1,50 +1,31 @@
 import sys
 import os
+import argparse
+import base64
+import collections
+import contextvars
+import csv
+import gc
 import json
+import queue
+import selectors
+import signal
+import threading
+import time
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 # Add the ml directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from model.utils.lazy import import_times, lazy_import, missing_modules
+
+__version__ = "1.0.0"
+
 def check_dependencies():
-    missing_packages = []
-    try:
-        import whisper
-    except ImportError:
-        missing_packages.append("whisper-openai")
-    
-    try:
-        import librosa
-    except ImportError:
-        missing_packages.append("librosa")
-    
-    try:
-        import torch
-    except ImportError:
-        missing_packages.append("torch")
-    
-    try:
-        import numpy
-    except ImportError:
-        missing_packages.append("numpy")
-    
-    try:
-        from pydub import AudioSegment
-    except ImportError:
-        missing_packages.append("pydub")
-    
-    try:
-        from transformers import (
-            Wav2Vec2Processor,
-            Wav2Vec2ForSequenceClassification,
-            AutoFeatureExtractor,
-            AutoConfig,
-            AutoModelForAudioClassification,
-            pipeline
-        )
-    except ImportError:
-        missing_packages.append("transformers")
-    
+    """Check the required packages are installed without importing them."""
+    missing_packages = missing_modules()
     if missing_packages:
         error_msg = f"Missing required Python packages: {', '.join(missing_packages)}\n"
         error_msg += "Please install them using: pip install " + " ".join(missing_packages)
@@ -52,34 +33,32 @@ def check_dependencies():
         return False
     return True
 
-# Check dependencies first
-if not check_dependencies():
-    sys.exit(1)
-
-# Now import the required packages
-import whisper
-import librosa
-import torch
+# Heavy libraries are imported the first time a stage uses them, so argument
+# errors, --help, --version and --check return immediately
 import numpy as np
-from pydub import AudioSegment
-from transformers import (
-    Wav2Vec2Processor,
-    Wav2Vec2ForSequenceClassification,
-    AutoFeatureExtractor,
-    AutoConfig,
-    AutoModelForAudioClassification,
-    pipeline
-)
-from model.utils.pdf_generator import generate_pdf
+torch = lazy_import("torch")
+librosa = lazy_import("librosa")
+from model import batching, emotion, registry, text_emotion, tiering, transcription
+from model.utils import cache as result_cache
+from model.utils import preprocessing, profiling, prosody
+from model.utils.audio import AudioContext
 
 # ============ CONFIG =============
 SAVE_PDF_DIR = "server/uploads/reports"
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
-# Load text emotion classification pipeline
-# print("Loading text emotion model...", file=sys.stderr)
-# text_emotion_classifier = pipeline("sentiment-analysis", model="j-hartmann/emotion-english-distilroberta-base", device=0 if device=="cuda" else -1)
-# print("Text emotion model loaded successfully", file=sys.stderr)
+# Model names and device live in model.registry (THERAVOX_* env vars or CLI flags)
+PARALLEL_STAGES = os.environ.get("THERAVOX_PARALLEL", "1") != "0"  # Run transcription/emotion/prosody concurrently
+TORCH_THREADS = int(os.environ.get("THERAVOX_TORCH_THREADS", "0"))  # 0 = one per CPU core
+REPORT_TIMINGS = os.environ.get("THERAVOX_TIMINGS", "0") == "1"
+METRICS_FILE = os.environ.get("THERAVOX_METRICS_FILE")  # Worker mode: Prometheus text file rewritten after each job
+METRICS_PORT = int(os.environ.get("THERAVOX_METRICS_PORT", "0"))  # Worker mode: serve /metrics on this port (0 = off)
+METRICS_HOST = os.environ.get("THERAVOX_METRICS_HOST", "127.0.0.1")  # Address /metrics listens on (0.0.0.0 = every interface)
+WORKER_CONCURRENCY = int(os.environ.get("THERAVOX_WORKER_CONCURRENCY", "1"))  # Jobs one --serve worker runs at once
+WORKER_PROCESSES = int(os.environ.get("THERAVOX_WORKER_PROCESSES", "1"))  # --serve: forked processes sharing the models
+WORKER_MAX_JOBS = int(os.environ.get("THERAVOX_WORKER_MAX_JOBS", "100"))  # Forked workers are replaced after this many jobs (0 = never)
+TEXT_EMOTIONS = os.environ.get("THERAVOX_TEXT_EMOTIONS", "0") == "1"  # Also classify the transcript text (model.text_emotion)
+STREAM_IDLE_SECONDS = float(os.environ.get("THERAVOX_STREAM_IDLE_SECONDS", "300"))  # Drop stream sessions idle this long (0 = never)
+MAX_STREAMS = int(os.environ.get("THERAVOX_MAX_STREAMS", "16"))  # Open stream sessions per worker process (0 = no limit)
+EMOTION_BATCHER = None  # Shared emotion micro-batcher, started by serve() when jobs run concurrently
 
 # ==================================
 
@@ -94,16 +73,6 @@ class NumpyEncoder(json.JSONEncoder):
             return obj.tolist()
         return super(NumpyEncoder, self).default(obj)
 
-# Load models
-whisper_model = whisper.load_model("base")  # Using base model for faster processing
-
-# Use a more accurate emotion recognition model
-emotion_model_name = "r-f/wav2vec-english-speech-emotion-recognition"  # English emotion recognition model
-
-# Load model and feature extractor for audio classification
-emotion_model = AutoModelForAudioClassification.from_pretrained(emotion_model_name).to(device)
-feature_extractor = AutoFeatureExtractor.from_pretrained(emotion_model_name)
-
 # Define allowed emotions and their mapping
 ALLOWED_EMOTIONS = {
     'neutral': 'neutral',
@@ -113,229 +82,159 @@ ALLOWED_EMOTIONS = {
     'angry': 'angry'
 }
 
-# Get label to ID and ID to label mappings from the model
-label2id = emotion_model.config.label2id
-id2label = emotion_model.config.id2label
-
-# Set model to evaluation mode
-emotion_model.eval()
-
-# def analyze_text_emotions(text):
-#     """Analyze emotions from text transcript using a pre-trained model."""
-#     try:
-#         if not text or text == "Transcription failed":
-#             return []
-#         # The dair-ai/emotion model outputs a list of dictionaries with label and score
-#         results = text_emotion_classifier(text)
-#         // console.log('[DashboardPatient] Raw text emotion analysis results:', results);
-#         // Filter and format results (e.g., only report top emotions or those above a threshold)
-#         formatted_emotions = []
-#         # Example: Get the top 3 emotions with score > 0.5
-#         for result in results[0]: # The pipeline returns a list containing one dictionary per input text
-#             if result['score'] > 0.5:
-#                  formatted_emotions.append(f"{result['label']} ({result['score']:.1%})")
-#         return formatted_emotions
-#     except Exception as e:
-#         print(f"Error analyzing text emotions: {str(e)}", file=sys.stderr)
-#         traceback.print_exc(file=sys.stderr)
-#         return []
-
-def convert_to_wav(audio_path):
-    """Convert audio to WAV format if needed."""
+def decode_audio(audio_path):
+    """Decode an upload in memory into the AudioContext every stage shares.
+
+    Nothing is written to disk; unreadable or over-long files raise instead of
+    falling back to the original path.
+    """
     try:
-        # Check if file exists and is readable
-        if not os.path.exists(audio_path):
-            raise FileNotFoundError(f"Audio file not found: {audio_path}")
-        
-        # Try to read the file first to check permissions
-        with open(audio_path, 'rb') as f:
-            pass
-            
-        # If we get here, we can read the file
-        audio = AudioSegment.from_file(audio_path)
-        wav_path = audio_path.rsplit('.', 1)[0] + '.wav'
-        
-        # Create a temporary directory if needed
-        temp_dir = os.path.join(os.path.dirname(audio_path), 'temp')
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Save to temporary directory
-        temp_wav_path = os.path.join(temp_dir, os.path.basename(wav_path))
-        audio.export(temp_wav_path, format='wav')
-        return temp_wav_path
+        return AudioContext.from_file(audio_path)
     except PermissionError as e:
         print(f"Permission denied: {str(e)}", file=sys.stderr)
         raise
     except Exception as e:
-        print(f"Error converting audio: {str(e)}", file=sys.stderr)
-        return audio_path
+        print(f"Error decoding audio: {str(e)}", file=sys.stderr)
+        raise
 
-def transcribe(audio_path):
-    """Transcribe audio using Whisper."""
+def transcribe_detailed(audio):
+    """Transcribe a whole recording (an AudioContext or a file path) using Whisper.
+
+    Returns a dict with the stitched text, timestamped segments and throughput stats.
+    """
     try:
-        # Convert to WAV if needed
-        wav_path = convert_to_wav(audio_path)
-        
-        # Load and preprocess audio
-        audio = whisper.load_audio(wav_path)
-        audio = whisper.pad_or_trim(audio)
+        tier = tiering.current()
+        whisper_model = registry.get_whisper(tier["whisperModel"], tier["whisperPrecision"])
         
-        # Make log-Mel spectrogram
-        mel = whisper.log_mel_spectrogram(audio).to(device)
+        # Decode once (no-op for an AudioContext) and take the 16kHz buffer
+        ctx = AudioContext.ensure(audio)
+        samples = ctx.at_rate(transcription.SAMPLE_RATE)
         
-        # Detect language and transcribe
-        _, probs = whisper_model.detect_language(mel)
-        lang = max(probs, key=probs.get)
-        
-        # Decode with options
-        options = whisper.DecodingOptions(
-            fp16=False,
-            language="en",  # Explicitly set language to English
-            task="transcribe"
-        )
-        result = whisper_model.decode(mel, options)
-        
-        return result.text
+        result = transcription.transcribe_long(whisper_model, samples)
+        print(f"Transcription throughput: {result['stats']['throughput']}x realtime", file=sys.stderr)
+        return result
     except Exception as e:
         print(f"Error in transcription: {str(e)}", file=sys.stderr)
-        return "Transcription failed"
-
-def preprocess_audio(y, sr):
-    """Enhanced audio preprocessing for better emotion detection."""
-    # 1. Resample to 16kHz if needed
-    if sr != 16000:
-        y = librosa.resample(y=y, orig_sr=sr, target_sr=16000)
-        sr = 16000
-    
-    # 2. Normalize audio
-    y = librosa.util.normalize(y)
-    
-    # 3. Apply pre-emphasis filter
-    y = librosa.effects.preemphasis(y)
-    
-    # 4. Trim silence with more aggressive threshold
-    y, _ = librosa.effects.trim(y, top_db=25)
-    
-    # 5. Apply dynamic range compression
-    y = librosa.effects.preemphasis(y, coef=0.97)
-    
-    # 6. Apply noise reduction
-    y = librosa.effects.preemphasis(y, coef=0.95)
-    
-    # 7. Apply spectral subtraction for noise reduction
-    D = librosa.stft(y)
-    D_harmonic, D_percussive = librosa.decompose.hpss(D)
-    y = librosa.istft(D_harmonic)
-    
+        return {"text": "Transcription failed", "segments": [], "stats": {}}
+
+def transcribe(audio):
+    """Transcribe audio (an AudioContext or a file path) using Whisper."""
+    return transcribe_detailed(audio)["text"]
+
+def preprocess_audio(y, sr, return_info=False, pipeline=None):
+    """Enhanced audio preprocessing for better emotion detection.
+
+    pipeline picks one of model.utils.preprocessing.PIPELINES (default: fast).
+    With return_info=True also returns a dict with the pipeline name, the
+    seconds of leading silence trimmed and per-stage timings.
+    """
+    y, sr, info = preprocessing.run(y, sr, pipeline)
+    if return_info:
+        return y, sr, info
     return y, sr
 
-def detect_emotions(audio_path):
-    """Detect emotions using the updated model with enhanced processing."""
+def format_emotions(emotion_probs):
+    """Turn (emotion, percent) pairs into the reported "emotion (xx.x%)" strings."""
+    # Filter and collect allowed emotions above a threshold
+    reported_emotions = []
+    threshold = 15.0 # Only report emotions with probability above this threshold
+    
+    for label, prob in sorted(emotion_probs, key=lambda item: item[1], reverse=True):
+        if label in ALLOWED_EMOTIONS and prob >= threshold:
+             reported_emotions.append(f"{ALLOWED_EMOTIONS[label]} ({prob:.1f}%)")
+
+    # If no emotions are above the threshold, report the top one regardless
+    if not reported_emotions and emotion_probs:
+        top_emotion, top_prob = sorted(emotion_probs, key=lambda item: item[1], reverse=True)[0]
+        if top_emotion in ALLOWED_EMOTIONS:
+             reported_emotions.append(f"{ALLOWED_EMOTIONS[top_emotion]} ({top_prob:.1f}%)")
+        else: # If even the top emotion isn't in ALLOWED_EMOTIONS, default to neutral
+             reported_emotions.append("neutral (100%)")
+
+    # If no emotions were detected at all (very unlikely but for safety)
+    if not reported_emotions:
+         reported_emotions.append("neutral (100%)")
+
+    return reported_emotions
+
+def detect_emotions_detailed(audio):
+    """Detect emotions over the whole recording (an AudioContext or a file path).
+
+    Returns a dict with the aggregate "emotions" list and the per-window "timeline".
+    """
     try:
         print("Starting emotion detection...", file=sys.stderr)
+        tier = tiering.current()
+        emotion_model, feature_extractor = registry.get_emotion_model(tier["emotionModel"], tier["emotionPrecision"])
+        # The shared batcher runs the configured model; another tier's model classifies here
+        batcher = EMOTION_BATCHER if EMOTION_BATCHER and EMOTION_BATCHER.model is emotion_model else None
         
-        # Convert to WAV if needed
-        wav_path = convert_to_wav(audio_path)
-        print(f"Converted audio to WAV: {wav_path}", file=sys.stderr)
-        
-        # Load and preprocess audio with enhanced preprocessing
-        y, sr = librosa.load(wav_path, sr=feature_extractor.sampling_rate)
-        y, sr = preprocess_audio(y, sr)
+        # Take the shared waveform at the model's rate and preprocess it
+        ctx = AudioContext.ensure(audio)
+        sr = feature_extractor.sampling_rate
+        with profiling.span("emotions.preprocess"):
+            y, sr, preprocess_info = preprocess_audio(ctx.at_rate(sr), sr, return_info=True, pipeline=tier["preprocess"])
         print(f"Loaded and preprocessed audio: duration={len(y)/sr:.2f}s, sample_rate={sr}", file=sys.stderr)
         
         # Ensure audio is at least 1 second long
         if len(y) / sr < 1.0:
             print("Audio too short for emotion detection.", file=sys.stderr)
-            return ["neutral (100%)"]
+            return {"emotions": ["neutral (100%)"], "timeline": [], "preprocessing": preprocess_info}
 
-        # Process audio using the feature extractor
-        print("Extracting features...", file=sys.stderr)
-        inputs = feature_extractor(
-            y, 
-            sampling_rate=sr, 
-            return_tensors="pt",
-            padding=True,
-            max_length=16000,  # 1 second at 16kHz
-            truncation=True
+        print("Running windowed emotion model inference...", file=sys.stderr)
+        labels, timeline, mean_probs = emotion.classify_windows(
+            emotion_model, feature_extractor, y, sr, offset=preprocess_info["offset"], batcher=batcher
         )
+        print(f"Classified {len(timeline)} windows", file=sys.stderr)
         
-        print("Running emotion model inference...", file=sys.stderr)
-        with torch.no_grad():
-            outputs = emotion_model(**inputs)
-            logits = outputs.logits
-        
-        # Apply temperature scaling for better probability distribution
-        temperature = 0.2  # Lower temperature for more decisive predictions
-        scaled_logits = logits / temperature
-        probabilities = torch.softmax(scaled_logits, dim=-1)[0]
-        
-        # Get all emotions with their probabilities
-        emotion_probs = [(id2label.get(i, f'Label_{i}').lower(), p.item() * 100) for i, p in enumerate(probabilities)]
+        # Aggregate: mean probability of every emotion over all windows
+        emotion_probs = list(zip(labels, mean_probs.tolist()))
         
         print("All detected emotions with probabilities:", file=sys.stderr)
-        for emotion, prob in emotion_probs:
-            print(f"{emotion}: {prob:.2f}%", file=sys.stderr)
-
-        # Filter and collect allowed emotions above a threshold
-        reported_emotions = []
-        threshold = 15.0 # Only report emotions with probability above this threshold
-        
-        for emotion, prob in sorted(emotion_probs, key=lambda item: item[1], reverse=True):
-            if emotion in ALLOWED_EMOTIONS and prob >= threshold:
-                 reported_emotions.append(f"{ALLOWED_EMOTIONS[emotion]} ({prob:.1f}%)")
-            # Optional: include the top emotion even if below threshold if no others meet it
-            # if not reported_emotions and emotion in ALLOWED_EMOTIONS:
-            #     reported_emotions.append(f"{ALLOWED_EMOTIONS[emotion]} ({prob:.1f}%)")
-            #     break
-
-        # If no emotions are above the threshold, report the top one regardless
-        if not reported_emotions and emotion_probs:
-            top_emotion, top_prob = sorted(emotion_probs, key=lambda item: item[1], reverse=True)[0]
-            if top_emotion in ALLOWED_EMOTIONS:
-                 reported_emotions.append(f"{ALLOWED_EMOTIONS[top_emotion]} ({top_prob:.1f}%)")
-            else: # If even the top emotion isn't in ALLOWED_EMOTIONS, default to neutral
-                 reported_emotions.append("neutral (100%)")
-
-        # If no emotions were detected at all (very unlikely but for safety)
-        if not reported_emotions:
-             reported_emotions.append("neutral (100%)")
+        for label, prob in emotion_probs:
+            print(f"{label}: {prob:.2f}%", file=sys.stderr)
 
+        reported_emotions = format_emotions(emotion_probs)
         print(f"Reported emotions: {reported_emotions}", file=sys.stderr)
         
-        return reported_emotions
+        return {"emotions": reported_emotions, "timeline": timeline, "preprocessing": preprocess_info}
         
     except Exception as e:
         print(f"Error in emotion detection: {str(e)}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
-        return ["neutral (100%)"]
+        return {"emotions": ["neutral (100%)"], "timeline": [], "preprocessing": {}}
 
-def extract_audio_features(audio_path):
-    """Extract pitch, silence, pace, and transcript from audio."""
+def detect_emotions(audio):
+    """Detect emotions in audio (an AudioContext or a file path) with enhanced processing."""
+    return detect_emotions_detailed(audio)["emotions"]
+
+def detect_text_emotions(segments):
+    """Emotions in each sentence of the transcript segments; an empty list if the stage fails."""
     try:
-        # Convert to WAV if needed
-        wav_path = convert_to_wav(audio_path)
-        
-        # Load audio
-        y, sr = librosa.load(wav_path)
-        duration = librosa.get_duration(y=y, sr=sr)
-        
-        # Extract pitch using librosa
-        pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
-        pitch_values = pitches[magnitudes > np.median(magnitudes)]
-        avg_pitch = float(np.mean(pitch_values)) if len(pitch_values) > 0 else 0.0
+        model, tokenizer = registry.get_text_emotion_model()
+        return text_emotion.classify_segments(model, tokenizer, segments)
+    except Exception as e:
+        print(f"Error analyzing text emotions: {str(e)}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return []
+
+def extract_prosody(audio):
+    """Framewise loudness, pitch and pause features of audio (an AudioContext or a file path)."""
+    ctx = AudioContext.ensure(audio)
+    return prosody.extract(ctx.samples, ctx.sample_rate)
 
-        # Calculate silence
-        silence_threshold = -40
-        audio = AudioSegment.from_file(wav_path)
-        silent_chunks = [chunk for chunk in audio[::100] if chunk.dBFS < silence_threshold]
-        silence_time = float(len(silent_chunks) * 0.1)
+def extract_audio_features(audio, transcript=None):
+    """Extract pitch, silence, pace, and transcript from audio (an AudioContext or a file path)."""
+    try:
+        ctx = AudioContext.ensure(audio)
+        summary = extract_prosody(ctx)["summary"]
 
         # Get transcript and calculate pace
-        transcript = transcribe(wav_path)
-        word_count = len(transcript.split())
-        pace = float(word_count / (duration / 60)) if duration > 0 else 0.0
+        if transcript is None:
+            transcript = transcribe(ctx)
+        pace = prosody.speaking_pace(transcript, ctx.duration)
 
-        return round(avg_pitch, 2), round(silence_time, 2), round(pace, 2), transcript
+        return summary["pitch"], summary["silence"], pace, transcript
     except Exception as e:
         print(f"Error extracting audio features: {str(e)}", file=sys.stderr)
         return 0.0, 0.0, 0.0, "Feature extraction failed"
@@ -348,60 +247,246 @@ def summarize(text):
         return text
     return text[:120] + "..."
 
-def main(audio_path, patient_name="N/A", patient_age="N/A", patient_gender="N/A"):
+def generate_pdf(report_data, pdf_path=None):
+    """Write the PDF report; fpdf is only imported once a report is made."""
+    from model.utils.pdf_generator import generate_pdf as render_pdf
+    with profiling.span("pdf"):
+        return render_pdf(report_data, pdf_path)
+
+def render_pdfs(reports):
+    """PDF bytes of each report (None where one failed), rendered in memory."""
+    from model.utils.pdf_generator import generate_pdfs
+    with profiling.span("pdf", reports=len(reports)):
+        return generate_pdfs(reports, as_bytes=True)
+
+def analysis_config(tier=None):
+    """Settings that change the analysis output; part of the result cache key.
+
+    tier is the resolved model tier the job runs with (default: the configured models).
+    """
+    tier = tier or tiering.resolve("configured")
+    return {
+        **registry.model_names(),
+        "preprocess": preprocessing.DEFAULT_PIPELINE,
+        "emotionWindow": emotion.WINDOW_SECONDS,
+        "emotionHop": emotion.HOP_SECONDS,
+        "whisperLanguage": transcription.LANGUAGE,
+        "detectLanguage": transcription.DETECT_LANGUAGE,
+        "textEmotions": TEXT_EMOTIONS,
+        # What the tier runs, not its name or why it was picked
+        "tier": {key: value for key, value in tier.items() if key not in ("name", "policy")},
+    }
+
+def _from_cache(cached):
+    """A stored result as served on a cache hit: marked cached, without the run times of the job that made it."""
+    result = {**cached, "cached": True}
+    if "transcription" in result:
+        result["transcription"] = {key: value for key, value in result["transcription"].items()
+                                   if key not in ("wallSeconds", "throughput", "perWindow")}
+    if "preprocessing" in result:
+        result["preprocessing"] = {key: value for key, value in result["preprocessing"].items() if key != "timings"}
+    return result
+
+def _torch_thread_budget():
+    """Split the torch intra-op threads between the Whisper and emotion stages.
+
+    The split is best-effort: torch.set_num_threads() sets one count for the
+    whole process (OpenMP and MKL included), so while the stages overlap they
+    all run with whichever share was set last. That still keeps two stages from
+    each starting a thread per core, but it is not a per-stage limit.
+    """
+    total = TORCH_THREADS or os.cpu_count() or 1
+    whisper_threads = max(1, (total * 3 + 4) // 5)  # Whisper decoding is the heavier stage
+    emotion_threads = max(1, total - whisper_threads)
+    return whisper_threads, emotion_threads
+
+def _run_stage(name, fn, ctx, timings, torch_threads=None):
+    """Run one stage in a profiling span, recording its wall/CPU time and peak memory."""
+    if torch_threads:
+        # Process-wide, not per stage: overlapping stages share the last count set
+        torch.set_num_threads(torch_threads)
     try:
-        # Initialize models
-        print("Loading models...", file=sys.stderr)
-        whisper_model = whisper.load_model("base")  # Using base model for faster processing
-        
-        # Use a more accurate emotion recognition model
-        emotion_model_name = "r-f/wav2vec-english-speech-emotion-recognition"  # English emotion recognition model
-        
-        # Load model and feature extractor for audio classification
-        emotion_model = AutoModelForAudioClassification.from_pretrained(emotion_model_name).to(device)
-        feature_extractor = AutoFeatureExtractor.from_pretrained(emotion_model_name)
-        
-        # Get label to ID and ID to label mappings from the model
-        label2id = emotion_model.config.label2id
-        id2label = emotion_model.config.id2label
-        
-        # Set model to evaluation mode
-        emotion_model.eval()
-        
-        print("Models loaded successfully", file=sys.stderr)
-        
-        # Process the audio file
-        print(f"Processing audio file: {audio_path}", file=sys.stderr)
-        
-        # Get transcription
-        transcript = transcribe(audio_path)
-        print(f"Transcription: {transcript}", file=sys.stderr)
-        
-        # Get audio emotions
-        audio_emotions = detect_emotions(audio_path)
-        print(f"Detected audio emotions: {audio_emotions}", file=sys.stderr)
-
-        # Calculate audio features
-        y, sr = librosa.load(audio_path)
-        pitch = librosa.piptrack(y=y, sr=sr)[1].mean()
-        pace = len(transcript.split()) / (len(y) / sr) if (len(y)/sr) > 0 else 0.0  # words per second, handle division by zero
-        silence = librosa.effects.split(y, top_db=20)[0].shape[0] / len(y) if len(y) > 0 else 0.0 # silence duration ratio, handle division by zero
-        
-        # Generate summary
-        summary = summarize(transcript)
-        
-        # Prepare the result including patient info and both emotion types
-        result = {
-            "patientName": patient_name,
-            "patientAge": patient_age,
-            "patientGender": patient_gender,
-            "transcript": transcript,
-            "audioEmotions": audio_emotions,
-            "pitch": float(pitch),
-            "pace": float(pace),
-            "silence": float(silence),
-            "summary": summary
+        with profiling.span(name) as stage:
+            return fn(ctx)
+    finally:
+        timings[name] = stage.as_dict()
+
+def run_analysis(ctx, timings=None):
+    """Run every analysis stage on a decoded recording; returns the patient-independent results.
+
+    Transcription, emotion detection and prosody extraction are independent, so
+    they run concurrently on a small thread pool. Per-stage timings are written
+    into the timings dict when one is given. The optional text emotion stage
+    needs the transcript, so it starts once transcription is done.
+    """
+    timings = {} if timings is None else timings
+    if PARALLEL_STAGES:
+        whisper_threads, emotion_threads = _torch_thread_budget()
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="stage") as pool:
+            # Each stage runs in a copy of this context so its spans carry the job id
+            def submit(*args):
+                return pool.submit(contextvars.copy_context().run, _run_stage, *args)
+
+            transcription_future = submit("transcribe", transcribe_detailed, ctx, timings, whisper_threads)
+            emotion_future = submit("emotions", detect_emotions_detailed, ctx, timings, emotion_threads)
+            prosody_future = submit("prosody", extract_prosody, ctx, timings)
+            transcription_result = transcription_future.result()
+            text_emotion_result = None
+            if TEXT_EMOTIONS:
+                # Overlaps whatever is left of the audio emotion stage
+                text_emotion_result = submit("text_emotions", detect_text_emotions,
+                                             transcription_result["segments"], timings).result()
+            emotion_result = emotion_future.result()
+            prosody_result = prosody_future.result()
+    else:
+        transcription_result = _run_stage("transcribe", transcribe_detailed, ctx, timings)
+        text_emotion_result = None
+        if TEXT_EMOTIONS:
+            text_emotion_result = _run_stage("text_emotions", detect_text_emotions, transcription_result["segments"],
+                                             timings)
+        emotion_result = _run_stage("emotions", detect_emotions_detailed, ctx, timings)
+        prosody_result = _run_stage("prosody", extract_prosody, ctx, timings)
+
+    return _run_stage("postprocess", _combine_results,
+                      (ctx, transcription_result, emotion_result, prosody_result, text_emotion_result), timings)
+
+def _combine_results(stage_results):
+    """Merge the stage outputs into the result dict."""
+    ctx, transcription_result, emotion_result, prosody_result, text_emotion_result = stage_results
+    # Get transcription
+    transcript = transcription_result["text"]
+    print(f"Transcription: {transcript}", file=sys.stderr)
+    
+    # Get audio emotions
+    audio_emotions = emotion_result["emotions"]
+    print(f"Detected audio emotions: {audio_emotions}", file=sys.stderr)
+
+    # Calculate audio features: pitch in Hz, silence in seconds, pace in words per minute
+    prosody_summary = prosody_result["summary"]
+    pitch = prosody_summary["pitch"]
+    silence = prosody_summary["silence"]
+    pace = prosody.speaking_pace(transcript, ctx.duration)
+    
+    # Generate summary
+    summary = summarize(transcript)
+    
+    result = {
+        "transcript": transcript,
+        "transcriptSegments": transcription_result["segments"],
+        "transcription": transcription_result["stats"],
+        "audioEmotions": audio_emotions,
+        "emotionTimeline": emotion_result["timeline"],
+        "preprocessing": emotion_result["preprocessing"],
+        "pitch": float(pitch),
+        "pace": float(pace),
+        "silence": float(silence),
+        "prosody": prosody_summary,
+        "summary": summary
+    }
+    if "language" in transcription_result:
+        result["language"] = transcription_result["language"]
+    if text_emotion_result is not None:
+        result["textEmotions"] = text_emotion_result
+        text_emotion.merge_timeline(result["emotionTimeline"], text_emotion_result)
+    return result
+
+def analyze_audio(audio_path, patient_name="N/A", patient_age="N/A", patient_gender="N/A", report_timings=None,
+                  ctx=None, backlog=0, slots=None):
+    """Run the full analysis on one file and return the result dict.
+
+    With report_timings (default: THERAVOX_TIMINGS=1) the result gets a
+    "timings" key with wall/CPU seconds per stage. ctx can be an AudioContext
+    already decoded from audio_path (batch mode decodes ahead of time).
+    With tiering on, backlog (jobs waiting behind this one) and slots (jobs
+    run at once) feed the tier choice; the result's "tier" says which ran.
+    A result served from the cache has "cached": true and no transcription
+    or preprocessing run times, which belong to the job that stored it.
+    """
+    report_timings = REPORT_TIMINGS if report_timings is None else report_timings
+    timings = {}
+    job_wall, job_cpu = time.perf_counter(), time.process_time()
+    job_id = uuid.uuid4().hex[:12]
+    profiling.set_job(job_id)
+
+    def with_timings(result, cached=False):
+        total = {
+            "wall": round(time.perf_counter() - job_wall, 3),
+            "cpu": round(time.process_time() - job_cpu, 3),
         }
+        profiling.emit("job", job=job_id, audioPath=audio_path, cached=cached, **total)
+        profiling.set_job(None)
+        if report_timings:
+            timings["total"] = total
+            timings["imports"] = import_times()
+            result["timings"] = timings
+        return result
+
+    # Process the audio file
+    print(f"Processing audio file: {audio_path}", file=sys.stderr)
+    patient = {
+        "patientName": patient_name,
+        "patientAge": patient_age,
+        "patientGender": patient_gender,
+    }
+    
+    # Identical audio analysed with identical settings is served from the cache
+    cache = result_cache.get_cache()
+    if cache:
+        digest = result_cache.file_digest(audio_path)
+    if cache and not tiering.ENABLED:
+        cache_key = result_cache.make_key(digest, analysis_config())
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"Result cache hit for {audio_path}", file=sys.stderr)
+            return with_timings({**patient, **_from_cache(cached)}, cached=True)
+    
+    # Decode once; every stage below works on this in-memory waveform
+    if ctx is None:
+        ctx = _run_stage("decode", decode_audio, audio_path, timings)
+    print(f"Decoded audio: duration={ctx.duration:.2f}s, sample_rate={ctx.sample_rate}", file=sys.stderr)
+    
+    if tiering.ENABLED:
+        # The tier depends on the duration, so the cache is checked once it is known
+        tier = tiering.choose(ctx.duration, backlog, slots or WORKER_CONCURRENCY * max(1, WORKER_PROCESSES))
+        print(f"Model tier: {tier['name']} (predicted {tier['policy']['predictedSeconds']}s, "
+              f"budget {tier['policy']['budgetSeconds']}s)", file=sys.stderr)
+        if cache:
+            cache_key = result_cache.make_key(digest, analysis_config(tier))
+            # A stored result from this tier or a more accurate one beats running this tier now
+            for name in tiering.at_least(tier["name"]):
+                cached = cache.get(result_cache.make_key(digest, analysis_config(tiering.resolve(name))))
+                if cached is not None:
+                    print(f"Result cache hit for {audio_path} ({name} tier)", file=sys.stderr)
+                    return with_timings({**patient, **_from_cache(cached)}, cached=True)
+    else:
+        tier = tiering.resolve("configured")
+    token = tiering.set_current(tier)
+    try:
+        analysis = run_analysis(ctx, timings)
+    finally:
+        tiering.reset(token)
+    tiering.record(tier["name"], ctx.duration, time.perf_counter() - job_wall)
+    analysis["tier"] = tier
+    # Don't pin a failed transcription in the cache
+    if cache and analysis["transcript"] != "Transcription failed":
+        cache.put(cache_key, analysis, encoder=NumpyEncoder)
+    
+    # Prepare the result including patient info and both emotion types
+    return with_timings({**patient, **analysis})
+
+def main(audio_path, patient_name="N/A", patient_age="N/A", patient_gender="N/A", profile_dir=None):
+    global PARALLEL_STAGES
+    try:
+        if profile_dir:
+            # cProfile only sees the thread that enabled it, so the stages run
+            # on this thread instead of the stage pool
+            PARALLEL_STAGES = False
+            # Dump cProfile stats and a torch profiler trace for this one job
+            name = os.path.splitext(os.path.basename(audio_path))[0]
+            with profiling.profile(profile_dir, name):
+                result = analyze_audio(audio_path, patient_name, patient_age, patient_gender)
+        else:
+            result = analyze_audio(audio_path, patient_name, patient_age, patient_gender)
         
         # Print the result as JSON
         print(json.dumps(result, cls=NumpyEncoder))
@@ -412,18 +497,1054 @@ def main(audio_path, patient_name="N/A", patient_age="N/A", patient_gender="N/A"
         traceback.print_exc(file=sys.stderr)
         sys.exit(1)
 
+# ============ STREAMING =============
+# A StreamingSession analyses a live recording while it is still being made.
+# feed() takes each new piece of audio and returns what it completed (new
+# transcript segments and emotion windows) plus running prosody; finish()
+# processes only the audio still buffered (at most one Whisper window and one
+# emotion window) and returns the same result dict as analyze_audio().
+
+class StreamingSession:
+    """Incremental analysis of one live recording."""
+
+    def __init__(self):
+        whisper_model = registry.get_whisper()
+        emotion_model, feature_extractor = registry.get_emotion_model()
+        self.emotion_rate = feature_extractor.sampling_rate
+        self.transcriber = transcription.StreamingTranscriber(whisper_model)
+        self.emotions = emotion.StreamingClassifier(
+            emotion_model, feature_extractor, self.emotion_rate, batcher=EMOTION_BATCHER
+        )
+        self.prosody = prosody.StreamingProsody(transcription.SAMPLE_RATE)
+        self.text_emotions = []  # Classified as their segments complete, so finish() only has the last one left
+        self.started = time.time()
+        self.last_used = self.started
+
+    @property
+    def duration(self):
+        return self.prosody.total / self.prosody.sample_rate
+
+    def _audio_emotions(self):
+        mean_probs = self.emotions.mean_probs()
+        if mean_probs is None:
+            return ["neutral (100%)"]
+        return format_emotions(list(zip(self.emotions.labels, mean_probs.tolist())))
+
+    def feed(self, samples, sample_rate=transcription.SAMPLE_RATE):
+        """Analyse the next piece of audio and return the partial result."""
+        samples = np.asarray(samples, dtype=np.float32)
+        if sample_rate != transcription.SAMPLE_RATE:
+            samples = librosa.resample(y=samples, orig_sr=sample_rate, target_sr=transcription.SAMPLE_RATE)
+        emotion_samples = samples
+        if self.emotion_rate != transcription.SAMPLE_RATE:
+            emotion_samples = librosa.resample(y=samples, orig_sr=transcription.SAMPLE_RATE, target_sr=self.emotion_rate)
+
+        new_segments = self.transcriber.feed(samples)
+        new_windows = self.emotions.feed(emotion_samples)
+        prosody_summary = self.prosody.feed(samples)
+        transcript = self.transcriber.text
+        partial = {
+            "received": round(self.duration, 2),
+            "transcript": transcript,
+            "newSegments": new_segments,
+            "newEmotionWindows": new_windows,
+            "audioEmotions": self._audio_emotions(),
+            "prosody": prosody_summary,
+            "pace": float(prosody.speaking_pace(transcript, self.duration)),
+        }
+        if TEXT_EMOTIONS:
+            partial["newTextEmotions"] = detect_text_emotions(new_segments) if new_segments else []
+            self.text_emotions += partial["newTextEmotions"]
+        return partial
+
+    def finish(self):
+        """Flush the buffered audio and return the full analysis result."""
+        final_segments = self.transcriber.finish()
+        self.emotions.finish()
+        prosody_summary = self.prosody.finish()["summary"]
+        transcript = self.transcriber.text
+        print(f"Streaming session finished: {self.duration:.1f}s of audio", file=sys.stderr)
+        result = {
+            "transcript": transcript,
+            "transcriptSegments": self.transcriber.segments,
+            "transcription": self.transcriber.stats(),
+            "audioEmotions": self._audio_emotions(),
+            "emotionTimeline": self.emotions.timeline,
+            "preprocessing": {"pipeline": "stream", "offset": 0.0, "timings": {}},
+            "pitch": float(prosody_summary["pitch"]),
+            "pace": float(prosody.speaking_pace(transcript, self.duration)),
+            "silence": float(prosody_summary["silence"]),
+            "prosody": prosody_summary,
+            "summary": summarize(transcript),
+            "tier": tiering.resolve("configured"),
+        }
+        if TEXT_EMOTIONS:
+            if final_segments:
+                self.text_emotions += detect_text_emotions(final_segments)
+            result["textEmotions"] = self.text_emotions
+            text_emotion.merge_timeline(result["emotionTimeline"], self.text_emotions)
+        return result
+
+# ============ WORKER MODE =============
+# `python process_audio.py --serve` keeps the models above loaded and reads
+# one JSON request per line from stdin, answering with one JSON line on stdout:
+#   {"id": "1", "op": "analyze", "audioPath": "...", "patientName": "..."}
+#   {"id": "2", "op": "health"}
+#   {"id": "6", "op": "render-pdf", "reports": [{...result...}]}  -> {"pdfs": ["<base64>", ...]}
+# Every response echoes the request id and carries "ok"; analyze responses put
+# the same dict main() prints under "result". Live recordings use a session:
+#   {"id": "3", "op": "stream-start"}                  -> {"sessionId": "..."}
+#   {"id": "4", "op": "stream-chunk", "sessionId": "...", "pcm": "<base64 int16 LE>", "sampleRate": 16000}
+#   {"id": "5", "op": "stream-finish", "sessionId": "...", "patientName": "..."}
+# stream-chunk may give "audioPath" (a file holding just that piece) instead of
+# "pcm"; its "result" is the partial result, stream-finish's the full one.
+# Stage spans are logged to stderr as JSON events (see model.utils.profiling);
+# --metrics-file / --metrics-port export them in Prometheus text format. With --concurrency N up to N
+# analyze requests run at once (responses may come back out of order) and their
+# emotion windows are classified together by a shared model.batching.MicroBatcher.
+
+def _handle_request(request, state):
+    """Dispatch one worker request and return the response dict."""
+    op = request.get("op", "analyze")
+    if op == "health":
+        return {
+            "ok": True,
+            "status": "ready",
+            "pid": os.getpid(),
+            "device": registry.get_device(),
+            "precision": registry.get_config()["precision"],
+            "models": registry.loaded_models(),
+            "loadTimes": registry.load_metrics(),
+            "importTimes": import_times(),
+            "uptime": round(time.time() - state["started"], 3),
+            "jobs": state["jobs"],
+            "failures": state["failures"],
+            "concurrency": WORKER_CONCURRENCY,
+            "streams": len(state["streams"]),
+            "cache": result_cache.get_cache().stats() if result_cache.ENABLED else None,
+            "emotionBatching": EMOTION_BATCHER.stats() if EMOTION_BATCHER else None,
+            "modelCache": registry.cache_usage(),
+            "tiers": tiering.stats() if tiering.ENABLED else None,
+        }
+    if op.startswith("stream-"):
+        return _handle_stream(request, state)
+    if op == "render-pdf":
+        reports = request.get("reports")
+        if not isinstance(reports, list):
+            return {"ok": False, "error": "reports must be a list of report objects"}
+        pdfs = render_pdfs(reports)
+        response = {"ok": all(pdf is not None for pdf in pdfs),
+                    "pdfs": [base64.b64encode(pdf).decode("ascii") if pdf is not None else None for pdf in pdfs]}
+        if not response["ok"]:
+            response["error"] = f"{pdfs.count(None)} of {len(pdfs)} reports failed to render"
+        return response
+    if op != "analyze":
+        return {"ok": False, "error": f"Unknown op: {op}"}
+
+    audio_path = request.get("audioPath")
+    if not audio_path:
+        return {"ok": False, "error": "audioPath is required"}
+    if not os.path.exists(audio_path):
+        return {"ok": False, "error": f"Audio file not found: {audio_path}"}
+
+    with state["lock"]:
+        state["jobs"] += 1
+    started = time.time()
+    try:
+        result = analyze_audio(
+            audio_path,
+            request.get("patientName", "N/A"),
+            request.get("patientAge", "N/A"),
+            request.get("patientGender", "N/A"),
+            report_timings=request.get("timings"),
+            backlog=request.get("backlog") or 0,
+            slots=request.get("slots"),
+        )
+    except Exception as e:
+        with state["lock"]:
+            state["failures"] += 1
+        print(f"Error processing audio: {str(e)}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return {"ok": False, "error": str(e)}
+    print(f"Job finished in {time.time() - started:.2f}s", file=sys.stderr)
+    return {"ok": True, "result": result}
+
+def _handle_stream(request, state):
+    """Handle the stream-start/-chunk/-finish ops of a live recording session."""
+    op = request["op"]
+    streams = state["streams"]
+    if op == "stream-start":
+        if MAX_STREAMS and len(streams) >= MAX_STREAMS:
+            return {"ok": False, "error": f"Too many open stream sessions ({len(streams)})"}
+        session_id = request.get("sessionId") or uuid.uuid4().hex
+        session = StreamingSession()
+        with state["lock"]:
+            streams[session_id] = session
+        return {"ok": True, "sessionId": session_id}
+
+    session = streams.get(request.get("sessionId"))
+    if session is None:
+        return {"ok": False, "error": f"Unknown stream session: {request.get('sessionId')}"}
+    session.last_used = time.time()
+    try:
+        if op == "stream-chunk":
+            if request.get("pcm") is not None:
+                pcm = np.frombuffer(base64.b64decode(request["pcm"]), dtype="<i2")
+                samples = pcm.astype(np.float32) / 32768.0
+                sample_rate = int(request.get("sampleRate", transcription.SAMPLE_RATE))
+            elif request.get("audioPath"):
+                samples, sample_rate = AudioContext.from_file(request["audioPath"]).samples, transcription.SAMPLE_RATE
+            else:
+                return {"ok": False, "error": "stream-chunk needs pcm or audioPath"}
+            result = session.feed(samples, sample_rate)
+            session.last_used = time.time()  # Idle time counts from the end of the last chunk
+            return {"ok": True, "result": result}
+        if op == "stream-finish":
+            with state["lock"]:
+                streams.pop(request["sessionId"], None)
+            result = session.finish()
+            return {"ok": True, "result": {
+                "patientName": request.get("patientName", "N/A"),
+                "patientAge": request.get("patientAge", "N/A"),
+                "patientGender": request.get("patientGender", "N/A"),
+                **result,
+            }}
+    except Exception as e:
+        print(f"Error in streaming analysis: {str(e)}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return {"ok": False, "error": str(e)}
+    return {"ok": False, "error": f"Unknown op: {op}"}
+
+def _expire_streams(state):
+    """Drop stream sessions nobody has used for STREAM_IDLE_SECONDS, with their buffers."""
+    cutoff = time.time() - STREAM_IDLE_SECONDS
+    with state["lock"]:
+        expired = [session_id for session_id, session in state["streams"].items() if session.last_used < cutoff]
+        for session_id in expired:
+            del state["streams"][session_id]
+    for session_id in expired:
+        print(f"Dropped stream session {session_id} after {STREAM_IDLE_SECONDS:.0f}s without a request", file=sys.stderr)
+
+def _worker_gauges(state):
+    """Worker-level values exported next to the stage metrics."""
+    gauges = [
+        ("worker_jobs_total", "counter", "Analyze requests handled by this worker", state["jobs"]),
+        ("worker_failures_total", "counter", "Analyze requests that failed", state["failures"]),
+        ("worker_uptime_seconds", "gauge", "Seconds since the worker started", round(time.time() - state["started"], 3)),
+        ("worker_rss_megabytes", "gauge", "Resident memory of the worker", round(profiling.rss_mb(), 1)),
+        ("worker_streams", "gauge", "Open streaming sessions", len(state["streams"])),
+    ]
+    if EMOTION_BATCHER:
+        batch_stats = EMOTION_BATCHER.stats()
+        gauges += [
+            ("emotion_batches_total", "counter", "Shared emotion forward passes", batch_stats["batches"]),
+            ("emotion_batch_windows_total", "counter", "Windows classified in shared batches", batch_stats["windows"]),
+            ("emotion_batch_size_mean", "gauge", "Mean windows per shared forward pass", batch_stats["meanBatchSize"]),
+        ]
+    if tiering.ENABLED:
+        tier_stats = tiering.stats()
+        gauges += [
+            ("tier_jobs_total", "counter", "Analyze jobs run with each model tier",
+             [({"tier": name}, values["jobs"]) for name, values in tier_stats.items()]),
+            ("tier_cost_seconds_per_audio_second", "gauge", "Learned analysis seconds per audio second of each tier",
+             [({"tier": name}, values["cost"]) for name, values in tier_stats.items()]),
+        ]
+    gauges.append(("model_cache_megabytes", "gauge", "Memory held by the cached models",
+                   registry.cache_usage()["totalMb"]))
+    if TEXT_EMOTIONS:
+        cache_stats = text_emotion.cache_stats()
+        gauges += [
+            ("text_emotion_cache_hits_total", "counter", "Segment texts served from the text emotion cache", cache_stats["hits"]),
+            ("text_emotion_cache_misses_total", "counter", "Segment texts run through the text emotion model", cache_stats["misses"]),
+            ("text_emotion_cache_entries", "gauge", "Segment texts held in the text emotion cache", cache_stats["entries"]),
+        ]
+    return gauges
+
+def serve(stdin=None, stdout=None):
+    """Answer JSON-lines requests until stdin closes."""
+    global EMOTION_BATCHER
+    stdin = stdin or sys.stdin
+    out = stdout or sys.stdout
+    # Anything a library prints must not end up in the protocol stream
+    sys.stdout = sys.stderr
+    send_lock = threading.Lock()
+
+    def send(message):
+        line = json.dumps(message, cls=NumpyEncoder) + "\n"
+        with send_lock:
+            out.write(line)
+            out.flush()
+
+    def respond(request):
+        response = _handle_request(request, state)
+        response["id"] = request.get("id")
+        send(response)
+        if METRICS_FILE:
+            try:
+                profiling.write_prometheus_file(METRICS_FILE, _worker_gauges(state))
+            except OSError as e:
+                print(f"Could not write metrics file {METRICS_FILE}: {str(e)}", file=sys.stderr)
+
+    state = {"started": time.time(), "jobs": 0, "failures": 0, "lock": threading.Lock(), "streams": {}}
+    # Load the models before announcing readiness so the first job is warm
+    registry.preload(text_emotion=TEXT_EMOTIONS)
+    if tiering.ENABLED:
+        tiering.preload()
+    pool = None
+    if WORKER_CONCURRENCY > 1:
+        pool = ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY, thread_name_prefix="job")
+        EMOTION_BATCHER = batching.MicroBatcher(*registry.get_emotion_model(), torch_threads=_torch_thread_budget()[1])
+    if STREAM_IDLE_SECONDS:
+        def expire_streams_forever():
+            while True:
+                time.sleep(min(60.0, STREAM_IDLE_SECONDS / 2))
+                _expire_streams(state)
+        threading.Thread(target=expire_streams_forever, name="stream-expiry", daemon=True).start()
+    if METRICS_PORT:
+        profiling.serve_prometheus(METRICS_PORT, lambda: _worker_gauges(state), host=METRICS_HOST)
+    send({"event": "ready", "pid": os.getpid(), "device": registry.get_device(), "loadTimes": registry.load_metrics(),
+          "importTimes": import_times(), "concurrency": WORKER_CONCURRENCY})
+
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            send({"ok": False, "error": f"Invalid JSON request: {str(e)}"})
+            continue
+        if not isinstance(request, dict):
+            send({"ok": False, "error": "Request must be a JSON object"})
+            continue
+        if pool and request.get("op", "analyze") == "analyze":
+            pool.submit(respond, request)
+        else:
+            respond(request)
+
+    if pool:
+        pool.shutdown(wait=True)
+
+# ============ PRE-FORK MODE =============
+# `--serve --processes N` speaks the same JSON-lines protocol, but the jobs run
+# in N forked children. The parent loads the models once, freezes them
+# (registry.prepare_for_fork) and forks, so the children share the weight
+# pages copy-on-write instead of each holding its own copy. Every child runs
+# serve() on a pair of pipes with its share of the cores as TORCH_THREADS (and
+# as the thread count of its own ONNX Runtime session, which can't be shared) and
+# is replaced after WORKER_MAX_JOBS analyze jobs, which caps slow memory
+# growth. The parent only routes requests. Analyze requests go to the child
+# with the most free slots, or wait in a queue. Stream ops stay on the child
+# that owns the session; a session idle for STREAM_IDLE_SECONDS is dropped, so
+# an abandoned one can't keep its child from being replaced. The parent answers health itself, with the
+# RSS/PSS/shared memory of every process. The parent is a single-threaded
+# select loop, so fork() never happens while another thread holds a lock.
+
+class _Child:
+    """Parent-side handle of one pre-forked worker process."""
+
+    def __init__(self, pid, request_fd, response_fd):
+        self.pid = pid
+        self.request_fd = request_fd
+        self.response_fd = response_fd
+        self.started = time.time()
+        self.ready = False
+        self.retiring = False
+        self.jobs = 0
+        self.failures = 0
+        self.pending = {}  # Parent request id -> (caller's request id, op, session id)
+        self.sessions = set()
+        self.outbuf = bytearray()
+        self.inbuf = b""
+
+    @property
+    def running_jobs(self):
+        return sum(1 for _, op, _ in self.pending.values() if op in ("analyze", "render-pdf"))
+
+
+def _exit_with_parent(parent_pid):
+    """Have Linux kill this process when the parent dies, so a killed pool leaves no orphans."""
+    try:
+        import ctypes
+        ctypes.CDLL(None, use_errno=True).prctl(1, signal.SIGKILL)  # PR_SET_PDEATHSIG
+    except (OSError, AttributeError):
+        pass
+    if os.getppid() != parent_pid:
+        os._exit(1)
+
+
+class _PreforkPool:
+    def __init__(self, processes, out):
+        self.size = processes
+        self.out = out
+        self.threads = TORCH_THREADS or max(1, (os.cpu_count() or 1) // processes)
+        self.selector = selectors.DefaultSelector()
+        self.children = {}
+        self.sessions = {}  # Session id -> owning _Child
+        self.session_used = {}  # Session id -> time of its last request or answer
+        self.queue = collections.deque()
+        self.next_id = 1
+        self.started = time.time()
+        self.announced = False
+        self.restarts = 0
+        self.retired_jobs = self.retired_failures = 0
+
+    def send(self, message):
+        self.out.write(json.dumps(message, cls=NumpyEncoder) + "\n")
+        self.out.flush()
+
+    # ---- children ----
+    def spawn(self):
+        request_r, request_w = os.pipe()
+        response_r, response_w = os.pipe()
+        parent_pid = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                os.close(request_w)
+                os.close(response_r)
+                for child in self.children.values():
+                    if child.request_fd is not None:
+                        os.close(child.request_fd)
+                    os.close(child.response_fd)
+                self.selector.close()
+                self._run_child(parent_pid, request_r, response_w)
+                code = 0
+            except BaseException:
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                os._exit(code)  # Never fall back into the parent's loop
+
+        os.close(request_r)
+        os.close(response_w)
+        os.set_blocking(request_w, False)
+        child = _Child(pid, request_w, response_r)
+        self.children[pid] = child
+        self.selector.register(response_r, selectors.EVENT_READ, child)
+        print(f"Started worker process {pid} ({self.threads} torch threads)", file=sys.stderr)
+        return child
+
+    def _run_child(self, parent_pid, request_fd, response_fd):
+        global TORCH_THREADS, METRICS_FILE, METRICS_PORT
+        _exit_with_parent(parent_pid)
+        # Only the parent reads the caller's stdin and writes the protocol stream
+        os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+        os.dup2(2, 1)
+        TORCH_THREADS = self.threads
+        torch.set_num_threads(self.threads)
+        METRICS_FILE, METRICS_PORT = None, 0  # The parent exports the pool's metrics
+        if registry.model_names()["emotion_backend"] == "onnx":
+            from model import onnx_backend
+
+            # prepare_for_fork() closed the parent's session; open this child's
+            # with its share of the cores (0 would start one thread per core in every child)
+            onnx_backend.THREADS = self.threads
+            registry.preload(text_emotion=TEXT_EMOTIONS)
+            if tiering.ENABLED:
+                tiering.preload()
+        serve(os.fdopen(request_fd, "r"), os.fdopen(response_fd, "w"))
+
+    def retire(self, child):
+        """Stop giving child new work and start its replacement."""
+        child.retiring = True
+        self.restarts += 1
+        print(f"Retiring worker process {child.pid} after {child.jobs} jobs", file=sys.stderr)
+        self.spawn()
+        self._close_if_idle(child)
+
+    def _close_if_idle(self, child):
+        # Closing the request pipe ends the child's serve() loop; it exits once drained
+        if child.retiring and not child.pending and not child.sessions and child.request_fd is not None:
+            self._unwatch_writes(child)
+            os.close(child.request_fd)
+            child.request_fd = None
+
+    def _expire_sessions(self):
+        """Forget sessions idle for STREAM_IDLE_SECONDS, so they can't keep a retiring child alive.
+
+        The child drops its own copy by the same rule (see _expire_streams).
+        """
+        cutoff = time.time() - STREAM_IDLE_SECONDS
+        for session_id, used in list(self.session_used.items()):
+            child = self.sessions.get(session_id)
+            if used >= cutoff or (child and any(s == session_id for _, _, s in child.pending.values())):
+                continue
+            del self.session_used[session_id]
+            self.sessions.pop(session_id, None)
+            if child:
+                child.sessions.discard(session_id)
+                print(f"Dropped stream session {session_id} on worker process {child.pid} "
+                      f"after {STREAM_IDLE_SECONDS:.0f}s without a request", file=sys.stderr)
+                self._close_if_idle(child)
+
+    def _reap(self, child, closing):
+        self.selector.unregister(child.response_fd)
+        os.close(child.response_fd)
+        if child.request_fd is not None:
+            self._unwatch_writes(child)
+            os.close(child.request_fd)
+        _, status = os.waitpid(child.pid, 0)
+        del self.children[child.pid]
+        self.retired_jobs += child.jobs
+        self.retired_failures += child.failures
+
+        for caller_id, op, _ in child.pending.values():
+            self.send({"id": caller_id, "ok": False,
+                       "error": f"Worker process {child.pid} exited with status {os.waitstatus_to_exitcode(status)}"})
+            if op == "analyze":
+                self.retired_failures += 1
+        for session_id in child.sessions:
+            self.sessions.pop(session_id, None)
+            self.session_used.pop(session_id, None)
+
+        if child.retiring or closing:
+            print(f"Worker process {child.pid} exited", file=sys.stderr)
+        elif child.ready:
+            print(f"Worker process {child.pid} died, starting a replacement", file=sys.stderr)
+            self.restarts += 1
+            self.spawn()
+        else:
+            print(f"Worker process {child.pid} failed to start", file=sys.stderr)
+            self._announce_when_ready()
+
+    # ---- pipes ----
+    def _write(self, child, message):
+        child.outbuf += (json.dumps(message) + "\n").encode()
+        self._flush(child)
+
+    def _flush(self, child):
+        try:
+            written = os.write(child.request_fd, child.outbuf)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            written = len(child.outbuf)  # The child is gone; _reap() fails its requests
+        del child.outbuf[:written]
+        if child.outbuf:
+            try:
+                self.selector.register(child.request_fd, selectors.EVENT_WRITE, child)
+            except KeyError:
+                pass  # Already waiting for the pipe to drain
+        else:
+            self._unwatch_writes(child)
+
+    def _unwatch_writes(self, child):
+        try:
+            self.selector.unregister(child.request_fd)
+        except (KeyError, ValueError):
+            pass
+
+    def _read(self, child, closing):
+        data = os.read(child.response_fd, 1 << 16)
+        if not data:
+            self._reap(child, closing)
+            return
+        *lines, child.inbuf = (child.inbuf + data).split(b"\n")
+        for line in lines:
+            if line.strip():
+                self._on_message(child, json.loads(line))
+
+    def _on_message(self, child, message):
+        if message.get("event") == "ready":
+            child.ready = True
+            self._announce_when_ready()
+            self._dispatch()
+            return
+        if "event" in message:
+            return
+
+        caller_id, op, session_id = child.pending.pop(message.get("id"), (None, None, None))
+        message["id"] = caller_id
+        if op == "analyze" and not message.get("ok"):
+            child.failures += 1
+        elif op == "stream-finish" or (op == "stream-start" and not message.get("ok")):
+            child.sessions.discard(session_id)
+            self.sessions.pop(session_id, None)
+            self.session_used.pop(session_id, None)
+        elif session_id in self.session_used:
+            self.session_used[session_id] = time.time()
+        self.send(message)
+
+        self._close_if_idle(child)
+        self._dispatch()
+        if METRICS_FILE:
+            try:
+                profiling.write_prometheus_file(METRICS_FILE, self.gauges())
+            except OSError as e:
+                print(f"Could not write metrics file {METRICS_FILE}: {str(e)}", file=sys.stderr)
+
+    def _announce_when_ready(self):
+        # The caller gets one ready event, once every child that started is warm
+        if self.announced or not self.children or not all(c.ready for c in self.children.values()):
+            return
+        self.announced = True
+        self.send({"event": "ready", "pid": os.getpid(), "device": registry.get_device(),
+                   "loadTimes": registry.load_metrics(), "importTimes": import_times(),
+                   "concurrency": WORKER_CONCURRENCY * len(self.children), "processes": len(self.children),
+                   "workerPids": sorted(self.children)})
+
+    # ---- routing ----
+    def _forward(self, child, request, session_id=None):
+        request_id = str(self.next_id)
+        self.next_id += 1
+        child.pending[request_id] = (request.get("id"), request.get("op", "analyze"), session_id)
+        self._write(child, {**request, "id": request_id})
+
+    def _dispatch(self):
+        while self.queue:
+            free = [c for c in self.children.values()
+                    if c.ready and not c.retiring and c.running_jobs < WORKER_CONCURRENCY]
+            if not free:
+                return
+            child = min(free, key=lambda c: (c.running_jobs, len(c.sessions)))
+            request = self.queue.popleft()
+            if request.get("op", "analyze") == "analyze":
+                # For the tier choice: the jobs still queued here add to the caller's backlog
+                request = {**request, "backlog": (request.get("backlog") or 0) + len(self.queue),
+                           "slots": request.get("slots") or WORKER_CONCURRENCY * len(self.children)}
+            self._forward(child, request)
+            child.jobs += 1
+            if WORKER_MAX_JOBS and child.jobs >= WORKER_MAX_JOBS:
+                self.retire(child)
+
+    def handle(self, request):
+        op = request.get("op", "analyze")
+        if op == "health":
+            self.send({**self.health(), "id": request.get("id")})
+        elif op in ("analyze", "render-pdf"):
+            self.queue.append(request)
+            self._dispatch()
+        elif op == "stream-start":
+            candidates = [c for c in self.children.values() if not c.retiring]
+            child = min(candidates, key=lambda c: (not c.ready, len(c.sessions), c.running_jobs))
+            session_id = request.get("sessionId") or uuid.uuid4().hex
+            self.sessions[session_id] = child
+            self.session_used[session_id] = time.time()
+            child.sessions.add(session_id)
+            self._forward(child, {**request, "sessionId": session_id}, session_id)
+        elif op.startswith("stream-"):
+            session_id = request.get("sessionId")
+            child = self.sessions.get(session_id)
+            if child is None:
+                self.send({"id": request.get("id"), "ok": False, "error": f"Unknown stream session: {session_id}"})
+            else:
+                self.session_used[session_id] = time.time()
+                self._forward(child, request, session_id)
+        else:
+            self.send({"id": request.get("id"), "ok": False, "error": f"Unknown op: {op}"})
+
+    # ---- reporting ----
+    def processes(self):
+        return [{
+            "pid": child.pid,
+            "ready": child.ready,
+            "retiring": child.retiring,
+            "jobs": child.jobs,
+            "failures": child.failures,
+            "running": child.running_jobs,
+            "streams": len(child.sessions),
+            "uptime": round(time.time() - child.started, 3),
+            "torchThreads": self.threads,
+            "memory": profiling.process_memory(child.pid),
+        } for child in list(self.children.values())]
+
+    def health(self):
+        processes = self.processes()
+        parent_memory = profiling.process_memory()
+        pss = [p["memory"]["pssMb"] for p in processes if p["memory"]] + [parent_memory and parent_memory["pssMb"]]
+        return {
+            "ok": True,
+            "status": "ready",
+            "pid": os.getpid(),
+            "device": registry.get_device(),
+            "precision": registry.get_config()["precision"],
+            "models": registry.loaded_models(),
+            "modelCache": registry.cache_usage(),
+            "loadTimes": registry.load_metrics(),
+            "importTimes": import_times(),
+            "uptime": round(time.time() - self.started, 3),
+            "jobs": self.retired_jobs + sum(p["jobs"] for p in processes),
+            "failures": self.retired_failures + sum(p["failures"] for p in processes),
+            "concurrency": WORKER_CONCURRENCY * self.size,
+            "queued": len(self.queue),
+            "streams": len(self.sessions),
+            "restarts": self.restarts,
+            "maxJobsPerProcess": WORKER_MAX_JOBS,
+            "parent": {"pid": os.getpid(), "memory": parent_memory},
+            "processes": processes,
+            # PSS splits shared pages between their sharers, so this sum is the pool's real footprint
+            "totalPssMb": round(sum(pss), 1) if None not in pss else None,
+        }
+
+    def gauges(self):
+        health = self.health()
+        by_pid = [({"pid": p["pid"], "role": "worker"}, p["memory"]) for p in health["processes"]]
+        by_pid.append(({"pid": os.getpid(), "role": "parent"}, health["parent"]["memory"]))
+        return [
+            ("worker_jobs_total", "counter", "Analyze requests handled by the pool", health["jobs"]),
+            ("worker_failures_total", "counter", "Analyze requests that failed", health["failures"]),
+            ("worker_uptime_seconds", "gauge", "Seconds since the pool started", health["uptime"]),
+            ("worker_processes", "gauge", "Forked worker processes alive", len(health["processes"])),
+            ("worker_restarts_total", "counter", "Worker processes replaced (job limit or crash)", self.restarts),
+            ("worker_queued_jobs", "gauge", "Analyze requests waiting for a worker process", len(self.queue)),
+            ("worker_streams", "gauge", "Open streaming sessions", len(self.sessions)),
+            ("worker_process_rss_megabytes", "gauge", "Resident memory per process",
+             [(labels, memory["rssMb"]) for labels, memory in by_pid if memory]),
+            ("worker_process_shared_megabytes", "gauge", "Resident memory shared copy-on-write with other processes",
+             [(labels, memory["sharedMb"]) for labels, memory in by_pid if memory]),
+            ("worker_process_pss_megabytes", "gauge", "Proportional set size per process (shared pages split)",
+             [(labels, memory["pssMb"]) for labels, memory in by_pid if memory and memory["pssMb"] is not None]),
+        ]
+
+    # ---- main loop ----
+    def run(self, stdin_fd):
+        for _ in range(self.size):
+            self.spawn()
+        self.selector.register(stdin_fd, selectors.EVENT_READ, None)
+        stdin_open, buffer = True, b""
+
+        while self.children:
+            if not stdin_open and not self.queue and not any(c.pending for c in self.children.values()):
+                break
+            for key, events in self.selector.select(timeout=1.0):
+                child = key.data
+                if child is None:
+                    data = os.read(stdin_fd, 1 << 16)
+                    if not data:
+                        stdin_open = False
+                        self.selector.unregister(stdin_fd)
+                        continue
+                    *lines, buffer = (buffer + data).split(b"\n")
+                    for line in lines:
+                        self._on_request_line(line)
+                elif child.pid not in self.children:
+                    continue  # Reaped earlier in this round
+                elif events & selectors.EVENT_WRITE and key.fd == child.request_fd:
+                    self._flush(child)
+                elif key.fd == child.response_fd:
+                    self._read(child, closing=not stdin_open and not self.queue)
+            if STREAM_IDLE_SECONDS:
+                self._expire_sessions()
+
+        for request in self.queue:
+            self.send({"id": request.get("id"), "ok": False, "error": "No worker process is running"})
+        # Closing the request pipes lets every child finish and exit
+        for child in list(self.children.values()):
+            child.retiring = True
+            if child.request_fd is not None:
+                self._unwatch_writes(child)
+                os.close(child.request_fd)
+                child.request_fd = None
+        for child in list(self.children.values()):
+            os.waitpid(child.pid, 0)
+        return 0 if self.announced else 1
+
+    def _on_request_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            self.send({"ok": False, "error": f"Invalid JSON request: {str(e)}"})
+            return
+        if not isinstance(request, dict):
+            self.send({"ok": False, "error": "Request must be a JSON object"})
+            return
+        self.handle(request)
+
+
+def serve_prefork(processes):
+    """Answer JSON-lines requests with a pool of forked workers; returns the exit status."""
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    # Loading single-threaded means no OpenMP thread pool exists at fork time
+    # (libgomp's pool doesn't survive fork); every child sets its own count
+    torch.set_num_threads(1)
+    registry.preload(text_emotion=TEXT_EMOTIONS)
+    if tiering.ENABLED:
+        tiering.preload()  # Every tier's models are shared too, not loaded per child
+    try:
+        registry.prepare_for_fork()
+    except RuntimeError as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return 1
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the children don't write to (and un-share) those pages
+    gc.collect()
+    gc.freeze()
+
+    pool = _PreforkPool(processes, out)
+    if METRICS_PORT:
+        profiling.serve_prometheus(METRICS_PORT, pool.gauges, host=METRICS_HOST)
+    return pool.run(sys.stdin.fileno())
+
+# ============ BATCH MODE =============
+# `python process_audio.py --batch <dir|manifest.csv|manifest.jsonl> --output results.jsonl`
+# analyses many recordings with one set of loaded models. Manifests list one
+# recording per row/line with an "audioPath" (or "path") column and optional
+# patientName/patientAge/patientGender; a directory is scanned for audio files.
+# Each finished recording is appended to the output as one JSON line, so an
+# interrupted run continues where it stopped when re-run with --resume.
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".webm", ".ogg", ".flac", ".m4a")
+BATCH_PREFETCH = int(os.environ.get("THERAVOX_BATCH_PREFETCH", "2"))  # Recordings decoded ahead of inference
+
+def read_batch_source(source):
+    """Return the list of jobs described by a directory, CSV or JSONL manifest."""
+    if os.path.isdir(source):
+        return [
+            {"audioPath": os.path.join(root, name)}
+            for root, _, names in sorted(os.walk(source))
+            for name in sorted(names)
+            if name.lower().endswith(AUDIO_EXTENSIONS)
+        ]
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as f:
+        if source.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    jobs = []
+    for row in rows:
+        path = row.get("audioPath") or row.get("path")
+        if not path:
+            print(f"Skipping manifest row without a path: {row}", file=sys.stderr)
+            continue
+        row["audioPath"] = path if os.path.isabs(path) else os.path.join(base_dir, path)
+        jobs.append(row)
+    return jobs
+
+def _completed_paths(output_path):
+    """Paths that already have a successful result in an existing output file."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by an interruption
+            if record.get("ok"):
+                done.add(record["audioPath"])
+    return done
+
+def _prefetch(jobs, out_queue):
+    """Decode upcoming recordings on a background thread."""
+    for job in jobs:
+        try:
+            out_queue.put((job, decode_audio(job["audioPath"]), None))
+        except Exception as e:
+            out_queue.put((job, None, e))
+    out_queue.put(None)
+
+def run_batch(source, output_path, resume=False):
+    """Analyse every recording in source and append results to output_path as JSON lines."""
+    jobs = read_batch_source(source)
+    done = _completed_paths(output_path) if resume else set()
+    pending = [job for job in jobs if job["audioPath"] not in done]
+    print(f"Batch: {len(jobs)} recordings, {len(jobs) - len(pending)} already done, {len(pending)} to go", file=sys.stderr)
+
+    registry.preload(text_emotion=TEXT_EMOTIONS)
+    decoded = queue.Queue(maxsize=max(1, BATCH_PREFETCH))
+    threading.Thread(target=_prefetch, args=(pending, decoded), daemon=True).start()
+
+    if resume and os.path.exists(output_path):
+        # Make sure a line cut short by an interruption doesn't swallow the next record
+        with open(output_path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() and (f.seek(-1, os.SEEK_END), f.read(1))[1] != b"\n":
+                f.write(b"\n")
+
+    started = time.time()
+    succeeded = failed = 0
+    with open(output_path, "a" if resume else "w") as out:
+        while True:
+            item = decoded.get()
+            if item is None:
+                break
+            job, ctx, error = item
+            record = {"audioPath": job["audioPath"]}
+            try:
+                if error:
+                    raise error
+                record["result"] = analyze_audio(
+                    job["audioPath"],
+                    job.get("patientName") or "N/A",
+                    job.get("patientAge") or "N/A",
+                    job.get("patientGender") or "N/A",
+                    ctx=ctx,
+                )
+                record["ok"] = True
+                succeeded += 1
+            except Exception as e:
+                print(f"Error processing {job['audioPath']}: {str(e)}", file=sys.stderr)
+                record.update(ok=False, error=str(e))
+                failed += 1
+            out.write(json.dumps(record, cls=NumpyEncoder) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            print(f"Batch progress: {succeeded + failed}/{len(pending)}", file=sys.stderr)
+
+    elapsed = time.time() - started
+    print(f"Batch finished: {succeeded} ok, {failed} failed in {elapsed:.1f}s", file=sys.stderr)
+    return failed == 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyze a speech recording and print the result as JSON.",
+        usage="python process_audio.py <audio_file_path> [<patient_name>] [<patient_age>] [<patient_gender>]\n"
+              "       python process_audio.py --serve [--processes N]\n"
+              "       python process_audio.py --batch <dir|manifest.csv|manifest.jsonl> --output <results.jsonl> [--resume]",
+    )
+    parser.add_argument("audio_path", nargs="?")
+    parser.add_argument("patient_name", nargs="?", default="N/A")
+    parser.add_argument("patient_age", nargs="?", default="N/A")
+    parser.add_argument("patient_gender", nargs="?", default="N/A")
+    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
+    parser.add_argument("--check", action="store_true",
+                        help="report whether the required packages are installed, without importing them")
+    parser.add_argument("--serve", action="store_true", help="run as a JSON-lines worker on stdin/stdout")
+    parser.add_argument("--processes", type=int,
+                        help="worker mode: fork this many worker processes that share the loaded models "
+                             "(default: $THERAVOX_WORKER_PROCESSES or 1)")
+    parser.add_argument("--max-jobs-per-process", type=int,
+                        help="replace a forked worker after this many jobs, 0 = never "
+                             "(default: $THERAVOX_WORKER_MAX_JOBS or 100)")
+    parser.add_argument("--stream-idle-seconds", type=float,
+                        help="drop stream sessions without a request for this long, 0 = never "
+                             "(default: $THERAVOX_STREAM_IDLE_SECONDS or 300)")
+    parser.add_argument("--max-streams", type=int,
+                        help="open stream sessions per worker process, 0 = no limit (default: $THERAVOX_MAX_STREAMS or 16)")
+    parser.add_argument("--concurrency", type=int,
+                        help="analyze requests one --serve worker runs at once, sharing emotion batches "
+                             "(default: $THERAVOX_WORKER_CONCURRENCY or 1)")
+    parser.add_argument("--metrics-file", help="worker mode: rewrite this Prometheus text file after every request "
+                                                "(default: $THERAVOX_METRICS_FILE)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="worker mode: serve Prometheus metrics on this port (default: $THERAVOX_METRICS_PORT)")
+    parser.add_argument("--metrics-host",
+                        help="address the metrics port listens on (default: $THERAVOX_METRICS_HOST or 127.0.0.1)")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="write cProfile stats and a torch profiler trace for the job to DIR "
+                             "(the stages then run one after another)")
+    parser.add_argument("--batch", metavar="SOURCE", help="analyse a directory or CSV/JSONL manifest of recordings")
+    parser.add_argument("--output", help="JSONL results file for --batch")
+    parser.add_argument("--resume", action="store_true", help="skip recordings already in the --batch output")
+    parser.add_argument("--whisper-model", help="Whisper checkpoint (default: $THERAVOX_WHISPER_MODEL or base)")
+    parser.add_argument("--emotion-model", help="audio emotion model (default: $THERAVOX_EMOTION_MODEL)")
+    parser.add_argument("--device", help="cpu, cuda or auto (default: $THERAVOX_DEVICE or auto)")
+    parser.add_argument("--precision", choices=["fp32", "bf16", "int8"],
+                        help="model precision; int8 uses dynamic quantization on CPU (default: $THERAVOX_PRECISION or fp32)")
+    parser.add_argument("--emotion-backend", choices=["torch", "onnx"],
+                        help="run the emotion classifier in PyTorch or ONNX Runtime (default: $THERAVOX_EMOTION_BACKEND or torch)")
+    parser.add_argument("--preprocess", choices=sorted(preprocessing.PIPELINES),
+                        help="emotion preprocessing pipeline (default: $THERAVOX_PREPROCESS or fast)")
+    parser.add_argument("--timings", action="store_true", help="add per-stage wall/CPU timings to the output")
+    parser.add_argument("--sequential", action="store_true", help="run the analysis stages one after another")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write the result cache")
+    parser.add_argument("--whisper-language",
+                        help='language to transcribe in, or "auto" to detect it per window '
+                             "(default: $THERAVOX_WHISPER_LANGUAGE or en)")
+    parser.add_argument("--detect-language", action="store_true",
+                        help="also report the detected language when --whisper-language is fixed")
+    parser.add_argument("--text-emotions", action="store_true",
+                        help="also classify the emotions in each transcript segment (default: $THERAVOX_TEXT_EMOTIONS)")
+    parser.add_argument("--text-emotion-model",
+                        help="text emotion model (default: $THERAVOX_TEXT_EMOTION_MODEL or "
+                             f"{registry.DEFAULT_TEXT_EMOTION_MODEL})")
+    parser.add_argument("--tiering", action="store_true",
+                        help="pick a model tier per job from its duration, the backlog and --latency-slo "
+                             "(default: $THERAVOX_TIERING)")
+    parser.add_argument("--latency-slo", type=float,
+                        help="seconds one analysis should take with --tiering (default: $THERAVOX_LATENCY_SLO or 300)")
+    parser.add_argument("--tiers", nargs="+", choices=list(tiering.TIERS),
+                        help="tiers --tiering may pick (default: $THERAVOX_TIERS or all)")
+    parser.add_argument("--model-cache-mb", type=float,
+                        help="memory the loaded models may use, least recently used dropped first "
+                             "(default: $THERAVOX_MODEL_CACHE_MB or no limit)")
+    parser.add_argument("--whisper-batch-size", type=int,
+                        help="30s windows decoded per Whisper batch (default: $THERAVOX_WHISPER_BATCH_SIZE or 4)")
+    args = parser.parse_args(argv)
+    if args.batch and not args.output:
+        parser.error("--batch needs --output")
+    if not args.check and not args.serve and not args.batch and not args.audio_path:
+        parser.error("the audio file path is required")
+    return args
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2 or len(sys.argv) > 5:
-        print("Usage: python process_audio.py <audio_file_path> [<patient_name>] [<patient_age>] [<patient_gender>] ", file=sys.stderr)
+    args = parse_args()
+    if args.check:
+        missing = missing_modules()
+        print(json.dumps({"ok": not missing, "missing": missing, "version": __version__,
+                          "python": sys.version.split()[0]}))
+        sys.exit(1 if missing else 0)
+    if not check_dependencies():
         sys.exit(1)
-    
-    audio_path = sys.argv[1]
-    patient_name = sys.argv[2] if len(sys.argv) > 2 else "N/A"
-    patient_age = sys.argv[3] if len(sys.argv) > 3 else "N/A"
-    patient_gender = sys.argv[4] if len(sys.argv) > 4 else "N/A"
+    registry.configure(
+        whisper_model=args.whisper_model,
+        emotion_model=args.emotion_model,
+        device=args.device,
+        precision=args.precision,
+        emotion_backend=args.emotion_backend,
+        text_emotion_model=args.text_emotion_model,
+    )
+    if args.whisper_batch_size:
+        transcription.BATCH_SIZE = args.whisper_batch_size
+    if args.whisper_language:
+        transcription.LANGUAGE = args.whisper_language
+    if args.detect_language:
+        transcription.DETECT_LANGUAGE = True
+    if args.text_emotions:
+        TEXT_EMOTIONS = True
+    if args.tiering:
+        tiering.ENABLED = True
+    if args.latency_slo:
+        tiering.LATENCY_SLO = args.latency_slo
+    if args.tiers:
+        tiering.ALLOWED = args.tiers
+    if args.model_cache_mb is not None:
+        registry.MODEL_CACHE_MB = args.model_cache_mb
+    if args.preprocess:
+        preprocessing.DEFAULT_PIPELINE = args.preprocess
+    if args.no_cache:
+        result_cache.ENABLED = False
+    if args.timings:
+        REPORT_TIMINGS = True
+    if args.sequential:
+        PARALLEL_STAGES = False
+    if args.concurrency:
+        WORKER_CONCURRENCY = args.concurrency
+    if args.processes:
+        WORKER_PROCESSES = args.processes
+    if args.max_jobs_per_process is not None:
+        WORKER_MAX_JOBS = args.max_jobs_per_process
+    if args.stream_idle_seconds is not None:
+        STREAM_IDLE_SECONDS = args.stream_idle_seconds
+    if args.max_streams is not None:
+        MAX_STREAMS = args.max_streams
+    if args.metrics_file:
+        METRICS_FILE = args.metrics_file
+    if args.metrics_port:
+        METRICS_PORT = args.metrics_port
+    if args.metrics_host:
+        METRICS_HOST = args.metrics_host
 
-    if not os.path.exists(audio_path):
-        print(f"Error: Audio file not found: {audio_path}", file=sys.stderr)
+    if args.serve:
+        if WORKER_PROCESSES > 1:
+            sys.exit(serve_prefork(WORKER_PROCESSES))
+        serve()
+        sys.exit(0)
+
+    if args.batch:
+        sys.exit(0 if run_batch(args.batch, args.output, args.resume) else 1)
+
+    if not os.path.exists(args.audio_path):
+        print(f"Error: Audio file not found: {args.audio_path}", file=sys.stderr)
         sys.exit(1)
     
-    main(audio_path, patient_name, patient_age, patient_gender)
+    main(args.audio_path, args.patient_name, args.patient_age, args.patient_gender, profile_dir=args.profile)
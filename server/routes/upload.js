@@ -5,7 +5,7 @@ const path = require('path');
 const fs = require('fs');
 const auth = require('../middleware/auth');
 const Report = require('../models/Report');
-const { spawn } = require('child_process');
+const analysisQueue = require('../utils/analysisQueue');
 const { generateReportPDF } = require('../utils/pdfGenerator');
 const User = require('../models/User');
 
@@ -38,7 +38,129 @@ const upload = multer({
   }
 });
 
-// Upload audio file and generate report
+// Finished uploads are kept this long for the client to collect
+const RESULT_TTL_MS = parseInt(process.env.ANALYSIS_RESULT_TTL_MS || String(10 * 60 * 1000), 10);
+
+// Upload job id -> { userId, job, status, report, error }
+const uploads = new Map();
+
+// Save the analysis as a report with its PDF; resolves to the populated report
+async function saveReport({ patientId, doctorId, audioFile }, analysis) {
+  console.log('Analysis data received from Python worker:', analysis);
+
+  // Extract just the emotion names without percentages from audioEmotions
+  const emotionsToSave = Array.isArray(analysis.audioEmotions) 
+    ? analysis.audioEmotions.map(emotion => emotion.split(' (')[0].toLowerCase())
+    : [];
+
+  console.log('Emotions to save:', emotionsToSave);
+
+  // Create the report without the pdfPath initially
+  const report = new Report({
+    patient: patientId,
+    doctor: doctorId,
+    audioFile,
+    emotions: emotionsToSave,
+    transcript: analysis.transcript,
+    pitch: analysis.pitch,
+    pace: analysis.pace,
+    silence: analysis.silence,
+    summary: analysis.summary,
+  });
+
+  // Save the report to get the _id
+  console.log('Saving report with patient ID:', patientId);
+  await report.save();
+  console.log('Report saved successfully with ID:', report._id);
+
+  try {
+    // Generate PDF using the saved report
+    console.log('Generating PDF for report ID:', report._id);
+    const pdfPath = await generateReportPDF(report);
+    console.log('PDF generated successfully at:', pdfPath);
+
+    // Store the absolute path in the database
+    report.pdfPath = pdfPath;
+    await report.save();
+    console.log('Report updated with PDF path successfully');
+
+    // Verify PDF file exists and is readable
+    try {
+      await fs.promises.access(pdfPath, fs.constants.R_OK);
+      const stats = await fs.promises.stat(pdfPath);
+      console.log('PDF file verified:', {
+        path: pdfPath,
+        size: stats.size,
+        created: stats.birthtime,
+        modified: stats.mtime
+      });
+    } catch (err) {
+      console.error('PDF file verification failed:', err);
+      // Don't throw error here, just log it
+    }
+
+    // Populate the patient field before generating and sending the response
+    const populatedReport = await Report.findById(report._id)
+      .populate('patient', 'name age gender')
+      .populate('doctor', 'name');
+
+    // Now generate PDF with the populated report
+    console.log('Generating PDF with populated report for ID:', populatedReport._id);
+    // Note: generateReportPDF expects the full report object, not just path
+    const finalPdfPath = await generateReportPDF(populatedReport);
+    console.log('PDF regenerated with populated data at:', finalPdfPath);
+    
+    // Update report with final PDF path (should be the same, but good practice)
+    if (populatedReport.pdfPath !== finalPdfPath) {
+        populatedReport.pdfPath = finalPdfPath;
+        await populatedReport.save();
+        console.log('Report PDF path updated after regeneration.');
+    }
+    return populatedReport;
+  } catch (pdfError) {
+    console.error('Error generating PDF:', pdfError);
+    // Still return the report even if PDF generation fails
+    return report;
+  }
+}
+
+// Wait for the queued analysis in the background and record how it ended
+async function finishUpload(upload, details) {
+  try {
+    let analysis;
+    try {
+      analysis = await upload.job.promise;
+    } catch (err) {
+      console.error('Audio analysis failed:', err.message);
+      if (err.code === 'CANCELLED') {
+        upload.error = 'Audio processing was cancelled.';
+      } else if (err.code === 'TIMEOUT') {
+        upload.error = 'Audio processing timed out on the server.';
+      } else if (err.message.includes('ModuleNotFoundError')) {
+        upload.error = 'Required Python libraries not installed on the server.';
+      } else {
+        upload.error = 'Audio processing failed on the server.';
+      }
+      upload.status = 'failed';
+      return;
+    }
+
+    try {
+      upload.status = 'saving';
+      upload.report = await saveReport(details, analysis);
+      upload.status = 'done';
+    } catch (err) {
+      console.error('Error processing report:', err);
+      upload.error = 'Error processing report';
+      upload.status = 'failed';
+    }
+  } finally {
+    setTimeout(() => uploads.delete(upload.job.id), RESULT_TTL_MS).unref();
+  }
+}
+
+// Upload audio file and queue it for analysis. Answers 202 right away with the
+// job's place in the queue; GET /jobs/:id reports progress and, once done, the report.
 router.post('/audio', auth, upload.single('audio'), async (req, res) => {
   try {
     if (!req.file) {
@@ -68,132 +190,87 @@ router.post('/audio', auth, upload.single('audio'), async (req, res) => {
     const patientAge = patient ? patient.age : 'N/A';
     const patientGender = patient ? patient.gender : 'N/A';
 
-    // Process audio using Python script
-    console.log('Spawning Python process...');
-    const pythonScriptPath = path.join(__dirname, '../../ml/process_audio.py');
-    const audioFilePath = req.file.path;
-    
-    const pythonArgs = [
-      pythonScriptPath,
-      audioFilePath,
-      patientName,
-      patientAge,
-      patientGender
-    ];
-
-    const pythonProcess = spawn('python', pythonArgs);
-
-    let analysisData = '';
-    let errorData = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      analysisData += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      console.error('Python script stderr:', data.toString());
-      errorData += data.toString();
-    });
-
-    pythonProcess.on('close', async (code) => {
-      if (code !== 0) {
-        console.error('Python process exited with code', code);
-        console.error('Python process stderr output:', errorData);
-        if (errorData.includes('ModuleNotFoundError')) {
-          return res.status(500).json({ error: 'Required Python libraries not installed on the server.' });
-        }
-        return res.status(500).json({ error: 'Audio processing failed on the server.' });
-      }
-
-      try {
-        const analysis = JSON.parse(analysisData);
-        console.log('Analysis data received from Python script:', analysis);
-        
-        // Extract just the emotion names without percentages from audioEmotions
-        const emotionsToSave = Array.isArray(analysis.audioEmotions) 
-          ? analysis.audioEmotions.map(emotion => emotion.split(' (')[0].toLowerCase())
-          : [];
-
-        console.log('Emotions to save:', emotionsToSave);
-
-        // Create the report without the pdfPath initially
-        const report = new Report({
-          patient: req.body.patientId,
-          doctor: req.user.role === 'doctor' ? req.user.id : null,
-          audioFile: req.file.path,
-          emotions: emotionsToSave,
-          transcript: analysis.transcript,
-          pitch: analysis.pitch,
-          pace: analysis.pace,
-          silence: analysis.silence,
-          summary: analysis.summary,
+    // Queue the audio for the Python worker pool
+    let job;
+    try {
+      job = analysisQueue.submit({
+        audioPath: req.file.path,
+        patientName,
+        patientAge,
+        patientGender
+      });
+    } catch (err) {
+      if (err.code === 'QUEUE_FULL') {
+        console.warn('Analysis queue full, rejecting upload');
+        res.set('Retry-After', '30');
+        return res.status(429).json({
+          error: 'The server is busy analysing other recordings. Please try again shortly.',
+          status: 'queue-full',
+          queueDepth: err.depth
         });
-
-        // Save the report to get the _id
-        console.log('Saving report with patient ID:', req.body.patientId);
-        await report.save();
-        console.log('Report saved successfully with ID:', report._id);
-
-        try {
-          // Generate PDF using the saved report
-          console.log('Generating PDF for report ID:', report._id);
-          const pdfPath = await generateReportPDF(report);
-          console.log('PDF generated successfully at:', pdfPath);
-
-          // Store the absolute path in the database
-          report.pdfPath = pdfPath;
-          await report.save();
-          console.log('Report updated with PDF path successfully');
-
-          // Verify PDF file exists and is readable
-          try {
-            await fs.promises.access(pdfPath, fs.constants.R_OK);
-            const stats = await fs.promises.stat(pdfPath);
-            console.log('PDF file verified:', {
-              path: pdfPath,
-              size: stats.size,
-              created: stats.birthtime,
-              modified: stats.mtime
-            });
-          } catch (err) {
-            console.error('PDF file verification failed:', err);
-            // Don't throw error here, just log it
-          }
-
-          // Populate the patient field before generating and sending the response
-          const populatedReport = await Report.findById(report._id)
-            .populate('patient', 'name age gender')
-            .populate('doctor', 'name');
-
-          // Now generate PDF with the populated report
-          console.log('Generating PDF with populated report for ID:', populatedReport._id);
-          // Note: generateReportPDF expects the full report object, not just path
-          const finalPdfPath = await generateReportPDF(populatedReport);
-          console.log('PDF regenerated with populated data at:', finalPdfPath);
-          
-          // Update report with final PDF path (should be the same, but good practice)
-          if (populatedReport.pdfPath !== finalPdfPath) {
-              populatedReport.pdfPath = finalPdfPath;
-              await populatedReport.save();
-              console.log('Report PDF path updated after regeneration.');
-          }
-
-          console.log('Sending populated report:', populatedReport);
-          res.json(populatedReport);
-        } catch (pdfError) {
-          console.error('Error generating PDF:', pdfError);
-          // Still return the report even if PDF generation fails
-          res.json(report);
-        }
-      } catch (err) {
-        console.error('Error processing report:', err);
-        res.status(500).json({ error: 'Error processing report' });
       }
+      throw err;
+    }
+    console.log(`Analysis job ${job.id} queued at position ${job.position}`);
+
+    const entry = { userId: req.user.id, job, status: 'queued', report: null, error: null };
+    uploads.set(job.id, entry);
+    finishUpload(entry, {
+      patientId: req.body.patientId,
+      doctorId: req.user.role === 'doctor' ? req.user.id : null,
+      audioFile: req.file.path
     });
+
+    const statusUrl = `${req.baseUrl}/jobs/${job.id}`;
+    res.set('Location', statusUrl);
+    res.status(202).json({ jobId: job.id, status: 'queued', position: job.position, statusUrl });
   } catch (err) {
     console.error('Error uploading audio:', err);
     res.status(500).json({ error: 'Error uploading audio' });
   }
 });
 
+// Progress of an upload: queued (with its position), running, saving, done (with the report) or failed
+router.get('/jobs/:id', auth, (req, res) => {
+  const entry = uploads.get(req.params.id);
+  if (!entry || entry.userId !== req.user.id) {
+    return res.status(404).json({ error: 'Upload job not found' });
+  }
+  const body = { jobId: entry.job.id, status: entry.status };
+  if (entry.status === 'queued') {
+    const position = analysisQueue.position(entry.job);
+    if (position) {
+      body.position = position;
+      res.set('Retry-After', '5');
+    } else {
+      body.status = 'running';
+    }
+  } else if (entry.status === 'done') {
+    body.report = entry.report;
+  } else if (entry.status === 'failed') {
+    body.error = entry.error;
+  }
+  res.json(body);
+});
+
+// Cancel an upload that is still waiting or running
+router.delete('/jobs/:id', auth, (req, res) => {
+  const entry = uploads.get(req.params.id);
+  if (!entry || entry.userId !== req.user.id) {
+    return res.status(404).json({ error: 'Upload job not found' });
+  }
+  analysisQueue.cancel(entry.job);
+  res.status(204).end();
+});
+
+// Queue and worker pool status
+router.get('/health', auth, (req, res) => {
+  res.json(analysisQueue.stats());
+});
+
+// Queue depth and wait-time metrics in Prometheus text format (scrapers send a bearer token, as for /health)
+router.get('/metrics', auth, (req, res) => {
+  res.type('text/plain; version=0.0.4').send(analysisQueue.prometheus());
+});
+
 module.exports = router;
@@ -0,0 +1,171 @@
+const AnalysisWorker = require('./analysisWorker');
+
+const POOL_SIZE = parseInt(process.env.ANALYSIS_WORKERS || '1', 10);
+const MAX_QUEUED = parseInt(process.env.ANALYSIS_MAX_QUEUED || '10', 10);
+const JOB_TIMEOUT_MS = parseInt(process.env.ANALYSIS_JOB_TIMEOUT_MS || String(15 * 60 * 1000), 10);
+
+const jobError = (message, code, extra = {}) => Object.assign(new Error(message), { code }, extra);
+
+// Bounded queue in front of a fixed pool of Python analysis workers. Each
+// worker runs up to worker.slots jobs at a time (one idle slot per job it can
+// take); at most MAX_QUEUED jobs wait behind them and anything beyond that
+// is rejected so the caller can answer 429.
+class AnalysisQueue {
+  constructor({ poolSize = POOL_SIZE, maxQueued = MAX_QUEUED, timeoutMs = JOB_TIMEOUT_MS } = {}) {
+    this.workers = Array.from({ length: Math.max(1, poolSize) }, () => new AnalysisWorker());
+    this.idle = this.workers.flatMap((worker) => Array(worker.slots).fill(worker));
+    this.slots = this.idle.length;
+    this.waiting = [];
+    this.maxQueued = maxQueued;
+    this.timeoutMs = timeoutMs;
+    this.nextId = 1;
+    this.metrics = {
+      submitted: 0,
+      completed: 0,
+      failed: 0,
+      rejected: 0,
+      timedOut: 0,
+      cancelled: 0,
+      waitSecondsSum: 0,
+      waitSecondsMax: 0,
+      runSecondsSum: 0
+    };
+  }
+
+  // Queue a job; returns { id, position, promise } or throws a QUEUE_FULL error
+  submit(payload) {
+    if (this.waiting.length >= this.maxQueued) {
+      this.metrics.rejected++;
+      throw jobError('Analysis queue is full', 'QUEUE_FULL', { depth: this.waiting.length });
+    }
+
+    const job = {
+      id: String(this.nextId++),
+      payload,
+      status: 'queued',
+      enqueuedAt: Date.now()
+    };
+    job.promise = new Promise((resolve, reject) => {
+      job.resolve = resolve;
+      job.reject = reject;
+    });
+    job.timer = setTimeout(() => {
+      this.metrics.timedOut++;
+      this._abort(job, jobError(`Analysis timed out after ${this.timeoutMs} ms`, 'TIMEOUT'));
+    }, this.timeoutMs);
+
+    this.metrics.submitted++;
+    this.waiting.push(job);
+    this._dispatch();
+    job.position = this.position(job);
+    return job;
+  }
+
+  // 1-based place in the waiting line, or 0 once the job has started
+  position(job) {
+    return job.status === 'queued' ? this.waiting.indexOf(job) + 1 : 0;
+  }
+
+  cancel(job) {
+    if (job.status === 'done') return;
+    this.metrics.cancelled++;
+    this._abort(job, jobError('Analysis cancelled', 'CANCELLED'));
+  }
+
+  _abort(job, err) {
+    if (job.status === 'queued') {
+      this.waiting = this.waiting.filter((queued) => queued !== job);
+    } else if (job.status === 'running') {
+      // The Python worker can't be interrupted mid-job, so restart it. A client
+      // cancel leaves a worker that is also running other jobs alone; the
+      // result is dropped and the slot frees up once the job finishes.
+      if (err.code === 'TIMEOUT' || job.worker.inFlight <= 1) {
+        job.worker.kill();
+      }
+    }
+    this._finish(job, err);
+  }
+
+  _dispatch() {
+    while (this.idle.length && this.waiting.length) {
+      this._run(this.idle.pop(), this.waiting.shift());
+    }
+  }
+
+  async _run(worker, job) {
+    job.status = 'running';
+    job.worker = worker;
+    job.startedAt = Date.now();
+    const waitSeconds = (job.startedAt - job.enqueuedAt) / 1000;
+    this.metrics.waitSecondsSum += waitSeconds;
+    this.metrics.waitSecondsMax = Math.max(this.metrics.waitSecondsMax, waitSeconds);
+    console.log(`Analysis job ${job.id} started after waiting ${waitSeconds.toFixed(1)}s`);
+
+    try {
+      // The jobs still waiting let the worker trade model size for latency (THERAVOX_TIERING)
+      const result = await worker.analyze({ ...job.payload, backlog: this.waiting.length, slots: this.slots });
+      this._finish(job, null, result);
+    } catch (err) {
+      this._finish(job, err);
+    } finally {
+      this.idle.push(worker);
+      this._dispatch();
+    }
+  }
+
+  _finish(job, err, result) {
+    if (job.status === 'done') return;
+    const wasRunning = job.status === 'running';
+    job.status = 'done';
+    clearTimeout(job.timer);
+    if (wasRunning) {
+      this.metrics.runSecondsSum += (Date.now() - job.startedAt) / 1000;
+    }
+    if (err) {
+      this.metrics.failed++;
+      job.reject(err);
+    } else {
+      this.metrics.completed++;
+      job.resolve(result);
+    }
+  }
+
+  stats() {
+    return {
+      poolSize: this.workers.length,
+      slots: this.slots,
+      busy: this.slots - this.idle.length,
+      queued: this.waiting.length,
+      maxQueued: this.maxQueued,
+      workersRunning: this.workers.filter((worker) => worker.running).length,
+      ...this.metrics
+    };
+  }
+
+  // Prometheus text exposition format
+  prometheus() {
+    const s = this.stats();
+    const lines = [
+      ['analysis_pool_size', 'gauge', 'Number of Python analysis workers', s.poolSize],
+      ['analysis_slots', 'gauge', 'Jobs the pool can run at once', s.slots],
+      ['analysis_busy_workers', 'gauge', 'Jobs currently running on the workers', s.busy],
+      ['analysis_queue_depth', 'gauge', 'Jobs waiting for a worker', s.queued],
+      ['analysis_queue_capacity', 'gauge', 'Maximum jobs allowed to wait', s.maxQueued],
+      ['analysis_jobs_submitted_total', 'counter', 'Jobs accepted into the queue', s.submitted],
+      ['analysis_jobs_completed_total', 'counter', 'Jobs that finished successfully', s.completed],
+      ['analysis_jobs_failed_total', 'counter', 'Jobs that failed, timed out or were cancelled', s.failed],
+      ['analysis_jobs_rejected_total', 'counter', 'Jobs rejected because the queue was full', s.rejected],
+      ['analysis_jobs_timed_out_total', 'counter', 'Jobs aborted by the per-job timeout', s.timedOut],
+      ['analysis_jobs_cancelled_total', 'counter', 'Jobs cancelled by the client', s.cancelled],
+      ['analysis_queue_wait_seconds_sum', 'counter', 'Total time jobs spent waiting', s.waitSecondsSum],
+      ['analysis_queue_wait_seconds_max', 'gauge', 'Longest time a job spent waiting', s.waitSecondsMax],
+      ['analysis_run_seconds_sum', 'counter', 'Total time workers spent on jobs', s.runSecondsSum]
+    ];
+    return lines
+      .map(([name, type, help, value]) => `# HELP theravox_${name} ${help}\n# TYPE theravox_${name} ${type}\ntheravox_${name} ${value}`)
+      .join('\n') + '\n';
+  }
+}
+
+module.exports = new AnalysisQueue();
+module.exports.AnalysisQueue = AnalysisQueue;
@@ -0,0 +1,173 @@
+const { spawn } = require('child_process');
+const path = require('path');
+const readline = require('readline');
+
+const PYTHON_BIN = process.env.PYTHON_BIN || 'python';
+const SCRIPT_PATH = path.join(__dirname, '../../ml/process_audio.py');
+const WORKER_CONCURRENCY = parseInt(process.env.ANALYSIS_WORKER_CONCURRENCY || '1', 10);
+const WORKER_PROCESSES = parseInt(process.env.ANALYSIS_WORKER_PROCESSES || '1', 10);
+
+// Keeps one `process_audio.py --serve` process alive so the models are loaded
+// once instead of on every upload. Requests and responses are JSON lines
+// matched up by id. With concurrency > 1 the process runs that many analyze
+// requests at once and batches their emotion windows together. With
+// processes > 1 the Python side forks that many children sharing one copy of
+// the models, each running `concurrency` jobs, behind the same protocol.
+class AnalysisWorker {
+  constructor({ concurrency = WORKER_CONCURRENCY, processes = WORKER_PROCESSES } = {}) {
+    this.concurrency = Math.max(1, concurrency);
+    this.processes = Math.max(1, processes);
+    this.proc = null;
+    this.ready = null;
+    this.pending = new Map();
+    this.nextId = 1;
+    this.stderrTail = '';
+  }
+
+  start() {
+    if (this.ready) return this.ready;
+
+    console.log('Starting Python analysis worker...');
+    const args = [SCRIPT_PATH, '--serve', '--concurrency', String(this.concurrency)];
+    if (this.processes > 1) {
+      args.push('--processes', String(this.processes));
+    }
+    this.proc = spawn(PYTHON_BIN, args, { stdio: ['pipe', 'pipe', 'pipe'] });
+    this.stderrTail = '';
+
+    this.ready = new Promise((resolve, reject) => {
+      const lines = readline.createInterface({ input: this.proc.stdout });
+      lines.on('line', (line) => {
+        let message;
+        try {
+          message = JSON.parse(line);
+        } catch (err) {
+          console.error('Analysis worker sent invalid JSON:', line);
+          return;
+        }
+        if (message.event === 'ready') {
+          console.log('Analysis worker ready, pid', message.pid);
+          resolve(message);
+          return;
+        }
+        const job = this.pending.get(message.id);
+        if (!job) return;
+        this.pending.delete(message.id);
+        if (message.ok) {
+          job.resolve(message.result !== undefined ? message.result : message);
+        } else {
+          job.reject(new Error(message.error || 'Analysis failed'));
+        }
+      });
+
+      this.proc.stderr.on('data', (data) => {
+        const text = data.toString();
+        console.error('Python worker stderr:', text);
+        // Keep only the recent output around for error reporting
+        this.stderrTail = (this.stderrTail + text).slice(-8192);
+      });
+
+      // Writing to a worker that just died (killed, or crashed) fails with
+      // EPIPE; without a listener that error would take down the server
+      this.proc.stdin.on('error', (err) => {
+        console.error('Analysis worker stdin failed:', err.message);
+        for (const job of this.pending.values()) {
+          job.reject(err);
+        }
+        this.pending.clear();
+        this.kill();
+      });
+
+      this.proc.on('error', (err) => {
+        console.error('Failed to start analysis worker:', err);
+        reject(err);
+        this._reset(err);
+      });
+
+      this.proc.on('close', (code) => {
+        console.error('Analysis worker exited with code', code);
+        const err = new Error(`Analysis worker exited with code ${code}: ${this.stderrTail}`);
+        reject(err);
+        this._reset(err);
+      });
+    });
+
+    return this.ready;
+  }
+
+  _reset(err) {
+    for (const job of this.pending.values()) {
+      job.reject(err);
+    }
+    this.pending.clear();
+    this.proc = null;
+    this.ready = null;
+  }
+
+  async _send(payload) {
+    await this.start();
+    const id = String(this.nextId++);
+    return new Promise((resolve, reject) => {
+      this.pending.set(id, { resolve, reject });
+      this.proc.stdin.write(JSON.stringify({ ...payload, id }) + '\n', (err) => {
+        if (err && this.pending.delete(id)) {
+          reject(err);
+        }
+      });
+    });
+  }
+
+  analyze({ audioPath, patientName, patientAge, patientGender, backlog, slots }) {
+    return this._send({ op: 'analyze', audioPath, patientName, patientAge, patientGender, backlog, slots });
+  }
+
+  // Live recordings: open a session, send 16-bit PCM pieces as they arrive
+  // (each answer is the partial result) and finish to get the full result
+  async streamStart() {
+    const { sessionId } = await this._send({ op: 'stream-start' });
+    return sessionId;
+  }
+
+  streamChunk(sessionId, pcm, sampleRate = 16000) {
+    return this._send({ op: 'stream-chunk', sessionId, pcm: pcm.toString('base64'), sampleRate });
+  }
+
+  streamFinish(sessionId, { patientName, patientAge, patientGender } = {}) {
+    return this._send({ op: 'stream-finish', sessionId, patientName, patientAge, patientGender });
+  }
+
+  // Render finished analysis results to PDFs in the Python worker; resolves
+  // to one Buffer per report, so the caller can stream it without a temp file
+  async renderPdfs(reports) {
+    const { pdfs } = await this._send({ op: 'render-pdf', reports });
+    return pdfs.map((pdf) => Buffer.from(pdf, 'base64'));
+  }
+
+  health() {
+    return this._send({ op: 'health' });
+  }
+
+  // Abort whatever the worker is doing; pending jobs are rejected and the next
+  // request starts a fresh process
+  kill() {
+    if (this.proc) {
+      this.proc.kill('SIGKILL');
+    }
+  }
+
+  // Analyze jobs this worker runs at once
+  get slots() {
+    return this.concurrency * this.processes;
+  }
+
+  // Requests sent and not yet answered
+  get inFlight() {
+    return this.pending.size;
+  }
+
+  get running() {
+    return Boolean(this.proc);
+  }
+}
+
+module.exports = AnalysisWorker;
@@ -0,0 +1,109 @@
+"""
+The server's analysis queue (server/utils/analysisQueue.js): queue positions
+as jobs start and finish, the backlog handed to each worker, wait/run time
+accounting, the queue-full rejection and cancelling a waiting job.
+
+The queue runs in node with its Python workers replaced by fakes that finish
+when the script says so, on a clock the script moves by hand.
+
+    python -m pytest test_analysis_queue.py
+"""
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+QUEUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server", "utils", "analysisQueue.js")
+
+SCRIPT = r"""
+const { AnalysisQueue } = require(process.argv[1]);
+
+let now = 1000000;
+Date.now = () => now;
+console.log = () => {};
+
+const queue = new AnalysisQueue({ poolSize: 2, maxQueued: 3, timeoutMs: 60000 });
+const calls = [];
+for (const worker of queue.workers) {
+  worker.analyze = (payload) => new Promise((resolve) => calls.push({ payload, finish: resolve }));
+  worker.kill = () => {};
+}
+const settle = () => new Promise((resolve) => setImmediate(resolve));
+
+(async () => {
+  const out = {};
+  const jobs = ['a', 'b', 'c', 'd', 'e'].map((name) => queue.submit({ audioPath: name }));
+  out.submitted = jobs.map((job) => job.position);
+  try {
+    queue.submit({ audioPath: 'f' });
+  } catch (err) {
+    out.rejected = { code: err.code, depth: err.depth };
+  }
+  out.started = calls.map(({ payload }) => payload);
+
+  const cancelled = jobs[3].promise.catch((err) => err.code);
+  queue.cancel(jobs[3]);
+  out.cancelled = await cancelled;
+  out.afterCancel = jobs.map((job) => queue.position(job));
+
+  now += 5000;
+  calls[0].finish({ ok: 'a' });
+  out.result = await jobs[0].promise;
+  await settle();
+  out.afterFinish = jobs.map((job) => queue.position(job));
+  out.nextStarted = calls[2].payload;
+
+  now += 2000;
+  calls[1].finish({ ok: 'b' });
+  calls[2].finish({ ok: 'c' });
+  await settle();
+  now += 1000;
+  calls[3].finish({ ok: 'e' });
+  await Promise.all([jobs[1].promise, jobs[2].promise, jobs[4].promise]);
+  await settle();
+  out.stats = queue.stats();
+  out.prometheus = queue.prometheus();
+  console.info(JSON.stringify(out));
+})();
+"""
+
+
+@pytest.fixture(scope="module")
+def run():
+    node = shutil.which("node")
+    if node is None:
+        pytest.skip("node is not installed")
+    proc = subprocess.run([node, "-e", SCRIPT, QUEUE_PATH], capture_output=True, text=True, timeout=60)
+    assert proc.returncode == 0, proc.stderr
+    return json.loads(proc.stdout)
+
+
+def test_positions_and_backlog(run):
+    # Two slots take a and b; c, d and e wait in line
+    assert run["submitted"] == [0, 0, 1, 2, 3]
+    assert run["rejected"] == {"code": "QUEUE_FULL", "depth": 3}
+    # Each started as it was submitted, with nobody behind it yet
+    assert run["started"] == [{"audioPath": "a", "backlog": 0, "slots": 2},
+                              {"audioPath": "b", "backlog": 0, "slots": 2}]
+    assert run["cancelled"] == "CANCELLED"
+    assert run["afterCancel"] == [0, 0, 1, 0, 2]
+    # a finishing frees a slot for c, which leaves e waiting behind it
+    assert run["result"] == {"ok": "a"}
+    assert run["afterFinish"] == [0, 0, 0, 0, 1]
+    assert run["nextStarted"] == {"audioPath": "c", "backlog": 1, "slots": 2}
+
+
+def test_wait_and_run_accounting(run):
+    stats = run["stats"]
+    assert {key: stats[key] for key in ("submitted", "completed", "failed", "rejected", "cancelled")} == \
+           {"submitted": 5, "completed": 4, "failed": 1, "rejected": 1, "cancelled": 1}
+    # a and b started at once; c waited 5 s, e 7 s
+    assert stats["waitSecondsSum"] == 12
+    assert stats["waitSecondsMax"] == 7
+    # a 5 s, b 7 s, c 2 s, e 1 s
+    assert stats["runSecondsSum"] == 15
+    assert (stats["busy"], stats["queued"]) == (0, 0)
+    assert "theravox_analysis_queue_wait_seconds_sum 12\n" in run["prometheus"]
+    assert "theravox_analysis_jobs_rejected_total 1\n" in run["prometheus"]
@@ -0,0 +1,102 @@
+"""
+Offline batch mode (--batch): reading directories and manifests, one JSON line
+per recording, failures recorded without stopping the run, and --resume
+skipping what an interrupted run already finished.
+
+The analysis itself is stubbed out; decoding is real.
+
+    python -m pytest test_batch_mode.py
+"""
+import json
+
+import pytest
+import soundfile as sf
+
+import process_audio
+from benchmarks.synthetic import SAMPLE_RATE, speech_like
+from model import registry
+
+
+@pytest.fixture
+def recordings(tmp_path):
+    audio_dir = tmp_path / "audio"
+    (audio_dir / "nested").mkdir(parents=True)
+    paths = []
+    for i, name in enumerate(["b.wav", "a.wav", "nested/c.flac"]):
+        path = str(audio_dir / name)
+        sf.write(path, speech_like(1, seed=i), SAMPLE_RATE)
+        paths.append(path)
+    (audio_dir / "notes.txt").write_text("not audio")
+    return audio_dir, paths
+
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    calls = []
+
+    def analyze_audio(audio_path, patient_name="N/A", patient_age="N/A", patient_gender="N/A", ctx=None, **kwargs):
+        calls.append(audio_path)
+        if "broken" in audio_path:
+            raise RuntimeError("analysis failed")
+        return {"patientName": patient_name, "duration": ctx.duration}
+
+    monkeypatch.setattr(registry, "preload", lambda **kwargs: None)
+    monkeypatch.setattr(process_audio, "analyze_audio", analyze_audio)
+    return calls
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_read_directory_and_manifests(tmp_path, recordings):
+    audio_dir, paths = recordings
+    jobs = process_audio.read_batch_source(str(audio_dir))
+    assert [job["audioPath"] for job in jobs] == sorted(paths)
+
+    csv_path = tmp_path / "manifest.csv"
+    csv_path.write_text("path,patientName\naudio/a.wav,Ann\n,Nobody\n")
+    jobs = process_audio.read_batch_source(str(csv_path))
+    assert jobs == [{"path": "audio/a.wav", "patientName": "Ann", "audioPath": str(audio_dir / "a.wav")}]
+
+    jsonl_path = tmp_path / "manifest.jsonl"
+    jsonl_path.write_text(json.dumps({"audioPath": paths[0], "patientAge": 40}) + "\n\n")
+    assert process_audio.read_batch_source(str(jsonl_path)) == [{"audioPath": paths[0], "patientAge": 40}]
+
+
+def test_run_batch_records_every_recording(tmp_path, recordings, analyzed):
+    audio_dir, paths = recordings
+    broken = str(audio_dir / "broken.wav")
+    sf.write(broken, speech_like(1), SAMPLE_RATE)
+    missing = str(audio_dir / "missing.wav")
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text("".join(json.dumps({"audioPath": p, "patientName": "P"}) + "\n"
+                                for p in [*paths, broken, missing]))
+    output = str(tmp_path / "results.jsonl")
+
+    assert process_audio.run_batch(str(manifest), output) is False
+    records = read_records(output)
+    assert [record["audioPath"] for record in records] == [*paths, broken, missing]
+    assert [record["ok"] for record in records] == [True, True, True, False, False]
+    assert records[0]["result"] == {"patientName": "P", "duration": 1.0}
+    assert records[3]["error"] == "analysis failed"
+    assert missing not in analyzed  # Failed to decode, never analysed
+
+
+def test_resume_skips_finished_recordings(tmp_path, recordings, analyzed):
+    audio_dir, paths = recordings
+    output = tmp_path / "results.jsonl"
+    done = sorted(paths)[0]
+    # An earlier run finished one recording, failed one and was cut off mid-line
+    output.write_text(json.dumps({"audioPath": done, "ok": True, "result": {}}) + "\n"
+                      + json.dumps({"audioPath": sorted(paths)[1], "ok": False, "error": "x"}) + "\n"
+                      + '{"audioPath": "cut off')
+
+    assert process_audio.run_batch(str(audio_dir), str(output), resume=True) is True
+    assert sorted(analyzed) == sorted(paths)[1:]
+    lines = output.read_text().splitlines()
+    # The cut-off line was ended, so the new records start on lines of their own
+    assert lines[2] == '{"audioPath": "cut off'
+    records = [json.loads(line) for line in lines[:2] + lines[3:]]
+    assert {record["audioPath"] for record in records if record["ok"]} == set(paths)
@@ -0,0 +1,59 @@
+"""
+Cross-request micro-batching of emotion windows must hand every job the same
+probabilities it would get running its windows on its own.
+
+    python -m pytest test_batching.py
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import SAMPLE_RATE, speech_like
+from model import emotion
+from model.batching import MicroBatcher
+
+
+def unbatched(model, feature_extractor, y):
+    _, timeline, mean_probs = emotion.classify_windows(model, feature_extractor, y, SAMPLE_RATE, batch_size=1)
+    return timeline, mean_probs
+
+
+def test_concurrent_jobs_get_their_own_results(tiny_emotion_model):
+    model, feature_extractor = tiny_emotion_model
+    recordings = [speech_like(seconds, seed=i) for i, seconds in enumerate((4, 9, 6, 12))]
+    expected = [unbatched(model, feature_extractor, y) for y in recordings]
+
+    batcher = MicroBatcher(model, feature_extractor, max_items=8, max_wait_ms=20)
+
+    def batched(y):
+        _, timeline, mean_probs = emotion.classify_windows(model, feature_extractor, y, SAMPLE_RATE, batcher=batcher)
+        return timeline, mean_probs
+
+    with ThreadPoolExecutor(max_workers=len(recordings)) as pool:
+        results = list(pool.map(batched, recordings))
+
+    for (timeline, mean_probs), (expected_timeline, expected_mean) in zip(results, expected):
+        assert [(w["start"], w["end"], w["emotion"]) for w in timeline] == \
+               [(w["start"], w["end"], w["emotion"]) for w in expected_timeline]
+        np.testing.assert_allclose(mean_probs, expected_mean, atol=1e-3)
+
+    stats = batcher.stats()
+    windows = sum(len(timeline) for timeline, _ in expected)
+    assert stats["windows"] == windows
+    assert stats["requests"] == len(recordings)
+    assert max(int(size) for size in stats["batchSizes"]) <= 8
+    assert stats["batches"] < windows  # Windows did share forward passes
+
+
+def test_errors_do_not_stop_the_scheduler(tiny_emotion_model):
+    model, feature_extractor = tiny_emotion_model
+    batcher = MicroBatcher(model, feature_extractor, max_items=4, max_wait_ms=5)
+    window = speech_like(3)
+    # Wrong rank for the feature extractor: fails inside the scheduler thread
+    with pytest.raises(Exception):
+        batcher.classify([np.stack([window, window])], SAMPLE_RATE)
+    # The scheduler survives and keeps serving
+    assert batcher.classify([window], SAMPLE_RATE).shape == (1, len(model.config.id2label))
+    with pytest.raises(ValueError):
+        batcher.classify([window], 8000)
@@ -0,0 +1,47 @@
+"""
+The sliding-window emotion timeline must cover the whole recording, and
+batching windows together must not change what each window is classified as.
+
+    python -m pytest test_emotion.py
+"""
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import SAMPLE_RATE, speech_like
+from model import emotion
+
+
+@pytest.mark.parametrize("seconds", [0.5, 3.0, 3.2, 10.0, 61.7])
+def test_windows_cover_the_signal(seconds):
+    num_samples = int(seconds * SAMPLE_RATE)
+    window, starts = emotion.window_starts(num_samples, SAMPLE_RATE, window_seconds=3.0, hop_seconds=1.5)
+    assert starts[0] == 0
+    assert starts[-1] + window == num_samples
+    assert window == min(num_samples, 3 * SAMPLE_RATE)
+    assert np.all(np.diff(starts) <= int(1.5 * SAMPLE_RATE))
+
+
+def test_batch_size_does_not_change_results(tiny_emotion_model):
+    model, feature_extractor = tiny_emotion_model
+    y = speech_like(10, seed=3)
+    labels, one_by_one, mean_one = emotion.classify_windows(model, feature_extractor, y, SAMPLE_RATE, batch_size=1)
+    _, batched, mean_batched = emotion.classify_windows(model, feature_extractor, y, SAMPLE_RATE, batch_size=16)
+
+    assert labels == ["angry", "happy", "neutral", "sad"]
+    assert len(batched) == len(emotion.window_starts(len(y), SAMPLE_RATE)[1])
+    assert [(w["start"], w["end"], w["emotion"]) for w in batched] == \
+           [(w["start"], w["end"], w["emotion"]) for w in one_by_one]
+    for a, b in zip(batched, one_by_one):
+        # Scores are rounded to 0.1 %, so float noise can move one by a step
+        assert all(abs(a["scores"][label] - b["scores"][label]) <= 0.1 + 1e-9 for label in labels)
+    np.testing.assert_allclose(mean_batched, mean_one, atol=1e-3)
+    assert mean_batched.sum() == pytest.approx(100.0)
+
+
+def test_offset_shifts_the_timeline(tiny_emotion_model):
+    model, feature_extractor = tiny_emotion_model
+    y = speech_like(5, seed=4)
+    _, timeline, _ = emotion.classify_windows(model, feature_extractor, y, SAMPLE_RATE)
+    _, shifted, _ = emotion.classify_windows(model, feature_extractor, y, SAMPLE_RATE, offset=12.5)
+    assert [w["start"] + 12.5 for w in timeline] == pytest.approx([w["start"] for w in shifted])
+    assert shifted[-1]["end"] == pytest.approx(12.5 + len(y) / SAMPLE_RATE, abs=0.01)
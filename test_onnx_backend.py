@@ -0,0 +1,63 @@
+"""
+The ONNX Runtime emotion backend must give the same logits and probabilities
+as the PyTorch classifier it was exported from.
+
+The classifier is a tiny randomly initialised wav2vec2 (no download needed).
+Skipped when onnx, onnxruntime or transformers is not installed.
+
+    python -m pytest test_onnx_backend.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml"))
+
+import pytest
+import torch
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+transformers = pytest.importorskip("transformers")
+
+from model import onnx_backend
+
+
+def tiny_classifier():
+    torch.manual_seed(0)
+    config = transformers.Wav2Vec2Config(
+        hidden_size=32, num_hidden_layers=1, num_attention_heads=2, intermediate_size=64,
+        conv_dim=(16, 16), conv_stride=(5, 2), conv_kernel=(10, 3), num_feat_extract_layers=2,
+        num_conv_pos_embeddings=16, num_conv_pos_embedding_groups=2, num_labels=4,
+    )
+    return transformers.Wav2Vec2ForSequenceClassification(config).eval()
+
+
+@pytest.mark.parametrize("with_mask", [False, True])
+def test_onnx_matches_torch(tmp_path, with_mask):
+    model = tiny_classifier()
+    path = str(tmp_path / "emotion.onnx")
+    onnx_backend.export(model, path, with_mask)
+    session = onnx_backend.OnnxClassifier(path, model.config, threads=1)
+
+    torch.manual_seed(1)
+    # Other batch and sample sizes than the export's dummy input: the axes are dynamic
+    inputs = {"input_values": torch.randn(3, 24000) * 0.1}
+    if with_mask:
+        inputs["attention_mask"] = torch.ones(3, 24000, dtype=torch.long)
+    with torch.inference_mode():
+        expected = model(**inputs).logits
+    logits = session(**inputs).logits
+
+    assert logits.shape == expected.shape
+    torch.testing.assert_close(logits, expected, atol=1e-4, rtol=1e-4)
+    torch.testing.assert_close(torch.softmax(logits, dim=-1), torch.softmax(expected, dim=-1), atol=1e-5, rtol=1e-4)
+
+
+if __name__ == "__main__":
+    import tempfile
+    import pathlib
+
+    for with_mask in (False, True):
+        with tempfile.TemporaryDirectory() as workdir:
+            test_onnx_matches_torch(pathlib.Path(workdir), with_mask)
+    print("ONNX Runtime logits match PyTorch")
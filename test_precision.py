@@ -0,0 +1,59 @@
+"""
+Saved int8 models: a quantized model written to the cache must come back with
+the same outputs, without rebuilding it, and a cache file that isn't a plain
+state dict (e.g. a pickled module) must be ignored rather than unpickled.
+
+    python -m pytest test_precision.py
+"""
+import copy
+
+import torch
+
+from model import precision
+
+
+def test_quantized_classifier_round_trip(tmp_path, monkeypatch, tiny_emotion_model):
+    monkeypatch.setattr(precision, "QUANTIZED_DIR", str(tmp_path))
+    model, _ = tiny_emotion_model
+    builds = []
+
+    def build():
+        builds.append(1)
+        return precision.quantize_classifier(copy.deepcopy(model))
+
+    built = precision.load_quantized("emotion", "tiny/emotion", build)
+    loaded = precision.load_quantized("emotion", "tiny/emotion", build)
+    assert len(builds) == 1
+    assert loaded is not built
+    x = torch.randn(2, 16000)
+    with torch.inference_mode():
+        assert torch.equal(loaded(x).logits, built(x).logits)
+
+
+def test_quantized_whisper_round_trip(tmp_path, monkeypatch, small_whisper):
+    monkeypatch.setattr(precision, "QUANTIZED_DIR", str(tmp_path))
+    # Not a released checkpoint name, so no alignment heads table applies to the random model
+    built = precision.load_quantized("whisper", "random", lambda: precision.quantize_whisper(copy.deepcopy(small_whisper)))
+    loaded = precision.load_quantized("whisper", "random", lambda: None)  # Must not build
+    assert torch.equal(loaded.alignment_heads.to_dense(), built.alignment_heads.to_dense())
+    mel = torch.randn(1, 80, 3000)
+    with torch.inference_mode():
+        features = built.encoder(mel)
+        assert torch.equal(loaded.encoder(mel), features)
+        tokens = torch.tensor([[50258, 50259, 50359]])
+        assert torch.equal(loaded.decoder(tokens, features), built.decoder(tokens, features))
+
+
+def test_pickled_module_is_not_loaded(tmp_path, monkeypatch, tiny_emotion_model, capsys):
+    monkeypatch.setattr(precision, "QUANTIZED_DIR", str(tmp_path))
+    model, _ = tiny_emotion_model
+    quantized = precision.quantize_classifier(copy.deepcopy(model))
+    precision.load_quantized("emotion", "old", lambda: quantized)
+    # What earlier versions wrote: a whole module, which only a full unpickle can read
+    path = next(tmp_path.iterdir())
+    torch.save(torch.nn.Linear(2, 2), path)
+
+    rebuilt = precision.load_quantized("emotion", "old", lambda: quantized)
+    assert rebuilt is quantized
+    assert "Ignoring unreadable quantized model" in capsys.readouterr().err
+    assert set(torch.load(path, weights_only=True)) == {"meta", "state_dict"}
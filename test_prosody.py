@@ -0,0 +1,57 @@
+"""
+Prosody features: the numbers on known signals, and StreamingProsody fed in
+pieces giving exactly what extract() gives for the whole recording.
+
+    python -m pytest test_prosody.py
+"""
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import SAMPLE_RATE, speech_like, tone
+from model.utils import prosody
+
+
+def test_tone_pitch_and_pauses():
+    # 1 s of 200 Hz, 1 s of silence, 1 s of 200 Hz
+    y = np.concatenate((tone(1.0, 200.0), np.zeros(SAMPLE_RATE, np.float32), tone(1.0, 200.0)))
+    summary = prosody.extract(y, SAMPLE_RATE)["summary"]
+    assert summary["duration"] == 3.0
+    # Frames straddling the tone's edges pull the mean a little
+    assert summary["pitch"] == pytest.approx(200.0, rel=0.01)
+    assert summary["pauseCount"] == 1
+    assert summary["longestPause"] == pytest.approx(1.0, abs=0.05)
+    assert summary["silence"] == pytest.approx(1.0, abs=0.05)
+
+
+def test_silence_has_no_pitch():
+    summary = prosody.extract(np.zeros(SAMPLE_RATE, np.float32), SAMPLE_RATE)["summary"]
+    assert summary["pitch"] == 0.0
+    assert summary["voicedRatio"] == 0.0
+    assert summary["silenceRatio"] == 1.0
+
+
+@pytest.mark.parametrize("chunk_samples", [1, 160, 641, 16000, 48000])
+def test_streaming_matches_extract(chunk_samples):
+    y = speech_like(12 if chunk_samples > 1 else 1, seed=5)
+    expected = prosody.extract(y, SAMPLE_RATE)
+
+    stream = prosody.StreamingProsody(SAMPLE_RATE)
+    for start in range(0, len(y), chunk_samples):
+        partial = stream.feed(y[start:start + chunk_samples])
+    result = stream.finish()
+
+    for key, values in expected["frames"].items():
+        np.testing.assert_array_equal(result["frames"][key], values, err_msg=key)
+    assert result["summary"] == expected["summary"]
+    # The last feed already saw every complete frame
+    assert partial["duration"] == expected["summary"]["duration"]
+
+
+def test_streaming_shorter_than_a_frame():
+    y = speech_like(0.02, seed=6)
+    stream = prosody.StreamingProsody(SAMPLE_RATE)
+    stream.feed(y)
+    result = stream.finish()
+    expected = prosody.extract(y, SAMPLE_RATE)
+    np.testing.assert_array_equal(result["frames"]["rms_db"], expected["frames"]["rms_db"])
+    assert result["summary"] == expected["summary"]
@@ -0,0 +1,98 @@
+"""
+The content-hash result cache: what goes into a key, LRU eviction, and a
+repeated analysis being served without running the pipeline again.
+
+    python -m pytest test_result_cache.py
+"""
+import hashlib
+import itertools
+
+import soundfile as sf
+
+import process_audio
+from benchmarks.synthetic import SAMPLE_RATE, speech_like
+from model import tiering
+from model.utils import cache as result_cache
+from model.utils import preprocessing
+
+
+def test_file_digest(tmp_path):
+    path = tmp_path / "audio.bin"
+    path.write_bytes(b"x" * (3 << 20))
+    assert result_cache.file_digest(str(path), chunk_size=1 << 20) == hashlib.sha256(b"x" * (3 << 20)).hexdigest()
+
+
+def test_key_covers_audio_config_and_version(monkeypatch):
+    config = {"whisper_model": "base", "preprocess": "fast"}
+    key = result_cache.make_key("abc", config)
+    assert result_cache.make_key("abc", dict(reversed(list(config.items())))) == key
+    assert result_cache.make_key("abd", config) != key
+    assert result_cache.make_key("abc", {**config, "preprocess": "none"}) != key
+    monkeypatch.setattr(result_cache, "CACHE_VERSION", result_cache.CACHE_VERSION + 1)
+    assert result_cache.make_key("abc", config) != key
+
+
+def test_analysis_config_follows_settings(monkeypatch):
+    config = process_audio.analysis_config()
+    monkeypatch.setattr(preprocessing, "DEFAULT_PIPELINE", "none")
+    assert process_audio.analysis_config() != config
+    monkeypatch.undo()
+    assert process_audio.analysis_config() == config
+    # A tier is keyed on what it runs, not on the name or the numbers it was picked on
+    fast = process_audio.analysis_config(tiering.resolve("fast"))
+    assert fast != process_audio.analysis_config(tiering.resolve("accurate"))
+    assert process_audio.analysis_config(tiering.choose(10.0, backlog=500)) == fast
+
+
+def test_put_get_and_lru_eviction(tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(result_cache.time, "time", lambda: float(next(clock)))
+    cache = result_cache.ResultCache(str(tmp_path), max_bytes=10 ** 9)
+    assert cache.get("missing") is None
+    value = {"transcript": "hello", "pitch": 120.5, "emotionTimeline": [{"start": 0.0}]}
+    cache.put("a", value)
+    assert cache.get("a") == value
+
+    # Room for about two of these; "a" was read after "b" was written, so "b" goes first
+    blob_size = cache.stats()["bytes"]
+    cache.max_bytes = blob_size * 2
+    cache.put("b", {**value, "transcript": "b"})
+    cache.get("a")
+    cache.put("c", {**value, "transcript": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") == value
+    assert cache.get("c")["transcript"] == "c"
+    assert cache.stats()["entries"] == 2
+
+
+def test_repeated_analysis_is_served_from_the_cache(tmp_path, monkeypatch):
+    runs = []
+
+    def run_analysis(ctx, timings=None):
+        runs.append(ctx.duration)
+        return {"transcript": "hello there", "duration": ctx.duration,
+                "transcription": {"audioSeconds": ctx.duration, "wallSeconds": 0.4, "chunks": 1, "throughput": 5.0},
+                "preprocessing": {"pipeline": "fast", "offset": 0.0, "timings": {"trim": 0.01}}}
+
+    monkeypatch.setattr(result_cache, "ENABLED", True)
+    monkeypatch.setattr(result_cache, "_default", result_cache.ResultCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(tiering, "ENABLED", False)
+    monkeypatch.setattr(process_audio, "run_analysis", run_analysis)
+    path = str(tmp_path / "clip.wav")
+    sf.write(path, speech_like(2, seed=7), SAMPLE_RATE)
+
+    first = process_audio.analyze_audio(path, "Ann", report_timings=False)
+    second = process_audio.analyze_audio(path, "Bob", report_timings=False)
+    assert len(runs) == 1
+    assert second["transcript"] == first["transcript"] == "hello there"
+    assert (first["patientName"], second["patientName"]) == ("Ann", "Bob")
+    # The stored run times belong to the first job, so the hit doesn't report them
+    assert "cached" not in first and second["cached"] is True
+    assert second["transcription"] == {"audioSeconds": 2.0, "chunks": 1}
+    assert second["preprocessing"] == {"pipeline": "fast", "offset": 0.0}
+    assert first["transcription"]["wallSeconds"] == 0.4
+
+    # Other settings, other key
+    monkeypatch.setattr(preprocessing, "DEFAULT_PIPELINE", "none")
+    process_audio.analyze_audio(path, report_timings=False)
+    assert len(runs) == 2
@@ -0,0 +1,94 @@
+"""
+Live recordings: the streaming emotion classifier fed in pieces must give the
+timeline classify_windows() gives for the whole recording, and the worker's
+stream-* ops must cap, finish and expire their sessions.
+
+    python -m pytest test_streaming.py
+"""
+import base64
+
+import numpy as np
+import pytest
+
+import process_audio
+from benchmarks.synthetic import SAMPLE_RATE, speech_like
+from model import emotion, registry
+
+
+def new_state():
+    return {"started": 0, "jobs": 0, "failures": 0, "lock": process_audio.threading.Lock(), "streams": {}}
+
+
+@pytest.mark.parametrize("seconds, chunk_seconds", [(10.0, 0.25), (10.0, 1.7), (11.3, 4.0), (7.9, 30.0), (2.0, 0.5)])
+def test_streaming_classifier_matches_whole_recording(tiny_emotion_model, seconds, chunk_seconds):
+    model, feature_extractor = tiny_emotion_model
+    y = speech_like(seconds, seed=8)
+    _, expected, expected_mean = emotion.classify_windows(model, feature_extractor, y, SAMPLE_RATE)
+
+    stream = emotion.StreamingClassifier(model, feature_extractor, SAMPLE_RATE)
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+    fed = []
+    for start in range(0, len(y), chunk):
+        fed += stream.feed(y[start:start + chunk])
+        # Only about a window of audio is held between feeds
+        assert len(stream.buffer) <= stream.window + chunk
+    fed += stream.finish()
+
+    assert fed == stream.timeline
+    assert [(w["start"], w["end"], w["emotion"]) for w in fed] == \
+           [(w["start"], w["end"], w["emotion"]) for w in expected]
+    np.testing.assert_allclose(stream.mean_probs(), expected_mean, atol=1e-3)
+
+
+def test_stream_session_round_trip(monkeypatch, tiny_emotion_model, small_whisper):
+    monkeypatch.setattr(registry, "get_whisper", lambda: small_whisper)
+    monkeypatch.setattr(registry, "get_emotion_model", lambda: tiny_emotion_model)
+    monkeypatch.setattr(process_audio, "TEXT_EMOTIONS", False)
+    state = new_state()
+
+    started = process_audio._handle_stream({"op": "stream-start", "sessionId": "s1"}, state)
+    assert started == {"ok": True, "sessionId": "s1"}
+    y = speech_like(8, seed=9)
+    pcm = (np.clip(y, -1, 1) * 32767).astype("<i2")
+    received = []
+    for start in range(0, len(pcm), 3 * SAMPLE_RATE):
+        response = process_audio._handle_stream(
+            {"op": "stream-chunk", "sessionId": "s1", "pcm": base64.b64encode(pcm[start:start + 3 * SAMPLE_RATE].tobytes()).decode("ascii")},
+            state,
+        )
+        assert response["ok"], response
+        received.append(response["result"]["received"])
+    assert received == [3.0, 6.0, 8.0]
+
+    finished = process_audio._handle_stream({"op": "stream-finish", "sessionId": "s1", "patientName": "Ann"}, state)
+    assert finished["ok"], finished
+    result = finished["result"]
+    assert result["patientName"] == "Ann"
+    assert result["prosody"]["duration"] == 8.0
+    assert result["emotionTimeline"][-1]["end"] == pytest.approx(8.0, abs=0.01)
+    assert state["streams"] == {}
+    assert process_audio._handle_stream({"op": "stream-chunk", "sessionId": "s1", "pcm": ""}, state)["ok"] is False
+
+
+class IdleSession:
+    """Stands in for StreamingSession where only the bookkeeping is under test."""
+
+    def __init__(self):
+        self.last_used = process_audio.time.time()
+
+
+def test_stream_limit_and_idle_expiry(monkeypatch):
+    monkeypatch.setattr(process_audio, "StreamingSession", IdleSession)
+    monkeypatch.setattr(process_audio, "MAX_STREAMS", 2)
+    monkeypatch.setattr(process_audio, "STREAM_IDLE_SECONDS", 60.0)
+    state = new_state()
+
+    for session_id in ("a", "b"):
+        assert process_audio._handle_stream({"op": "stream-start", "sessionId": session_id}, state)["ok"]
+    refused = process_audio._handle_stream({"op": "stream-start", "sessionId": "c"}, state)
+    assert refused["ok"] is False and "Too many" in refused["error"]
+
+    state["streams"]["a"].last_used -= 61
+    process_audio._expire_streams(state)
+    assert list(state["streams"]) == ["b"]
+    assert process_audio._handle_stream({"op": "stream-start", "sessionId": "c"}, state)["ok"]
@@ -0,0 +1,88 @@
+"""
+Per-job model tiers: which tier a job gets for its length and the backlog,
+learning a tier's cost from finished jobs, and a cached result from a more
+accurate tier being served instead of running a faster one.
+
+    python -m pytest test_tiering.py
+"""
+import pytest
+import soundfile as sf
+
+import process_audio
+from benchmarks.synthetic import SAMPLE_RATE, speech_like
+from model import tiering
+from model.utils import cache as result_cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_tiers(monkeypatch):
+    # Learned costs and job counts are process-wide; start every test from the estimates
+    monkeypatch.setattr(tiering, "_costs", {name: tier["cost"] for name, tier in tiering.TIERS.items()})
+    monkeypatch.setattr(tiering, "_jobs", {name: 0 for name in tiering.TIERS})
+    monkeypatch.setattr(tiering, "ALLOWED", list(tiering.TIERS))
+    monkeypatch.setattr(tiering, "LATENCY_SLO", 300.0)
+
+
+def test_choose_follows_the_backlog():
+    # 60 s of audio: accurate takes 2 + 0.45 * 60 = 29 s, standard 11 s, fast 6.8 s
+    assert tiering.choose(60.0)["name"] == "accurate"
+    assert tiering.choose(60.0, backlog=9, slots=1)["name"] == "accurate"  # Budget 30 s
+    assert tiering.choose(60.0, backlog=10, slots=1)["name"] == "standard"  # Budget 27.3 s
+    assert tiering.choose(60.0, backlog=20, slots=2)["name"] == "standard"  # Slots share the backlog
+    tier = tiering.choose(60.0, backlog=100, slots=1)
+    # Nothing fits 2.97 s, so the fastest tier runs
+    assert tier["name"] == "fast"
+    assert tier["policy"] == {"durationSeconds": 60.0, "backlog": 100, "slots": 1, "sloSeconds": 300.0,
+                              "budgetSeconds": 2.97, "predictedSeconds": 6.8}
+
+
+def test_only_allowed_tiers_are_picked(monkeypatch):
+    monkeypatch.setattr(tiering, "ALLOWED", ["standard", "accurate"])
+    assert tiering.choose(60.0, backlog=100)["name"] == "standard"
+    assert tiering.at_least("standard") == ["accurate", "standard"]
+    assert tiering.at_least("fast") == ["fast"]
+    monkeypatch.setattr(tiering, "ALLOWED", ["turbo"])
+    assert tiering.allowed_tiers() == ["standard"]
+
+
+def test_at_least_is_most_accurate_first():
+    assert tiering.at_least("fast") == ["accurate", "standard", "fast"]
+    assert tiering.at_least("accurate") == ["accurate"]
+
+
+def test_record_learns_from_long_jobs():
+    # 100 s of audio in 27 s observes 0.25 s per second; the estimate moves 30 % of the way
+    tiering.record("standard", 100.0, 27.0)
+    assert tiering.stats()["standard"] == {"jobs": 1, "cost": pytest.approx(0.18)}
+    tiering.record("standard", 5.0, 100.0)  # Too short to learn from
+    tiering.record("configured", 100.0, 1.0)  # Not a tier
+    assert tiering.stats()["standard"] == {"jobs": 2, "cost": pytest.approx(0.18)}
+    assert tiering.choose(60.0, backlog=20)["name"] == "standard"  # 12.8 s fits a 14.3 s budget
+    # A slow job (0.6 s per second) lifts the estimate to 0.306, and the same job drops to fast
+    tiering.record("standard", 100.0, 62.0)
+    assert tiering.stats()["standard"]["cost"] == pytest.approx(0.306)
+    assert tiering.choose(60.0, backlog=20)["name"] == "fast"
+
+
+def test_cached_result_from_a_more_accurate_tier(tmp_path, monkeypatch):
+    tiers_run = []
+
+    def run_analysis(ctx, timings=None):
+        tiers_run.append(tiering.current()["name"])
+        return {"transcript": tiers_run[-1], "duration": ctx.duration}
+
+    monkeypatch.setattr(tiering, "ENABLED", True)
+    monkeypatch.setattr(result_cache, "ENABLED", True)
+    monkeypatch.setattr(result_cache, "_default", result_cache.ResultCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(process_audio, "run_analysis", run_analysis)
+    path = str(tmp_path / "clip.wav")
+    sf.write(path, speech_like(2, seed=11), SAMPLE_RATE)
+
+    busy = process_audio.analyze_audio(path, report_timings=False, backlog=10_000, slots=1)
+    assert busy["tier"]["name"] == "fast"
+    idle = process_audio.analyze_audio(path, report_timings=False)
+    assert idle["tier"]["name"] == "accurate"
+    # Under load again: the accurate result is on hand, so nothing runs
+    again = process_audio.analyze_audio(path, report_timings=False, backlog=10_000, slots=1)
+    assert tiers_run == ["fast", "accurate"]
+    assert again["transcript"] == "accurate"
@@ -0,0 +1,53 @@
+"""
+Two analyze requests running at once on one worker (--serve --concurrency 2)
+must get the same transcripts as when they run one after the other.
+
+Whisper weights are random (no download needed) and the audio emotion stage is
+left out; the point is the shared Whisper model, not the transcript quality.
+
+    python -m pytest test_worker_concurrency.py
+"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml"))
+
+import pytest
+import soundfile as sf
+
+import process_audio
+from benchmarks.synthetic import SAMPLE_RATE, speech_like
+from model import registry
+
+
+def test_concurrent_analyze(tmp_path, monkeypatch, small_whisper):
+    config = registry.get_config()
+    monkeypatch.setitem(registry._models,
+                        ("whisper", config["whisper_model"], registry.get_device(), config["precision"]), small_whisper)
+    monkeypatch.setattr(process_audio.result_cache, "ENABLED", False)
+    monkeypatch.setattr(process_audio, "detect_emotions_detailed",
+                        lambda audio: {"emotions": [], "timeline": [], "preprocessing": {}})
+
+    requests = []
+    for i, seconds in enumerate((40, 12)):
+        path = str(tmp_path / f"clip-{i}.wav")
+        sf.write(path, speech_like(seconds, seed=i, pitch=110 + 40 * i), SAMPLE_RATE)
+        requests.append({"op": "analyze", "audioPath": path})
+    state = {"started": 0, "jobs": 0, "failures": 0, "lock": process_audio.threading.Lock(), "streams": {}}
+
+    def analyze(request):
+        response = process_audio._handle_request(request, state)
+        assert response["ok"], response
+        return response["result"]["transcriptSegments"]
+
+    sequential = [analyze(request) for request in requests]
+    assert all(sequential), "the clips should produce some (random) text"
+    for _ in range(3):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            concurrent = list(pool.map(analyze, requests))
+        assert concurrent == sequential
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))